@@ -63,7 +63,11 @@ class ArchyState:
         self._initQuasiModeTextLayer()
         
         self.keyState.start()
+
+        import glyph_atlas
+        glyph_atlas.loadCached()
         self.loadContent()
+        glyph_atlas.install(self.stylePool)
     
     def bindToScreen(self, screen = None):
         self.screenSurface = screen
@@ -19,8 +19,7 @@
 VERSION = "$Id: behavior.hpy,v 1.17 2005/04/03 05:16:33 azaraskin Exp $"
 
 import copy
-# Until the bugs get sorted out, use a regular list.
-#import run_length_list
+import run_length_list
 
 # Needed Pools:
 # 1) The Command Pool for the raw Add, Style, and Delete commands. Each
@@ -82,11 +81,39 @@ class ActionPool(Pool):
         print self.pool
         print self.commandPool.pool
 
+# Behaviors are never modified once they are in the pool, so everything
+# the BehaviorArray asks about a behavior (see BehaviorCapabilities) is
+# worked out once, when the behavior is interned, and kept in
+# _capabilities alongside the pool. The pool is also indexed by behavior,
+# and merge/remove results are memoised, so the hot paths never search the
+# pool or copy a behavior.
+
 class BehaviorPool(Pool):
     def __init__(self, bArray):
         self.pool = []
         self._bArray = bArray
         self.actionPool = ActionPool(self)
+        self.buildCapabilities()
+
+# The following method (re)builds the capability table and the lookup
+# caches from the pool. The caches are not pickled, so this is also called
+# once a pickled BehaviorArray has been fully restored.
+
+    def buildCapabilities(self):
+        self._capabilities = []
+        self._index = {}
+        self._mergeCache = {}
+        self._removeCache = {}
+        for ID in range(len(self.pool)):
+            self._index[tuple(self.pool[ID])] = ID
+            self._capabilities.append(BehaviorCapabilities(self, self.pool[ID]))
+
+    def __getstate__(self):
+        odict = self.__dict__.copy()
+        for cache in ['_capabilities', '_index', '_mergeCache', '_removeCache']:
+            if odict.has_key(cache):
+                del odict[cache]
+        return odict
 
     def getActionID(self, **args):
         return self.actionPool.getActionID(**args)
@@ -94,15 +121,32 @@ class BehaviorPool(Pool):
     def getBehaviorID(self, actionIDs):
         if type(actionIDs) == int:
             actionIDs = [actionIDs]
-        return self.getElementID(actionIDs)
+        try:
+            return self._index[tuple(actionIDs)]
+        except KeyError:
+            pass
+        self.pool.append(list(actionIDs))
+        ID = len(self.pool)-1
+        self._index[tuple(actionIDs)] = ID
+        self._capabilities.append(BehaviorCapabilities(self, actionIDs))
+        return ID
 
     def getBehavior(self, ID):
         return copy.deepcopy(self.pool[ID])
 
+    def getCapabilities(self, ID):
+        return self._capabilities[ID]
+
     def merge(self, oldID, newAction):
-        newBehavior = copy.deepcopy(self.getBehavior(oldID))
+        try:
+            return self._mergeCache[(oldID, newAction)]
+        except KeyError:
+            pass
+        newBehavior = self.getBehavior(oldID)
         newBehavior.insert(0, newAction)
-        return self.getBehaviorID(newBehavior)
+        newID = self.getBehaviorID(newBehavior)
+        self._mergeCache[(oldID, newAction)] = newID
+        return newID
 
 # For a number of reasons we store command instances in the command pool
 # instead of command objects. However, when we remove a command we do
@@ -115,6 +159,10 @@ class BehaviorPool(Pool):
 # the particular instance of the commands]) that action persists in the
 # action pool. It shouldn't.
     def remove(self, oldID, actionToRemove):
+        try:
+            return self._removeCache[(oldID, actionToRemove)]
+        except KeyError:
+            pass
         newBehavior = self.getBehavior(oldID)
 
         try:
@@ -122,7 +170,9 @@ class BehaviorPool(Pool):
         except ValueError:
             pass #the action is not a part of the behavior
             #print "  value error: could not remove", actionToRemove
-        return self.getBehaviorID(newBehavior)
+        newID = self.getBehaviorID(newBehavior)
+        self._removeCache[(oldID, actionToRemove)] = newID
+        return newID
 
     def has(self, oldID, action):
         theBehavior = self.getBehavior(oldID)
@@ -144,6 +194,52 @@ class BehaviorPool(Pool):
     def show(self):
         self.actionPool.show()
         print self.pool
+
+# --------------------------
+# Behavior capabilities
+# --------------------------
+
+# A BehaviorCapabilities record holds, for one behavior:
+#  commands: a dictionary from each BehaviorArray key ('add', 'delete', ...)
+#     to the tuple of that key's commands, in action order, without Nones.
+#  allCommands: the add, delete, style, focus and unfocus commands of every
+#     action, in action order.
+#  actionNames: a dictionary whose keys are the behaviorName()s of the
+#     behavior's commands.
+#  overridesDelete, overridesStyle: whether any delete (style) command of
+#     the behavior has its stop bit set.
+
+class BehaviorCapabilities:
+    def __init__(self, behaviorPool, actionIDs):
+        keys = behaviorPool._bArray.keys
+        actions = map(behaviorPool.actionPool.getCommands, actionIDs)
+
+        self.commands = {}
+        for num in range(len(keys)):
+            self.commands[keys[num]] = tuple(filter(lambda c:c <> None, [action[num] for action in actions]))
+
+        allKeys = map(keys.index, ['add', 'delete', 'style', 'focus', 'unfocus'])
+        allCommands = []
+        for action in actions:
+            for num in allKeys:
+                allCommands.append(action[num])
+        self.allCommands = tuple(filter(lambda c:c <> None, allCommands))
+
+        #The filter removes the commands which do not have the behaviorName() method.
+        #In other words, it removes the default AddText, StyleText, and DeleteText commands
+        #which have the name() method because they are full fledged commands.
+        self.actionNames = {}
+        for aCommand in filter(lambda c:'behaviorName' in dir(c), self.allCommands):
+            self.actionNames[aCommand().behaviorName()] = 1
+
+        self.overridesDelete = self._anyStopBit(self.commands['delete'])
+        self.overridesStyle = self._anyStopBit(self.commands['style'])
+
+    def _anyStopBit(self, commandList):
+        for aCommand in commandList:
+            if aCommand().stopBit():
+                return 1
+        return 0
            
 
 # --- --- ---
@@ -197,6 +293,15 @@ class UnfocusCommand(AbstractCommand):
 
 # TODO: This class and the StyleArray class should be subclasses of an
 # abstract class. As it stands, there is a good deal of code overlap.
+
+# The behavior IDs are stored run length encoded, like the style numbers
+# of the StyleArray. Behaviors change rarely along the text, so the queries
+# below (extents, ranges, deletable/styleable ranges) walk the runs rather
+# than the individual characters.
+
+# What we need to know about a behavior (the names of its actions, whether
+# it overrides deleting or styling, its commands for each key) is looked
+# up in the capability table of the behavior pool.
 class BehaviorArray:
     def __init__(self, associatedTextArray=None):
         self.keys = ['add', 'delete', 'style', 'focus', 'unfocus', 'storage']
@@ -208,9 +313,8 @@ class BehaviorArray:
         import commands.style_editing
         self.behaviorPool = BehaviorPool(self)
 
-        self._array = []
-# Until the bugs get sorted out, use a regular list.
-        #self._array = run_length_list.RLE_List()
+        self._array = run_length_list.RLE_List()
+        self._journal = None
 # TO DO: this next line should really aboid importing these modules, and instead call on the pool of behaviors
         defaultAction = self.behaviorPool.getActionID(add =commands.text_editing.SimpleAddTextCommand, \
                                         delete = commands.text_editing.SimpleDeleteTextCommand, \
@@ -220,8 +324,7 @@ class BehaviorArray:
         #As the default behavior is defined first it should have the ID of 0.
 
         if associatedTextArray:
-            for i in range(associatedTextArray.getLength()):
-                self._array.insert(i, self.defaultBehavior)
+            self._array.insert(0, self.defaultBehavior, associatedTextArray.getLength())
                 
         self.registerHardcodedBehaviors()
 
@@ -268,6 +371,8 @@ class BehaviorArray:
             self.behavior_equiv[behaviorName].append(self._toDictForm(self.behavior_dict[behaviorName]))
         self.behavior_dict[behaviorName][self.keys.index('storage')] = storage
         self.behavior_equiv[behaviorName].append(self._toDictForm(self.behavior_dict[behaviorName]))
+        if self._journal:
+            self._journal.recordRegistryChange()
 
     def getBehaviorEquivalence(self, behaviorName):
         if self.behavior_equiv.has_key(behaviorName):
@@ -276,81 +381,96 @@ class BehaviorArray:
             return None
 
     def behaviorHasAction(self, ID, name):
-        #The filter removes the commands which do not have the behaviorName() method.
-        #In other words, it removes the default AddText, StyleText, and DeleteText commands
-        #which have the name() method because they are full fledged commands.
-        behaviorCommands = filter(lambda c:'behaviorName' in dir(c), self._getAllCommands(ID))
-        return name in map(lambda c:c().behaviorName(), behaviorCommands)
+        return self.behaviorPool.getCapabilities(ID).actionNames.has_key(name)
 
     def _behaviorOverridesDelete(self, ID):
-        for aCommand in self._getBlankCommands(ID, [self.keys.index('delete')] ):
-            if aCommand().stopBit():
-                return 1
-        return 0
+        return self.behaviorPool.getCapabilities(ID).overridesDelete
 
     def _behaviorOverridesStyle(self, ID):
-        for aCommand in self._getBlankCommands(ID, [self.keys.index('style')]):
-            if aCommand().stopBit():
-                return 1
-        return 0
+        return self.behaviorPool.getCapabilities(ID).overridesStyle
 
     def __getstate__(self):
-        import commands
-
         odict = self.__dict__.copy()
-        odict['_array'] = commands.save_and_load.compressList( odict['_array'] )
+        odict['_array'] = self._array.getRuns()
+        odict['_journal'] = None
         return odict
 
     def __setstate__(self, dict):
-        import commands
-
         self.__dict__.update(dict)
-        self._array = commands.save_and_load.decompressList(self._array)
+        runs = self._array
+        self._array = run_length_list.RLE_List()
+        self._array.insertRuns(0, runs)
+        self.behaviorPool.buildCapabilities()
 
     def isValidPos(self, pos):
         return pos >= 0 and pos < len(self._array)
 
+# The journal (see journal.py) is given the behavior runs of every range
+# whose behaviors change.
+
+    def setJournal(self, journal):
+        self._journal = journal
+
+    def _journalRange(self, startPos, endPos):
+        if self._journal:
+            self._journal.recordBehaviors(max(startPos, 0), self._array.getRuns(startPos, endPos+1))
+
+# Overwrites the behaviors starting at startPos with a list of (run length,
+# behavior ID) tuples, as returned by getRuns().
+
+    def setRuns(self, startPos, runs):
+        self._array.replaceRuns(startPos, runs)
+
+# The following two methods merge (or remove) the action once per behavior
+# run in the range, rather than once per character.
+
     def addActionInRange(self, action, startPos, endPos):
-        for pos in range(startPos, endPos + 1):
-            if self.isValidPos(pos):
-                 oldBehaviorID = self._array[pos]
-                 self._array[pos] = self.behaviorPool.merge(oldBehaviorID, action)
+        pos = max(startPos, 0)
+        for runLength, oldBehaviorID in self._array.getRuns(startPos, endPos+1):
+            self._array.setRange(pos, pos+runLength, self.behaviorPool.merge(oldBehaviorID, action))
+            pos += runLength
+        self._journalRange(startPos, endPos)
 
     def removeActionInRange(self, action, startPos, endPos):
-        for pos in range(startPos, endPos + 1):
-            if self.isValidPos(pos):
-                oldBehaviorID = self._array[pos]
-                self._array[pos] = self.behaviorPool.remove(oldBehaviorID, action)
+        pos = max(startPos, 0)
+        for runLength, oldBehaviorID in self._array.getRuns(startPos, endPos+1):
+            self._array.setRange(pos, pos+runLength, self.behaviorPool.remove(oldBehaviorID, action))
+            pos += runLength
+        self._journalRange(startPos, endPos)
 
     def findActionExtent(self, actionName, pos):
-        startPos = pos
-        while self.behaviorHasAction(self._array[startPos], actionName):
-            startPos -= 1
-            if not self.isValidPos(startPos):
+        if not self.behaviorHasAction(self._array[pos], actionName):
+            return pos+1, pos-1
+
+        startPos, endPos, behaviorID = self._array.getRunAt(pos)
+        while startPos > 0:
+            runStart, runEnd, behaviorID = self._array.getRunAt(startPos-1)
+            if not self.behaviorHasAction(behaviorID, actionName):
                 break
-        startPos += 1
+            startPos = runStart
 
-        endPos = pos
-        while self.behaviorHasAction(self._array[endPos], actionName):
-            endPos += 1
-            if not self.isValidPos(endPos):
+        while endPos < len(self._array):
+            runStart, runEnd, behaviorID = self._array.getRunAt(endPos)
+            if not self.behaviorHasAction(behaviorID, actionName):
                 break
-        endPos -= 1
+            endPos = runEnd
 
-        return startPos, endPos
+        return startPos, endPos-1
 
     def getStorage(self, actionName, pos):
         behaviorID = self._array[pos]
-        for storage in self._getBlankCommands(behaviorID, [self.keys.index('storage')] ):
+        for storage in self._getCommands(behaviorID, 'storage'):
             if storage:
                 if storage.behaviorName() == actionName:
                     return storage
         return None
 
     def firstActionInRange(self, actionName, startPos, endPos):
-        for i in range(startPos, endPos+1):
-            if self.behaviorHasAction(self._array[i], actionName):
-                return i
+        pos = max(startPos, 0)
+        for runLength, behaviorID in self._array.getRuns(startPos, endPos+1):
+            if self.behaviorHasAction(behaviorID, actionName):
+                return pos
+            pos += runLength
         return None
 
     def hasAction(self, actionName, pos):
@@ -358,78 +478,65 @@ class BehaviorArray:
 
     def getCommand(self, theCommand, pos):
         behaviorID = self._array[pos]
-        f = self.keys.index
-        allCommands = self._getBlankCommands(behaviorID, [f('add'),f('delete'),f('style'),f('focus'),f('unfocus')])
-        for com in allCommands:
+        for com in self._getAllCommands(behaviorID):
             if com.__class__ == theCommand:
                 return com
 
         raise "Position %d with behavior %d does not have the command %s" % (pos, behaviorID, theCommand)
 
-    def _getBlankCommands(self, ID, toGet):
-        commands = []
-        actions = self.behaviorPool.getBehavior(ID)
-        for actionID in actions:
-            for num in toGet:
-                commands.append(self.behaviorPool.actionPool.getCommands(actionID)[num])
-        commands = filter(lambda c:c <> None, commands)
-        return commands
+# The command lists returned by the following methods are shared with the
+# capability table, so they are tuples.
+
+    def _getCommands(self, ID, key):
+        return self.behaviorPool.getCapabilities(ID).commands[key]
 
     def _getAllCommands(self, ID):
-        f = self.keys.index
-        return self._getBlankCommands(ID, [f('add'),f('delete'),f('style'),f('focus'),f('unfocus')])
+        return self.behaviorPool.getCapabilities(ID).allCommands
 
     def getAddBehavior(self, pos):
-        behaviorID = self._array[pos]
-        return self._getBlankCommands(behaviorID, [self.keys.index('add')])
+        return self._getCommands(self._array[pos], 'add')
 
     def getStyleBehavior(self, pos):
-        behaviorID = self._array[pos]
-        return self._getBlankCommands(behaviorID, [self.keys.index('style')])
+        return self._getCommands(self._array[pos], 'style')
 
     def getDeleteBehavior(self, pos):
-        behaviorID = self._array[pos]
-        return self._getBlankCommands(behaviorID, [self.keys.index('delete')])
+        return self._getCommands(self._array[pos], 'delete')
 # \
     def getFocusBehavior(self, pos):
-        behaviorID = self._array[pos]
-        return self._getBlankCommands(behaviorID, [self.keys.index('focus')])
+        return self._getCommands(self._array[pos], 'focus')
 
     def getUnfocusBehavior(self, pos):
-        behaviorID = self._array[pos]
-        return self._getBlankCommands(behaviorID, [self.keys.index('unfocus')])
+        return self._getCommands(self._array[pos], 'unfocus')
 
     def behaviorOverridesDelete(self, startPos, endPos):
-        for pos in range(startPos, endPos+1):
-            if self._array[pos].overridesDelete():
+        for runLength, behaviorID in self._array.getRuns(startPos, endPos+1):
+            if self._behaviorOverridesDelete(behaviorID):
                 return 1
         return 0
 
     def behaviorOverridesStyle(self, startPos, endPos):
-        for pos in range(startPos, endPos+1):
-            if self._array[pos].overridesStyle():
+        for runLength, behaviorID in self._array.getRuns(startPos, endPos+1):
+            if self._behaviorOverridesStyle(behaviorID):
                 return 1
         return 0
 
     def blankableRanges(self, theBlank, startPos, endPos):
         ranges = []
-        lastOverrideBit = 1
-        rangeStart = startPos
+        pos = max(startPos, 0)
 
-        for pos in range(startPos, endPos+1):
+        for runLength, behaviorID in self._array.getRuns(startPos, endPos+1):
             if theBlank == "deletable":
-                overrideBit = self._behaviorOverridesDelete(self._array[pos])
+                overrideBit = self._behaviorOverridesDelete(behaviorID)
             if theBlank == "styleable":
-                overrideBit = self._behaviorOverridesStyle(self._array[pos])
+                overrideBit = self._behaviorOverridesStyle(behaviorID)
 
-            if lastOverrideBit == 1 and overrideBit == 0 :
-                rangeStart = pos
-            if  lastOverrideBit == 0 and overrideBit == 1:
-                ranges.append( (rangeStart, pos-1) )
-            if overrideBit == 0 and pos == endPos:
-                ranges.append( (rangeStart, pos) )
+            if overrideBit == 0:
+                if len(ranges) > 0 and ranges[-1][1] == pos-1:
+                    ranges[-1] = (ranges[-1][0], pos+runLength-1)
+                else:
+                    ranges.append( (pos, pos+runLength-1) )
 
-            lastOverrideBit = overrideBit
+            pos += runLength
 
         return ranges
 
@@ -440,7 +547,9 @@ class BehaviorArray:
         return self.blankableRanges("styleable", startPos, endPos)
 
     def addText(self, newString, insertPos):
-        self._array[insertPos:insertPos] = [self.defaultBehavior] * len(newString)
+        if insertPos < 0 or len(self._array)-1 < insertPos :
+            insertPos = len(self._array)
+        self._array.insert(insertPos, self.defaultBehavior, len(newString))
 
     def delText(self, start, end):
         if end < start:
@@ -455,18 +564,18 @@ class BehaviorArray:
         if len(self._array) - 1 < end:
             end = len(self._array) - 1
 
-        del self._array[start:end+1]
+        self._array.delete(start, end+1)
 
     def getSubString(self, startPos, endPos):
-        behaviorString = []
-        for pos in range(startPos, endPos+1):
-            behaviorAtPos = self._array[pos]
-            behaviorString.append(behaviorAtPos)
-        return behaviorString
+        return self._array.toList(startPos, endPos+1)
 
     def replaceBehaviors(self, behaviorString, insertPos):
-        for i in range(0, len(behaviorString)):
-            self._array[insertPos + i] = behaviorString[i]
+        self._array.replaceList(insertPos, behaviorString)
+        self._journalRange(insertPos, insertPos+len(behaviorString)-1)
+
+    def setBehaviorInRange(self, behaviorID, startPos, endPos):
+        self._array.setRange(startPos, endPos+1, behaviorID)
+        self._journalRange(startPos, endPos)
 
     def getLength(self):
         return len(self._array)
@@ -206,8 +206,9 @@ class UndoCommand(CommandObject):
     def execute(self):
         from archy_state import archyState
 
-        if 0 <= archyState.commandHistory._lastCommandIndex:
+        if archyState.commandHistory._undoLimit < archyState.commandHistory._lastCommandIndex:
             archyState.commandHistory._history[archyState.commandHistory._lastCommandIndex].undo()
+            archyState.commandHistory._history.changed(archyState.commandHistory._lastCommandIndex)
             archyState.commandHistory._lastCommandIndex = archyState.commandHistory._lastCommandIndex - 1
         else:
             raise AbortCommandException("Nothing to undo!")
@@ -229,6 +230,7 @@ class RedoCommand(CommandObject):
         if archyState.commandHistory._lastCommandIndex < len(archyState.commandHistory._history)-1:
             archyState.commandHistory._lastCommandIndex += 1
             archyState.commandHistory._history[archyState.commandHistory._lastCommandIndex].redo()
+            archyState.commandHistory._history.changed(archyState.commandHistory._lastCommandIndex)
         else:
             raise AbortCommandException("Nothing to redo!")
 
@@ -248,8 +250,7 @@ class EmptyCommandHistory(CommandObject):
         from archy_state import archyState
 
         lastCommand = archyState.commandHistory._history[-1]
-        archyState.commandHistory._history = [ lastCommand ]
-        archyState.commandHistory._lastCommandIndex = 0
+        archyState.commandHistory.setHistory([ lastCommand ], 0)
 
 
 
@@ -276,10 +277,16 @@ class EmptyCommandHistory(CommandObject):
 # A problem with this design is that once the command history becomes [A, B, E] it is impossible to revert to the state [A, B, C`, D`]. Alternative designs will be considered in the future.
 
 
+import paged_history
+
+# The commands are kept in a PagedHistory (see paged_history.py), which
+# keeps only the recently used commands in memory.
+
 class CommandHistory:
     def __init__(self, ArchyThread = None ):
-        self._history = []
+        self._history = paged_history.PagedHistory()
         self._lastCommandIndex = -1
+        self._undoLimit = -1
         self._lastCommand = None
         self._lastLeapTarget = ""
 # ============================================
@@ -304,6 +311,24 @@ class CommandHistory:
     
     def getSelectionAnchor(self):
         return self._selectionAnchor
+
+# The following function replaces the command history with the given list
+# of commands (or PagedHistory).
+    def setHistory(self, history, lastCommandIndex, undoLimit=-1):
+        if not isinstance(history, paged_history.PagedHistory):
+            history = paged_history.PagedHistory(history)
+        self._history = history
+        self._lastCommandIndex = lastCommandIndex
+        self._undoLimit = undoLimit
+
+# The following function makes UNDO stop at the last command done. It is
+# used when changes that are not in the history, such as the ones replayed
+# from the journal, were made after that command: the commands up to it can
+# no longer be undone, nor the ones after it redone. The commands up to it
+# are kept, and saved with the history.
+    def limitUndo(self):
+        del self._history[self._lastCommandIndex+1:]
+        self._undoLimit = self._lastCommandIndex
         
 # The following function adds the given command to the command history.
 # If incrementalSave is false, then the command isn't registered as a change to Archy's state for the purposes of journaling/incremental saving--this should only happen when the journaling mechanism itself is calling this function.
@@ -318,7 +343,7 @@ class CommandHistory:
 
         #print "adding to history:", command.name()
         self._lastCommandIndex += 1
-        self._history = self._history[0:self._lastCommandIndex]
+        del self._history[self._lastCommandIndex:]
         self._history.append(command)
         commandName = command.name()
         if commandName.startswith("LEAP forward to:") or commandName.startswith("LEAP backward to:"):
@@ -426,6 +426,9 @@ class CursorObserver:
     def onDelText(self, startPos, endPos):
         return
 
+    def onStyleChange(self, startPos, endPos):
+        return
+
     def onClear(self):
         return
 
@@ -25,6 +25,7 @@ import email_thread
 import messages
 import copy
 from forms import AddFormCommand
+from lock import LOCK_STYLE
 
 # --- --- ---
 
@@ -84,6 +85,18 @@ def getEmailServerInformation():
 
     return form
 
+# The following function tells the user about the messages the outgoing
+# mail thread gave up on sending (see email_thread.py).
+
+def reportFailedMail():
+    email_thread.outgoing_email_lock.acquire()
+    failures = email_thread.failed_outgoing_email
+    email_thread.failed_outgoing_email = []
+    email_thread.outgoing_email_lock.release()
+
+    for subject, reason in failures:
+        messages.queue('Could not send the email "%s" (%s); it was moved to the %s folder' % (subject, reason, email_thread.mail_spool.FAILED_DIR), 'normal')
+
 class SendEmailCommand(commands.CommandObject):
     def name(self):
         return "SEND"
@@ -115,12 +128,17 @@ class SendEmailCommand(commands.CommandObject):
         email_thread.outgoing_servers = [ newServerInfo ]
         email_thread.outgoing_servers_lock.release()
 
-        email_thread.outgoing_email_lock.acquire()
-        email_thread.outgoing_email.append( msg )
-        email_thread.is_outgoing_mail.set()
-        email_thread.outgoing_email_lock.release()
-        
-        messages.queue('Email sent successfully', 'normal')
+# The message is sent by the outgoing mail thread; the command only waits
+# for it to be written to the outgoing spool.
+
+        try:
+            email_thread.queueOutgoingMail( msg )
+        except (IOError, OSError):
+            messages.queue('Could not queue the email for sending', 'normal')
+            return
+
+        messages.queue('Email queued for sending', 'normal')
+        reportFailedMail()
         
         
 
@@ -138,40 +156,9 @@ class GetEmailCommand(commands.CommandObject):
         email_thread.incoming_servers_lock.release()
         email_thread.server_settings_changed.set()
 
-    def writeEmail(self, msg):
-        newEmail = archyState.commandMap.findSystemCommand('RecievedEmailForm')
-        newEmail['From'] = msg['From']
-        newEmail['To'] = msg['To']
-        newEmail['Subject'] = msg['Subject']
-        if not msg.is_multipart():
-            newEmail['Body'] = filter(lambda x:x <> '\r', msg.get_payload())
-
-
-        self.history = []
-        
-        cmd = archyState.commandMap.findSystemCommand('LEAP forward to:')
-        cmd.setinfo( '`E M A I L \n') 
-        self.history.append(cmd)
-
-        cmd = archyState.commandMap.findSystemCommand('LEAP forward to:')
-        cmd.setinfo( '\n')
-        self.history.append(cmd)
-        
-        self.history.append( cmd = archyState.commandMap.findSystemCommand('CreepRight') )
-
-        cmd = archyState.commandMap.findSystemCommand('AddText')
-        cmd.setinfo('\n' + newEmail.text() ) 
-        self.history.append(cmd)
-        
-        self.history.append( archyState.commandMap.findSystemCommand('LOCK') )
-        self.history.append( archyState.commandMap.findSystemCommand('CreepRight') )
-
-        for i in self.history:
-            archyState.commandHistory.executeCommand( i )
-
-
     def execute(self):
         self.updateServerInformation()
+        reportFailedMail()
 
         email_thread.check_mail_now.set()
 
@@ -180,12 +167,90 @@ class GetEmailCommand(commands.CommandObject):
         email_thread.incoming_email = []
         email_thread.incoming_email_lock.release()
 
-        for msg in newMessages:
-            self.writeEmail(msg)
+        self.insertCommand = None
+        if len(newMessages) > 0:
+            self.insertCommand = archyState.commandMap.findSystemCommand('InsertEmail')
+            self.insertCommand.setinfo(newMessages)
+            try:
+                self.insertCommand.execute()
+            except commands.AbortCommandException:
+                email_thread.incoming_email_lock.acquire()
+                email_thread.incoming_email[0:0] = newMessages
+                email_thread.incoming_email_lock.release()
+                raise
+
+    def undo(self):
+        if self.insertCommand:
+            self.insertCommand.undo()
+
+    def redo(self):
+        if self.insertCommand:
+            self.insertCommand.execute()
+
+def formatEmail(msg):
+    newEmail = archyState.commandMap.findSystemCommand('RecievedEmailForm')
+    newEmail['From'] = msg['From']
+    newEmail['To'] = msg['To']
+    newEmail['Subject'] = msg['Subject']
+    if not msg.is_multipart():
+        newEmail['Body'] = filter(lambda x:x <> '\r', msg.get_payload())
+    return '\n' + newEmail.text()
+
+# The following command puts received messages into the E M A I L section,
+# newest first, just below its heading. The messages are locked, as though
+# each was added and then LOCKed, but all of them are added with a single
+# addText() that sets their text, style and behaviors at once; the viewers
+# are told about one change, and undo removes them all.
+
+class InsertEmailCommand(commands.CommandObject):
+    def name(self):
+        return "InsertEmail"
+
+    def setinfo(self, newMessages):
+        self.newMessages = newMessages
+
+    def execute(self):
+        mT = archyState.mainText
+        heading = '`E M A I L \n'
+        headingPos = mT.textArray.find(heading, 0)
+        if headingPos < 0:
+            raise commands.AbortCommandException('There is no E M A I L section to put the email in.')
+
+        self.origCursorPos = mT.getCursorPos()
+        self.origSelections = mT.copySelectionList()
+
+        newText = ''
+        for msg in self.newMessages:
+            newText = formatEmail(msg) + newText
+
+        self.startPos = headingPos + len(heading)
+        self.endPos = self.startPos + len(newText) - 1
+
+        if mT.isValidPos(self.startPos):
+            baseStyle = mT.getCharStyle(self.startPos)
+        else:
+            baseStyle = mT.getDefaultStyle()
+        lockStyle = archyState.stylePool.mergeStyleWithOverlay(baseStyle, archyState.stylePool.newStyleOverlay(style = LOCK_STYLE))
+
+        bA = mT.behaviorArray
+        lockAction = bA.behaviorPool.getActionID(**bA.getBehavior('LOCK'))
+        lockBehavior = bA.behaviorPool.merge(bA.defaultBehavior, lockAction)
+
+        mT.addText(newText, self.startPos, lockStyle, lockBehavior)
+        mT.createNewSelection(self.startPos, self.endPos)
+        mT.setCursor(self.endPos+1)
+
+# Now that the messages are in the document, the POP3 server need not send
+# them again.
+
+        email_thread.deliveredPOPMessages(self.newMessages)
 
     def undo(self):
-        pass
+        mT = archyState.mainText
+        mT.delText(self.startPos, self.endPos)
+        mT.setSelectionList(self.origSelections)
+        mT.setCursor(self.origCursorPos)
 
-SYSTEM_COMMANDS = [EmailServerForm, RecievedEmailForm]
+SYSTEM_COMMANDS = [EmailServerForm, RecievedEmailForm, InsertEmailCommand]
 COMMANDS = [EmailForm, SendEmailCommand, GetEmailCommand]
 BEHAVIORS = []
@@ -24,6 +24,9 @@ import messages
 
 # --- --- ---
 
+# The style overlay of locked text.
+
+LOCK_STYLE = {'backgroundColor':(245,245,245), 'foregroundColor':(200,70,70)}
 
 # -- Start Normal Lock --
 
@@ -108,7 +111,7 @@ class LockCommand(commands.CommandObject):
         selStart, selEnd = archyState.mainText.getSelection('selection')
         
         self.theStyle = archyState.commandMap.findSystemCommand("Style")
-        self.theStyle.setinfo(backgroundColor = (245,245,245), foregroundColor = (200,70,70))
+        self.theStyle.setinfo(**LOCK_STYLE)
         self.theStyle.execute()
         
         self.theAction = behavior_editing.AddActionCommand("LOCK")
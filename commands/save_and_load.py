@@ -28,9 +28,20 @@
 # Setting List
 
 
-# The state information is saved in a gzip.GzipFile class. This compresses
-# the command history (which takes the vast majority of space) to be about 
-# 50-60 bytes per command object. 
+# The state information is saved in the sectioned format of document_file.py:
+# the text, styles, behaviors and other information each have a section of
+# their own, and the command history (which takes the vast majority of
+# space) is only unpickled when it is needed.
+
+# Versions of Archy before the sectioned format pickled the whole state
+# into the file; such files are still loaded.
+
+# Changes made between two saves of the state are appended to a journal
+# file (see journal.py), which is replayed when the state is loaded. Once
+# the journal grows past CHECKPOINT_MAX_RECORDS records or
+# CHECKPOINT_MAX_BYTES bytes, the state is saved again (a checkpoint) and
+# the journal starts anew, so that neither the journal nor the time taken
+# to replay it grow without bound.
 
 # A text file which has just the text content without formatting info is also
 # saved at the end of a session (QUIT command).
@@ -43,6 +54,11 @@ import commands
 from archy_state import archyState
 
 import cPickle
+import marshal
+import journal
+import document_file
+import paged_history
+import threading
 
 # --------------------------
 # Global variables
@@ -52,36 +68,121 @@ import cPickle
 
 outputFile = 'Humane Document'
 
-# The changeQueue is a list of all the changes that have been made to the state of Archy since it was last incrementally saved.
+# This is the file to which the journal of changes is appended. The journal
+# starts with the journalID of the state file it applies to.
+
+def _journalFile():
+    return outputFile+'.journal'
+
+journalID = None
+currentJournal = None
+
+# journalBytes is the size of the current journal. While a checkpoint is
+# being written, pendingRecords holds the records for the journal that
+# will follow it; journalLock guards both, and the journal file.
+
+journalBytes = 0
+pendingRecords = None
+journalLock = threading.Lock()
+checkpointThread = None
 
-changeQueue = []
+CHECKPOINT_MAX_RECORDS = 5000
+CHECKPOINT_MAX_BYTES = 512*1024
 
 # --------------------------
 # Incremental save functionality
 # --------------------------
 
-# The following function logs a change to the state of Archy.
+# The following function logs a change to the state of Archy. The change
+# itself has already been recorded by the journal of the main text.
 
 def logChange(command):
-    changeQueue.append(command)
-    
     maybeSaveBackup()
 
-# The following function saves all the queued changes to the state of Archy to disk.
+# The following function starts journaling the changes made to the main
+# text. If resume is true, the records are appended to the existing
+# journal file; otherwise the file is started anew.
+
+def startJournal(resume=0):
+    import os
+    global currentJournal
+    global journalBytes
+
+    currentJournal = journal.Journal(journalID, archyState.mainText, archyState.stylePool, archyState.commandHistory, resume)
+    archyState.mainText.setJournal(currentJournal)
+    if resume:
+        journalBytes = os.path.getsize(_journalFile())
+    else:
+        records = currentJournal.takeRecords()
+        f = open(_journalFile(), 'wb')
+        f.write(records)
+        f.close()
+        journalBytes = len(records)
+
+# The following function saves all the journaled changes to the state of Archy to disk.
+
+# While a checkpoint is being written, the changes are still appended to the
+# old journal (so that the old state file and journal stay complete should
+# the checkpoint fail) and also kept for the new journal.
 
 def saveChanges():
-    import gzip
-    global changeQueue
+    global journalBytes
 
-    if len(changeQueue) == 0:
+    if currentJournal == None:
         return
-    #f = gzip.GzipFile(outputFile,'a')
-    f = open(outputFile, 'a')
-    cPickle.dump(changeQueue, f)
-    f.close()
-    changeQueue = []
+    journalLock.acquire()
+    try:
+        records = currentJournal.takeRecords()
+        if len(records) == 0:
+            return
+        f = open(_journalFile(), 'ab')
+        f.write(records)
+        f.close()
+        journalBytes += len(records)
+        if pendingRecords <> None:
+            pendingRecords.append(records)
+    finally:
+        journalLock.release()
+
+    if currentJournal.recordCount > CHECKPOINT_MAX_RECORDS or journalBytes > CHECKPOINT_MAX_BYTES:
+        checkpoint()
+
+def _readJournal(fileName):
+    try:
+        f = open(fileName, 'rb')
+    except IOError:
+        return []
+    try:
+        return journal.readRecords(f)
+    finally:
+        f.close()
+
+# The following function applies a journal to the state of Archy. The
+# command history saved with the state does not match the text after the
+# journaled changes, so UNDO is made to stop where the journal starts (see
+# CommandHistory.limitUndo()). Returns the number of records applied, or
+# None if the journal does not belong to the loaded state.
+
+# If Archy stopped while a checkpoint was being put in place, the journal
+# of the new state may still be in the .new journal file; it is then moved
+# into place.
+
+def _applyJournal():
+    records = _readJournal(_journalFile())
+    if len(records) == 0 or records[0] <> (journal.JOURNAL_START, journalID):
+        records = _readJournal(_journalFile()+'.new')
+        if len(records) == 0 or records[0] <> (journal.JOURNAL_START, journalID):
+            return None
+        _replaceFile(_journalFile(), _journalFile()+'.new')
 
-# The following function applies a list of changes to the state of Archy.
+    mT = archyState.mainText
+    if journal.replay(records, journalID, mT, archyState.stylePool, archyState.commandHistory) > 0:
+        archyState.commandHistory.limitUndo()
+    print "Applied %d journal records." % (len(records)-1)
+    return len(records)-1
+
+# The following function applies a list of pickled commands to the state of
+# Archy. Versions of Archy before the journal appended these to the state file.
 
 def _applyChanges(changeList):
     for command in changeList:
@@ -190,10 +291,79 @@ def maybeSaveBackup():
 
 # The following class encapsulates the saving and restoring of Archy's state.  It is created to be pickleable (serializable) so that saving and restoring Archy's state consists merely of pickling/unpickling an instance of this class and calling the appropriate save/restore method.
 
-COMMAND_HISTORY_LIMIT=10000
+# It is no longer pickled as a whole: encode() and decode() turn it into
+# the sections of a document file and back.
 
-class _ArchyState:
+# The most recent commands of the history are saved with the state, as many
+# as fit in COMMAND_HISTORY_BUDGET bytes of pickled commands (and never fewer
+# than the commands that can be redone).
 
+COMMAND_HISTORY_BUDGET = 4*1024*1024
+
+class _ArchyState:
+    INFO_ATTRIBUTES = ['mainTextNonContentInfo', 'passwordList', 'settingList', 'lastCommandIndex', 'lastLeapTarget', 'selectionAnchor', 'journalID']
+
+# snapshot() serialises the parts of the state that keep changing while
+# Archy runs: the behaviors, the style pool, the other information and the
+# pages of the command history. These are small, or already pickled (see
+# paged_history.py). The text and styles were copied by save(), so encode()
+# may then run in another thread while the document is being changed.
+
+    def snapshot(self):
+        info = {}
+        for name in self.INFO_ATTRIBUTES:
+            info[name] = getattr(self, name)
+
+        self.historyPages, dropped = self.commandHistory.getPages(COMMAND_HISTORY_BUDGET, self.lastCommandIndex+1)
+        info['lastCommandIndex'] = self.lastCommandIndex - dropped
+        info['undoLimit'] = max(self.undoLimit - dropped, -1)
+        if dropped > 0:
+            print "saved commandHistory size = ", len(self.commandHistory) - dropped
+
+        self.stylePoolData = marshal.dumps(map(lambda s:s.getAttributes(), self.stylePool))
+        self.behaviorData = cPickle.dumps(self.behaviorList, 2)
+        self.infoData = cPickle.dumps(info, 2)
+
+    def encode(self):
+        pages = self.historyPages
+        sections = [ ('TEXT', self.allText.encode('utf-8')),
+                     ('STYL', marshal.dumps(self.allStyles)),
+                     ('SPOL', self.stylePoolData),
+                     ('BHVR', self.behaviorData),
+                     ('INFO', self.infoData),
+                     ('HIST', "".join(map(lambda p:p[1], pages))),
+                     ('HPAG', marshal.dumps(map(lambda p:(p[0], len(p[1])), pages))) ]
+        return document_file.encodeSections(sections)
+
+    def decode(self, doc):
+        import style
+
+        self.allText = doc.getText('TEXT')
+        self.allStyles = marshal.loads(doc.getSection('STYL'))
+
+        self.stylePool = style.StylePool()
+        del self.stylePool[:]
+        for attributes in marshal.loads(doc.getSection('SPOL')):
+            newStyle = style.Style()
+            for key in attributes.keys():
+                newStyle.setAttribute(key, attributes[key])
+            self.stylePool.append(newStyle)
+
+        self.behaviorList = cPickle.loads(doc.getSection('BHVR'))
+
+        info = cPickle.loads(doc.getSection('INFO'))
+        for name in self.INFO_ATTRIBUTES:
+            setattr(self, name, info[name])
+        self.undoLimit = info.get('undoLimit', -1)
+
+        pages = []
+        pos = 0
+        historyData = doc.getSection('HIST')
+        for count, length in marshal.loads(doc.getSection('HPAG')):
+            pages.append( (count, historyData[pos:pos+length]) )
+            pos += length
+        self.commandHistory = paged_history.PagedHistory()
+        self.commandHistory.appendPages(pages)
 
     def save(self):
         mT = archyState.mainText
@@ -204,44 +374,21 @@ class _ArchyState:
         #print "mT.styleArray.getLength()",mT.styleArray.getLength()
         #print "mT.behaviorArray.getLength()",mT.behaviorArray.getLength()
 
-        self.allText, self.allStyles = mT.getStyledText(0, length-1)
-        self.allStyles = compressList(self.allStyles)
+        self.allText = mT.textArray.getSubString(0, length-1)
+        self.allStyles = mT.styleArray.getRuns(0, length-1)
         self.mainTextNonContentInfo = mT.getNonContentMemento()
         self.passwordList = mT.passwordList
         self.settingList = mT.settingList
         self.behaviorList = mT.behaviorArray
         self.stylePool = archyState.stylePool
 
-        lastCommandIndex = archyState.commandHistory._lastCommandIndex
-        lenCommandHistory = len(archyState.commandHistory._history)
-
-        if lenCommandHistory > COMMAND_HISTORY_LIMIT:
-
-            # figure out the first command
-            firstCommandIndex = lastCommandIndex - COMMAND_HISTORY_LIMIT + 1
-            if firstCommandIndex < 0:
-                firstCommandIndex = 0
-            print "first command index =", firstCommandIndex
-
-            # copy commands up to the lastCommandIndex - the last command that was run by the user.
-            # there can be extra command objects that were undone and are redoable.
-            self.commandHistory = archyState.commandHistory._history[firstCommandIndex : lastCommandIndex+1]
-            self.lastCommandIndex = len(self.commandHistory)-1
-
-            if len(self.commandHistory) < COMMAND_HISTORY_LIMIT:
-                # there are undone commands that can be redone. we will add them to the saved
-                # history
-                roomLeft = COMMAND_HISTORY_LIMIT - len(self.commandHistory)
-                redoable_commands = archyState.commandHistory._history[ lastCommandIndex+1 : lastCommandIndex + 1 + roomLeft]
-                self.commandHistory = self.commandHistory+redoable_commands
-
-            print "saved commandHistory size = ", len(self.commandHistory)
-            print "saved lastCommandIndex = ", self.lastCommandIndex
-        else:
-            self.commandHistory = archyState.commandHistory._history
-            self.lastCommandIndex = archyState.commandHistory._lastCommandIndex
+        # The history is cut down to COMMAND_HISTORY_BUDGET by encode().
+        self.commandHistory = archyState.commandHistory._history
+        self.lastCommandIndex = archyState.commandHistory._lastCommandIndex
+        self.undoLimit = archyState.commandHistory._undoLimit
         self.lastLeapTarget = archyState.commandHistory._lastLeapTarget
         self.selectionAnchor = archyState.commandHistory.getSelectionAnchor()
+        self.journalID = journalID
 
         #print "len(self.allText)",len(self.allText)
         #print "len(decompressList(self.allStyles))",len(decompressList(self.allStyles))
@@ -258,13 +405,18 @@ class _ArchyState:
 
         mT.clear()
         archyState.stylePool = self.stylePool
-        addText = commands.text_editing.SimpleAddTextCommand(self.allText, decompressList(self.allStyles))
+        addText = commands.text_editing.SimpleAddTextCommand(self.allText)
         addText.execute()
 
+        # The styles were saved as runs, so they go straight into the style
+        # array rather than being expanded to one entry per character. The
+        # viewers were cleared above, so they have no glyphs to restyle yet.
+        mT.styleArray.setRuns(0, self.allStyles)
+
         mT.setNonContentInformation(self.mainTextNonContentInfo)
 
-        archyState.commandHistory._history = self.commandHistory
-        archyState.commandHistory._lastCommandIndex = self.lastCommandIndex
+        # States saved before UNDO could be limited have no undoLimit.
+        archyState.commandHistory.setHistory(self.commandHistory, self.lastCommandIndex, getattr(self, 'undoLimit', -1))
         archyState.commandHistory._lastLeapTarget = self.lastLeapTarget
         archyState.commandHistory.setSelectionAnchor(self.selectionAnchor)
 
@@ -293,56 +445,210 @@ class _ArchyState:
 # -- Russell Nelson, 11/6/2004
 
 def saveState():
-    import os
-    import gzip
+    _waitForCheckpoint()
+
+    stateData = _encodeState()
     
+    save_text_backup()
+
+    _writeState(stateData)
+
+# Everything journaled so far is in the new state file, so the journal starts anew.
+
+    startJournal()
+
+# The following function takes a snapshot of Archy's current state, under
+# a new journalID, ready to be encoded.
+
+def _snapshotState():
+    import time
+    global journalID
+
+    journalID = repr(time.time())
     state = _ArchyState()
     state.save()
-    
-    save_text_backup()
+    state.snapshot()
+    return state
+
+# The following function encodes Archy's current state, under a new
+# journalID, into the contents of a document file.
+
+def _encodeState():
+    return _snapshotState().encode()
+
+# The following function writes a file and makes sure it is on the disk.
+
+def _writeFile(fileName, data):
+    import os
+    f = open(fileName, 'wb')
+    try:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    finally:
+        f.close()
+
+# The following function puts the new file in place of the file fileName.
+# If backup is true, the file is kept as a backup.
+
+def _replaceFile(fileName, newFileName, backup=0):
+    import os
+
+# Here we delete the backup file, if it exists, and rename the file--if it
+# exists--to the backup file (or just delete it). A rename can't replace an
+# existing file on all platforms.
+
+    if backup:
+        try:
+            os.unlink(fileName+'.bak')
+        except OSError:
+            pass
+        try:
+            os.rename(fileName, fileName+'.bak')
+        except OSError:
+            pass
+    else:
+        try:
+            os.unlink(fileName)
+        except OSError:
+            pass
+
+# Now we'll rename the new file so it's the current working copy.
+
+    os.rename(newFileName, fileName)
+
+# The following function writes a pickled state to disk.
+
+def _writeState(stateData):
 
 # First we'll save Archy's state information to a brand new file (NOT the working copy).
 
     global outputFile
     #f = gzip.GzipFile(outputFile+'.new','w')
-    f = open(outputFile+'.new', 'w')
-    cPickle.dump(state, f)
-    f.close()
+    _writeFile(outputFile+'.new', stateData)
     print "saved humane document.new"
 
-# Here we delete the backup file, if it exists.
+    _replaceFile(outputFile, outputFile+'.new', 1)
+    print "renamed to humane document"
+
+# The following function saves a checkpoint of Archy's state once the journal
+# has grown too large. A snapshot of the state is taken right away, as the
+# document may not be read while it is being changed, but the state is
+# encoded and written (and the journal restarted) by a background thread.
+# Changes made meanwhile go to the new journal.
 
-    try:
-        os.unlink(outputFile+'.bak')
-    except OSError:
-        pass
+def checkpoint():
+    global checkpointThread
+    global pendingRecords
+    global journalBytes
 
-# Now we'll rename the working copy--if it exists--to the backup file.
+    if checkpointThread <> None and checkpointThread.isAlive():
+        return
 
+    saveChanges()
+    journalLock.acquire()
     try:
-        os.rename(outputFile, outputFile+'.bak')
-    except OSError:
-        pass
+        state = _snapshotState()
+        startJournal(resume=1)
+        pendingRecords = [ journal.startRecord(journalID) ]
+        journalBytes = len(pendingRecords[0])
+    finally:
+        journalLock.release()
+
+    print "Saving checkpoint."
+    checkpointThread = threading.Thread(target=_writeCheckpoint, args=(state,))
+    checkpointThread.start()
+
+# The new state file and the new journal are both written to .new files
+# and synced before either is renamed into place, the state first. At any
+# moment the disk holds a state file with its journal: the old ones, the
+# new state with the new journal still in its .new file (which
+# _applyJournal() then moves into place), or the new ones. The journal
+# lock is held from writing the new journal until it is in place, so that
+# no change is appended to the old journal only.
+
+def _writeCheckpoint(state):
+    global pendingRecords
 
-# Now we'll rename the new file we just created so it's the current working copy.
+    try:
+        _writeFile(outputFile+'.new', state.encode())
+    except:
+        print "Couldn't save checkpoint."
+        journalLock.acquire()
+        pendingRecords = None
+        journalLock.release()
+        return
 
-    os.rename(outputFile+'.new', outputFile)
-    print "renamed to humane document"
-    global changeQueue
-    changeQueue = []
+    journalLock.acquire()
+    try:
+        try:
+            _writeFile(_journalFile()+'.new', "".join(pendingRecords))
+            _replaceFile(outputFile, outputFile+'.new', 1)
+            _replaceFile(_journalFile(), _journalFile()+'.new')
+        except (IOError, OSError):
+            print "Couldn't save checkpoint."
+        pendingRecords = None
+    finally:
+        journalLock.release()
 
-# The following function loads Archy state information from disk.  It also loads and then applies any incremental changes previously appended to the state file by the saveChanges() function.
+def _waitForCheckpoint():
+    if checkpointThread <> None:
+        checkpointThread.join()
+
+# The following function loads Archy state information from disk.  It also loads and then applies any incremental changes previously journaled by the saveChanges() function.
 
 def loadState():
     import gzip
     global outputFile
+    global journalID
     #f = gzip.GzipFile(outputFile,'r')
-    
+
+# If Archy stopped after the working copy was renamed to the backup file,
+# the new file was already complete, so it becomes the working copy.
+
+    import os
+    if not os.path.exists(outputFile) and os.path.exists(outputFile+'.new'):
+        os.rename(outputFile+'.new', outputFile)
+
     try:
-        f = open(outputFile, 'r')
-    except:
+        isDocumentFile = document_file.isDocumentFile(outputFile)
+    except IOError:
         return "Humane Document file does not exist."
 
+    if isDocumentFile:
+        try:
+            doc = document_file.DocumentFile(outputFile)
+            try:
+                state = _ArchyState()
+                state.decode(doc)
+            finally:
+                doc.close()
+        except:
+            return "Error loading Humane Document."
+        changeList = []
+    else:
+        state, changeList = _loadPickledState()
+        if state == None:
+            return "Error loading Humane Document."
+
+    archyState.mainText.setJournal(None)
+    state.restore()
+    _applyChanges(changeList)
+    journalID = getattr(state, 'journalID', None)
+    recordCount = _applyJournal()
+    startJournal(recordCount <> None)
+    if recordCount:
+        currentJournal.recordCount = recordCount
+    return "Loaded file correctly."
+
+# The following function loads a state file in the format of versions of
+# Archy before the sectioned format: the pickled state followed by pickled
+# lists of commands. Returns the state (None if the file can't be loaded)
+# and the list of commands.
+
+def _loadPickledState():
+    f = open(outputFile, 'r')
+
     try:
         state = cPickle.load(f)
 
@@ -354,11 +660,9 @@ def loadState():
             except EOFError:
                 break
     except:
-        return "Error loading Humane Document."
+        f.close()
+        return None, []
 
     f.close()
-
-    state.restore()
-    _applyChanges(changeList)
-    return "Loaded file correctly."
+    return state, changeList
 
@@ -219,19 +219,12 @@ class AbstractLearnCommand(commands.CommandObject):
         mT.setSelection('selection', *oldSel)
 
         
-        foundNext = 0
-        pos = mT.getCursorPos()
-        start = pos
-
-        while not foundNext and pos < mT.getLength() and abs(pos-start)<2000:
-            if mT.behaviorArray.hasAction("SPELLCHECK", pos):
-                foundNext = 1
-            else:
-                pos += 1
+        start = mT.getCursorPos()
+        pos = mT.behaviorArray.firstActionInRange("SPELLCHECK", start, min(start+1999, mT.getLength()-1))
         
         messages.unqueue('persistant')
 
-        if foundNext <> 0:
+        if pos <> None:
             mT.setCursor(pos)
             mT.setSelection('selection', mT.cursorPosInText)
             messages.display()
@@ -276,19 +269,12 @@ class AbstractReplaceCommand(commands.CommandObject):
         self.delText.execute()
         self.addText.execute()
 
-        foundNext = 0
-        pos = mT.getCursorPos()
-        start = pos
-
-        while not foundNext and pos < mT.getLength() and abs(pos-start)<2000:
-            if mT.behaviorArray.hasAction("SPELLCHECK", pos):
-                foundNext = 1
-            else:
-                pos += 1
+        start = mT.getCursorPos()
+        pos = mT.behaviorArray.firstActionInRange("SPELLCHECK", start, min(start+1999, mT.getLength()-1))
         
         messages.unqueue('persistant')
 
-        if foundNext <> 0:
+        if pos <> None:
             mT.setCursor(pos)
             mT.setSelection('selection', mT.cursorPosInText)
             messages.display()
@@ -333,7 +333,11 @@ class FindNextCommand(commands.CommandObject):
         self.cursorPos = mT.getCursorPos()
         self.origSel = mT.getSelection('selection')
 
-        pos = mT.textArray.find(self.searchTerm, self.cursorPos)
+        # Only matches starting before searchEnd are of interest, so the
+        # search is bounded there instead of running to the end of the text.
+        pos = -1
+        for pos in mT.textArray.findAll(self.searchTerm, self.cursorPos, self.searchEnd+len(self.searchTerm)-1):
+            break
         if pos < self.searchEnd and pos > 0:
             mT.setSelection('selection', pos, pos+len(self.searchTerm)-1)
             mT.setCursor(pos+len(self.searchTerm))
@@ -381,8 +385,11 @@ class ReplaceCommand(commands.CommandObject):
         searchTerm = mT.textArray.getSubString(*foSel)
         replacement = mT.textArray.getSubString(*oSel)
 
-        pos = mT.textArray.find(searchTerm, sel[0])
-        if pos < sel[1] and pos > 0:
+        # One scan finds every occurrence in the selection; the first one is
+        # selected and the total is reported to the user.
+        matches = list(mT.textArray.findAll(searchTerm, sel[0], sel[1]+len(searchTerm)-1))
+        if len(matches) > 0 and matches[0] > 0:
+            pos = matches[0]
             mT.setSelection('selection', pos, pos+len(searchTerm)-1)
             mT.setCursor(pos+len(searchTerm))
             
@@ -398,6 +405,10 @@ class ReplaceCommand(commands.CommandObject):
             archyState.commandMap.registerCommand(FindNextCommand())
             archyState.commandMap.registerCommand(EndReplaceCommand())
 
+            if len(matches) == 1:
+                messages.queue('\"%s\" was found once in the selection.' % (searchTerm))
+            else:
+                messages.queue('\"%s\" was found %d times in the selection.' % (searchTerm, len(matches)))
             messages.queue("command-space: change\ncommand-tab: find next\nEND - Exit REPLACE", "persistant")
 
         else:
@@ -292,7 +292,7 @@ class ExampleParser:
         except:
             print "Thread Failure: Attempting to recenter the screen at an inappropriate time"
         self.soundtrack.stop()
-        archyState.commandHistory._history = archyState.commandHistory._history[:self.original_command_history_length]
+        del archyState.commandHistory._history[self.original_command_history_length:]
         archyState.commandHistory._lastCommandIndex = self.original_command_history_length-1
 
         messages.queue('Example '+self.name+' Finished', 'instant')
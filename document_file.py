@@ -0,0 +1,116 @@
+# document_file.py
+# The Raskin Center for Humane Interfaces (RCHI) 2005
+
+# This work is licensed under the Creative Commons
+# Attribution-NonCommercial-ShareAlike License. To view
+# a copy of this license, visit
+# http://creativecommons.org/licenses/by-nc-sa/2.0/
+
+# or send a letter to :
+
+# Creative Commons
+# 559 Nathan Abbott Way
+# Stanford, California 94305,
+# USA.
+# --- --- ---
+
+# This module implements the sectioned file format of the Humane Document
+# (see commands/save_and_load.py).
+
+# The file starts with a header (the magic string, the format version and
+# the number of sections) followed by a table giving the name, offset and
+# length of each section. The sections themselves follow the table. This
+# way a section can be read without reading, let alone unpickling, the
+# sections before it: the file is memory mapped and only the sections
+# asked for are copied out of it.
+
+# The sections written by save_and_load are:
+
+# TEXT - the text, encoded as UTF-8
+# STYL - the style runs, marshalled
+# SPOL - the attributes of the styles in the style pool, marshalled
+# BHVR - the pickled BehaviorArray (whose behaviors are stored as runs)
+# INFO - the pickled cursor, selections, settings and such
+# HIST - the pages of the command history, each a pickled list of commands
+# HPAG - the number of commands and the length of each page, marshalled
+
+import struct
+import mmap
+
+MAGIC = 'ARCHYDOC'
+VERSION = 1
+HEADER_FORMAT = '<8sII'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+SECTION_FORMAT = '<4sII'
+SECTION_SIZE = struct.calcsize(SECTION_FORMAT)
+
+class DocumentFileError(Exception):
+    pass
+
+def isDocumentFile(fileName):
+    f = open(fileName, 'rb')
+    try:
+        return f.read(len(MAGIC)) == MAGIC
+    finally:
+        f.close()
+
+# The following function returns the contents of a document file holding
+# the given list of (name, data) sections.
+
+def encodeSections(sections):
+    header = struct.pack(HEADER_FORMAT, MAGIC, VERSION, len(sections))
+    offset = HEADER_SIZE + SECTION_SIZE*len(sections)
+    table = []
+    for name, data in sections:
+        table.append( struct.pack(SECTION_FORMAT, name, offset, len(data)) )
+        offset += len(data)
+    return header + "".join(table) + "".join(map(lambda s:s[1], sections))
+
+# --------------------------
+# The DocumentFile class
+# --------------------------
+
+# A DocumentFile gives access to the sections of a document file. Call
+# close() once the sections needed have been read.
+
+class DocumentFile:
+    def __init__(self, fileName):
+        self._file = open(fileName, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except:
+            self._file.close()
+            raise
+
+        if len(self._map) < HEADER_SIZE:
+            self.close()
+            raise DocumentFileError("The document file is truncated.")
+        magic, version, count = struct.unpack(HEADER_FORMAT, self._map[:HEADER_SIZE])
+        if magic <> MAGIC or version > VERSION:
+            self.close()
+            raise DocumentFileError("Not a document file of a known version.")
+
+        self._sections = {}
+        pos = HEADER_SIZE
+        for i in range(count):
+            name, offset, length = struct.unpack(SECTION_FORMAT, self._map[pos:pos+SECTION_SIZE])
+            if offset + length > len(self._map):
+                self.close()
+                raise DocumentFileError("The section %s is truncated." % name)
+            self._sections[name] = (offset, length)
+            pos += SECTION_SIZE
+
+    def hasSection(self, name):
+        return self._sections.has_key(name)
+
+    def getSection(self, name):
+        offset, length = self._sections[name]
+        return self._map[offset:offset+length]
+
+    def getText(self, name):
+        offset, length = self._sections[name]
+        return unicode(self._map[offset:offset+length], 'utf-8')
+
+    def close(self):
+        self._map.close()
+        self._file.close()
@@ -1,13 +1,58 @@
 import time
+import re
+import socket
+import marshal
 import email
+import email.Errors
+from email.FeedParser import FeedParser
 import imaplib
 import poplib_2_4 as poplib
 import smtplib
+import mail_spool
+
+# The incoming mail thread checks for mail every POLL_INTERVAL seconds. An
+# IMAP server that supports IDLE tells the thread about new mail instead:
+# the IDLE command is renewed every IDLE_INTERVAL seconds, and the thread
+# checks every IDLE_POLL seconds whether it has been woken up.
+
+POLL_INTERVAL = 30
+IDLE_INTERVAL = 25*60
+IDLE_POLL = 1
+
+# The unique IDs (UIDLs) of the POP3 messages that have been put into the
+# document are saved to POP_UIDL_FILE, so that they are not retrieved again,
+# even after a restart. A message that was retrieved but not yet put into
+# the document is only remembered until Archy exits, so it is retrieved
+# again if Archy exits first (see deliveredPOPMessages()). One check retrieves at most POP_MAX_MESSAGES messages and
+# POP_MAX_BYTES bytes; the rest are retrieved by the following checks.
+
+POP_UIDL_FILE = 'pop_uidl.dat'
+POP_MAX_MESSAGES = 50
+POP_MAX_BYTES = 4*1024*1024
+
+# The outgoing mail thread sends at most SMTP_MAX_BATCH messages at a time
+# over its SMTP session. When sending fails, the thread waits
+# SMTP_RETRY_DELAY seconds before trying again, doubling the wait after
+# each failure up to SMTP_MAX_RETRY_DELAY seconds. A message the server
+# refuses for good is not sent again, nor is one the server has refused
+# SMTP_MAX_ATTEMPTS times for the time being.
+
+SMTP_MAX_BATCH = 20
+SMTP_RETRY_DELAY = 10
+SMTP_MAX_RETRY_DELAY = 30*60
+SMTP_MAX_ATTEMPTS = 10
+
+# The messages waiting to be sent are kept in a spool (see mail_spool.py)
+# in OUTGOING_SPOOL_DIR, so that they are sent even if Archy exits first.
+
+OUTGOING_SPOOL_DIR = 'outgoing_mail'
 
 class ServerError(Exception):
     pass
 class UserPasswordError(Exception):
     pass
+class InvalidMessageError(Exception):
+    pass
 
 
 class EmailServerObject:
@@ -38,9 +83,17 @@ class EmailServerObject:
             mailboxes = ['INBOX']
         messages = []
         for i in mailboxes:
-            messages += self._getMail( i )
+            newMessages = self._getMail( i )
+            if newMessages:
+                messages += newMessages
         return messages
 
+# Waits until new mail may have arrived or wakeEvent is set. By default the
+# server is polled every POLL_INTERVAL seconds.
+
+    def waitForMail(self, wakeEvent):
+        wakeEvent.wait(POLL_INTERVAL)
+
 
     def _isServerInfoValid(self):
         raise NotImplementedError()
@@ -57,7 +110,17 @@ class EmailServerObject:
 
 
 
+# An IMAPEmail stays logged in between checks. For each mailbox it remembers
+# the UIDVALIDITY and the highest UID it has fetched, and then fetches the
+# messages with higher UIDs with a single UID FETCH. The first check of a
+# mailbox, or one whose UIDVALIDITY changed, fetches its unseen messages.
+
 class IMAPEmail(EmailServerObject):         
+    def __init__(self, serverDict = None):
+        self._lastUIDs = {}
+        self._selectedMailbox = None
+        EmailServerObject.__init__(self, serverDict)
+
     def _isServerInfoValid(self):
         pass
         #raise NotImplementedError()
@@ -100,43 +163,136 @@ class IMAPEmail(EmailServerObject):
             
     def releaseServer(self):
         if self._isInitialized:
-            self._IMAP.close()
-            self._IMAP.logout()
+            try:
+                if self._selectedMailbox <> None:
+                    self._IMAP.close()
+                self._IMAP.logout()
+            except (imaplib.IMAP4.error, socket.error):
+                pass
             del self._IMAP
-        self._isIntialized = False
+        self._isInitialized = False
+        self._selectedMailbox = None
         
+# A connection that was dropped between checks is logged in again once.
+
     def _getMail(self, mailBox = None):
         if mailBox == None:
             mailBox = "INBOX"
-        if not self._isInitialized:
+        for attempt in range(2):
+            if not self._isInitialized:
+                try:
+                    self._initializeServer()
+                except:
+                    #print "exception",4
+                    return None
             try:
-                self._initializeServer()
-            except:
-                #print "exception",4
-                return None
-        if self._serverDict.has_key('last checked time'):
-            return self._getNewMail( self._serverDict['last checked time'], mailBox)
-        else:
-            return self._getNewMail( imaplib.Time2Internaldate( time.gmtime(0) ), mailBox)
+                return self._getNewMail( mailBox )
+            except (imaplib.IMAP4.abort, socket.error):
+                self._isInitialized = False
+                self._selectedMailbox = None
+        return None
 
-    def _getNewMail(self, sinceTime, mailBox):
-        self._IMAP.select( mailBox )
-        toSearchFor = sinceTime[:12]+sinceTime[-1:]
-        #if toSearchFor == imaplib.Time2Internaldate( time.localtime())[:12] +'"':
-        if 1:
-            toSearchFor = "UNSEEN"
+    def _getResponseNumber(self, code):
+        typ, data = self._IMAP.response( code )
+        try:
+            return int( data[-1] )
+        except (TypeError, ValueError, IndexError):
+            return None
+
+    def _getNewMail(self, mailBox):
+        typ, data = self._IMAP.select( mailBox )
+        if typ <> 'OK':
+            return []
+        self._selectedMailbox = mailBox
+        uidValidity = self._getResponseNumber( 'UIDVALIDITY' )
+        uidNext = self._getResponseNumber( 'UIDNEXT' )
+
+        if self._lastUIDs.has_key(mailBox) and self._lastUIDs[mailBox][0] == uidValidity:
+            lastUID = self._lastUIDs[mailBox][1]
+            if uidNext <> None and uidNext <= lastUID + 1:
+                return []
+            messageSet = '%d:*' % (lastUID + 1)
         else:
-            toSearchFor = "(SINCE "+toSearchFor + ")"
-        typ, data = self._IMAP.search( None, toSearchFor )
+            lastUID = 0
+            typ, data = self._IMAP.uid( 'SEARCH', None, 'UNSEEN' )
+            messageSet = ','.join( data[0].split() )
+
         messages = []
-        for num in data[0].split():
-            typ, data = self._IMAP.fetch(num, 'RFC822')
-            message = email.message_from_string( data[0][1] )
-            messages.append(message)
-        messages.reverse()
+        if messageSet <> '':
+            messages, highestUID = self._fetchMessages( messageSet, lastUID )
+            lastUID = max( lastUID, highestUID )
+        if uidNext <> None:
+            lastUID = max( lastUID, uidNext - 1 )
+        else:
+            typ, data = self._IMAP.uid( 'SEARCH', None, 'ALL' )
+            lastUID = max( [lastUID] + map(int, data[0].split()) )
+        self._lastUIDs[mailBox] = (uidValidity, lastUID)
 
-        self._serverDict['last checked time'] = imaplib.Time2Internaldate( time.localtime() )
+        messages.reverse()
         return messages
+
+# Fetches the messages in messageSet (a UID set) in one UID FETCH, and
+# returns those with a UID above lastUID, in order, along with the highest
+# UID fetched. A range "n:*" always matches the last message, even if its
+# UID is below n, so it is left out.
+
+    def _fetchMessages(self, messageSet, lastUID):
+        typ, data = self._IMAP.uid( 'FETCH', messageSet, '(UID RFC822)' )
+        fetched = []
+        for item in data:
+            if type(item) <> tuple:
+                continue
+            match = re.search( r'UID (\d+)', item[0] )
+            if match and int( match.group(1) ) > lastUID:
+                fetched.append( (int( match.group(1) ), email.message_from_string( item[1] )) )
+        fetched.sort()
+        highestUID = 0
+        if len(fetched) > 0:
+            highestUID = fetched[-1][0]
+        return map(lambda f: f[1], fetched), highestUID
+
+# While a single mailbox is checked and the server supports it, waiting for
+# mail uses IDLE, which returns as soon as the server reports a new message.
+
+    def waitForMail(self, wakeEvent):
+        if self._isInitialized and self._selectedMailbox <> None and 'IDLE' in self._IMAP.capabilities \
+           and len( self._serverDict.get('mailboxes', ['INBOX']) ) == 1:
+            try:
+                self._idle( wakeEvent )
+                return
+            except (imaplib.IMAP4.error, socket.error):
+                self._isInitialized = False
+                self._selectedMailbox = None
+        EmailServerObject.waitForMail(self, wakeEvent)
+
+    def _idle(self, wakeEvent):
+        tag = self._IMAP._new_tag()
+        self._IMAP.send( '%s IDLE\r\n' % tag )
+        if not self._IMAP.readline().startswith('+'):
+            raise imaplib.IMAP4.abort( 'IDLE refused' )
+
+        if hasattr(self._IMAP, 'sslobj'):
+            connection = self._IMAP.sslobj
+        else:
+            connection = self._IMAP.sock
+        connection.settimeout( IDLE_POLL )
+        endTime = time.time() + IDLE_INTERVAL
+        try:
+            while time.time() < endTime and not wakeEvent.isSet():
+                try:
+                    line = self._IMAP.readline()
+                except socket.timeout:
+                    continue
+                if line == '':
+                    raise imaplib.IMAP4.abort( 'connection closed while idling' )
+                if line.upper().find( 'EXISTS' ) <> -1:
+                    break
+        finally:
+            connection.settimeout( None )
+
+        self._IMAP.send( 'DONE\r\n' )
+        while not self._IMAP.readline().startswith( tag ):
+            pass
         
     def keepAlive(self):
         if self._isInitialized:
@@ -146,7 +302,78 @@ class IMAPEmail(EmailServerObject):
                 #print "exception",5
                 self._isInitialized = False
         
+# The saved UIDLs are kept as a dictionary mapping (server, user) to the
+# list of the UIDLs retrieved from that account.
+
+def _loadPOPUIDLs():
+    try:
+        f = open(POP_UIDL_FILE, 'rb')
+        try:
+            return marshal.load(f)
+        finally:
+            f.close()
+    except (IOError, EOFError, ValueError, TypeError):
+        return {}
+
+def _savePOPUIDLs(savedUIDLs):
+    try:
+        f = open(POP_UIDL_FILE, 'wb')
+        try:
+            marshal.dump(savedUIDLs, f)
+        finally:
+            f.close()
+    except IOError:
+        print "Could not save the POP message IDs."
+
+# The following function saves the UIDLs of the given POP3 messages, once
+# they have been put into the document. Messages from other servers are
+# ignored.
+
+def deliveredPOPMessages(messages):
+    global pop_uidl_lock
+    delivered = {}
+    for msg in messages:
+        popUIDL = getattr(msg, 'popUIDL', None)
+        if popUIDL <> None:
+            account, uidl = popUIDL
+            delivered.setdefault(account, []).append(uidl)
+    if len(delivered) == 0:
+        return
+
+    pop_uidl_lock.acquire()
+    try:
+        savedUIDLs = _loadPOPUIDLs()
+        for account, uidls in delivered.items():
+            accountUIDLs = savedUIDLs.get(account, [])
+            savedUIDLs[account] = accountUIDLs + filter(lambda uidl: uidl not in accountUIDLs, uidls)
+        _savePOPUIDLs(savedUIDLs)
+    finally:
+        pop_uidl_lock.release()
+
+# The following function forgets the saved UIDLs of an account that are no
+# longer on its server.
+
+def _prunePOPUIDLs(account, serverUIDLs):
+    global pop_uidl_lock
+    onServer = {}
+    for uidl in serverUIDLs:
+        onServer[uidl] = 1
+    pop_uidl_lock.acquire()
+    try:
+        savedUIDLs = _loadPOPUIDLs()
+        accountUIDLs = savedUIDLs.get(account, [])
+        prunedUIDLs = filter(lambda uidl: onServer.has_key(uidl), accountUIDLs)
+        if len(prunedUIDLs) < len(accountUIDLs):
+            savedUIDLs[account] = prunedUIDLs
+            _savePOPUIDLs(savedUIDLs)
+    finally:
+        pop_uidl_lock.release()
+
 class POPemail(EmailServerObject):
+    def __init__(self, serverDict = None):
+        self._seenUIDLs = None
+        EmailServerObject.__init__(self, serverDict)
+
     def _initializeServer(self):
         if self._serverDict == None:
             raise Exception("No server to initialize!")
@@ -187,8 +414,11 @@ class POPemail(EmailServerObject):
     def releaseServer(self):
         if self._isInitialized:
             self._POP.quit()
-        self._isIntialized = False
+        self._isInitialized = False
         
+# A POP3 server only shows the messages that were there when the session
+# started, so each check logs in again.
+
     def _getMail(self, noPOPmailboxes):
         if not self._isInitialized:
             try:
@@ -196,17 +426,90 @@ class POPemail(EmailServerObject):
             except:
                 #print "failed server start-POP"
                 return None
-        return self._getNewMail()
+        try:
+            return self._getNewMail()
+        finally:
+            try:
+                self.releaseServer()
+            except (poplib.error_proto, socket.error):
+                self._isInitialized = False
+
+    def _getAccount(self):
+        return (self._serverDict['server'], self._serverDict['user'])
+
+# Retrieves the messages whose UIDL hasn't been seen, in order, up to the
+# limits of one check. A server without UIDL has all of its messages
+# retrieved, as before. Each message carries its account and UIDL as
+# popUIDL, for deliveredPOPMessages(). The saved UIDLs are pruned to the
+# messages still on the server.
 
     def _getNewMail(self):
-        messages = []
-        for i in range( len(self._POP.list()[1]) ):
-            #print "another message"
-            rawText = ""
-            for j in self._POP.retr(i+1)[1]:
-                rawText += (j+"\n")
-            messages.append( email.message_from_string(rawText) )
+        sizes = {}
+        for line in self._POP.list()[1]:
+            words = line.split()
+            sizes[int(words[0])] = int(words[1])
+        try:
+            uidlLines = self._POP.uidl()[1]
+        except poplib.error_proto:
+            numbers = sizes.keys()
+            numbers.sort()
+            return map( self._retrieveMessage, self._limitToOneCheck(numbers, sizes) )
+
+        if self._seenUIDLs == None:
+            self._seenUIDLs = {}
+            for uidl in _loadPOPUIDLs().get(self._getAccount(), []):
+                self._seenUIDLs[uidl] = 1
+
+        serverUIDLs = []
+        newMessages = []
+        for line in uidlLines:
+            num, uidl = line.split()[:2]
+            serverUIDLs.append(uidl)
+            if not self._seenUIDLs.has_key(uidl):
+                newMessages.append( (int(num), uidl) )
+        newMessages.sort()
+
+        numbers = self._limitToOneCheck( map(lambda m: m[0], newMessages), sizes )
+        messages = map( self._retrieveMessage, numbers )
+        for i in range(len(numbers)):
+            uidl = newMessages[i][1]
+            messages[i].popUIDL = (self._getAccount(), uidl)
+            self._seenUIDLs[uidl] = 1
+
+        seenOnServer = filter(lambda uidl: self._seenUIDLs.has_key(uidl), serverUIDLs)
+        if len(seenOnServer) < len(self._seenUIDLs):
+            self._seenUIDLs = {}
+            for uidl in seenOnServer:
+                self._seenUIDLs[uidl] = 1
+            _prunePOPUIDLs(self._getAccount(), serverUIDLs)
         return messages
+
+# Returns the first of the message numbers that fit in the limits of one
+# check. The first message is always retrieved, however large it is.
+
+    def _limitToOneCheck(self, numbers, sizes):
+        totalSize = 0
+        for i in range(len(numbers)):
+            size = sizes.get(numbers[i], 0)
+            if i > 0 and (i >= POP_MAX_MESSAGES or totalSize + size > POP_MAX_BYTES):
+                return numbers[:i]
+            totalSize += size
+        return numbers
+
+# Retrieves a message, feeding its lines to the parser as they arrive
+# instead of collecting the whole message first.
+
+    def _retrieveMessage(self, num):
+        self._POP._putcmd( 'RETR %d' % num )
+        self._POP._getresp()
+        parser = FeedParser()
+        line, octets = self._POP._getline()
+        while line != '.':
+            if line[:2] == '..':
+                line = line[1:]
+            parser.feed( line + '\n' )
+            line, octets = self._POP._getline()
+        return parser.close()
         
     def keepAlive(self):
         if self._isInitialized:
@@ -289,34 +592,49 @@ class SMTPserver:
         
     def _releaseServer(self):
         if self._isInitialized:
-            self._SMTP.quit()
+            try:
+                self._SMTP.quit()
+            except (smtplib.SMTPException, socket.error):
+                pass
             del self._SMTP
         self._isInitialized = False
+
+    def releaseServer(self):
+        self._releaseServer()
+
+# The SMTP session stays open between messages. ensureConnected() checks
+# that it is still open, and opens a new one if it isn't; reconnect() opens
+# a new one in any case.
+
+    def ensureConnected(self):
+        if self._isInitialized:
+            try:
+                if self._SMTP.noop()[0] == 250:
+                    return
+            except (smtplib.SMTPException, socket.error):
+                pass
+            self._isInitialized = False
+        self._initializeServer()
+
+    def reconnect(self):
+        self._isInitialized = False
+        self._initializeServer()
         
     def sendMessage(self, msg):
+        del msg['From']
         msg['From'] = self._serverDict['From']
         if not self._verifyMessage(msg):
-            raise Exception("Not a valid message.")
+            raise InvalidMessageError("Not a valid message.")
         messageText = msg.as_string()
-        try:
-            self._initializeServer()
-        except:
-            #print "exception",14
+        if not self._isInitialized:
             #TO DO: use the standard exception
-            raise
-            #raise Exception("Could not access SMTP server.")
+            self._initializeServer()
         try:
             print self._SMTP.sendmail( msg['From'], msg['To'], messageText )
         except:
             #TO DO: not sure what to do here
             raise
         
-        try:
-            self._releaseServer()
-        except:
-            #TO DO: this should eventually be a pass
-            raise
-        
         
     def _constructText(self, msg):
         messageText = ""
@@ -337,9 +655,17 @@ import threading
 
 global incoming_email_lock,incoming_email,outgoing_email_lock,outgoing_email
 incoming_email_lock = threading.Lock()
+pop_uidl_lock = threading.Lock()
 incoming_email = []
 outgoing_email_lock = threading.Lock()
 outgoing_email = []
+outgoing_spool = mail_spool.MailSpool(OUTGOING_SPOOL_DIR)
+
+# The subjects of the messages that could not be sent, along with the
+# reasons, are kept in failed_outgoing_email (under outgoing_email_lock)
+# until the email commands tell the user about them.
+
+failed_outgoing_email = []
 
 global server_settings_changed,check_mail_now   
 server_settings_changed = threading.Event()
@@ -369,35 +695,54 @@ class IncomingEmailThread(threading.Thread):
         self._settingsChanged = True
         self._serverLogonFailed = []
         self._serverObjects = []
+
+# The server objects, and their connections, are kept from one check to the
+# next. When the server settings change, the objects whose settings are
+# unchanged are kept, and the others are released and replaced; servers
+# whose logon failed are tried again at the next check.
+
+    def _updateServerObjects(self):
+        oldObjects = self._serverObjects
+        self._serverObjects = []
+        self._serverLogonFailed = []
+        for j in self._servers:
+            kept = filter(lambda o: o.getServerInfo() == j, oldObjects)
+            if len(kept) > 0:
+                self._serverObjects.append( kept[0] )
+                oldObjects.remove( kept[0] )
+                self._serverLogonFailed.append( False )
+                continue
+            try:
+                if j['protocol'] == 'IMAP':
+                    self._serverObjects.append( IMAPEmail(j) )
+                if j['protocol'] == 'POP':
+                    self._serverObjects.append( POPemail(j) )
+                self._serverLogonFailed.append( False )
+            except:
+                self._serverLogonFailed.append( True )
+        self._releaseServerObjects( oldObjects )
+
+    def _releaseServerObjects(self, serverObjects):
+        for i in serverObjects:
+            try:
+                i.releaseServer()
+            except:
+                #print "exception", 20
+                pass
         
     def run(self):
         while 1:
             global server_settings_changed, system_quit
             if system_quit.isSet():
+                self._releaseServerObjects( self._serverObjects )
                 break
-            #TO DO: this is a very inefficient way of doing this, but very stable; maybe a more elegant method?
-            if server_settings_changed.isSet():
+            if server_settings_changed.isSet() or len(self._serverObjects) < len(self._servers):
                 global incoming_servers, incoming_servers_lock
                 incoming_servers_lock.acquire()
                 self._servers = incoming_servers
                 server_settings_changed.clear()
                 incoming_servers_lock.release()
-            for i in range( len(self._serverObjects) ):
-                try:
-                    self._serverObjects[i].releaseServer()
-                except:
-                    #print "exception", 20
-                    pass
-                del self._serverObjects[i]
-            for j in self._servers:
-                try:
-                    if j['protocol'] == 'IMAP':
-                        self._serverObjects.append( IMAPEmail(j) )
-                    if j['protocol'] == 'POP':
-                        self._serverObjects.append( POPemail(j) )
-                    self._serverLogonFailed.append( False )
-                except:
-                    self._serverLogonFailed.append( True )
+                self._updateServerObjects()
             newMessages = []
             for j in self._serverObjects:
                 newMessages += j.getMail()
@@ -413,67 +758,220 @@ class IncomingEmailThread(threading.Thread):
                 is_incoming_mail.set()
                 
             global check_mail_now
-            check_mail_now.wait(30)
+            if len(self._serverObjects) == 1:
+                self._serverObjects[0].waitForMail( check_mail_now )
+            else:
+                check_mail_now.wait( POLL_INTERVAL )
             print "receivemail thread woken up"
             if check_mail_now.isSet():
                 check_mail_now.clear()
-            #for i in self._serverObjects:
-                #i.keepAlive()
 
 
+# The following function queues a message to be sent. The message is
+# written to the outgoing spool before it is queued, and the IOError or
+# OSError of a failed write is passed on to the caller.
+
+def queueOutgoingMail(msg):
+    global outgoing_email, outgoing_email_lock, outgoing_spool, is_outgoing_mail
+    outgoing_email_lock.acquire()
+    try:
+        outgoing_email.append( outgoing_spool.enqueue(msg) )
+        is_outgoing_mail.set()
+    finally:
+        outgoing_email_lock.release()
+
+# The following function tells whether an error sending a message will
+# happen again however often the message is sent: the server refused it
+# with a 5xx reply, or the message itself is not valid. A refused login is
+# a problem with the settings, not with the message.
+
+def _isPermanentError(error):
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        return False
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        for code, reply in error.recipients.values():
+            if code < 500:
+                return False
+        return True
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code >= 500
+    return isinstance(error, (InvalidMessageError, email.Errors.MessageError, UnicodeError))
+
+# The outgoing mail thread keeps one SMTPserver, and its session, for as
+# long as the outgoing server settings stay the same. Each time it wakes
+# up, it sends the queued messages in batches of at most SMTP_MAX_BATCH
+# over that session. Messages that could not be sent are put back at the
+# front of the queue, and the thread backs off before trying again.
+
+# The queue (outgoing_email) holds the spool IDs of the messages. When the
+# thread starts, it queues the messages left in the spool from the last
+# time Archy ran; a message leaves the spool once it has been sent.
+
 class OutgoingEmailThread(threading.Thread):
     def __init__(self):
         threading.Thread.__init__(self)
         self._settingsChanged = True
         self._serverObjects = []
+        self._server = None
+        self._retryDelay = 0
+        self._attempts = {}
+
+    def _releaseServer(self):
+        if self._server <> None:
+            self._server.releaseServer()
+            self._server = None
+
+    def _getServer(self):
+        global outgoing_servers, outgoing_servers_lock
+        outgoing_servers_lock.acquire()
+        self._servers = outgoing_servers
+        outgoing_servers_lock.release()
+
+        if self._server <> None and self._server.getServerInfo() in self._servers:
+            return self._server
+        self._releaseServer()
+        for j in self._servers:
+            try:
+                self._server = SMTPserver( j )
+                break
+            except:
+                pass
+        return self._server
+
+    def _recoverSpool(self):
+        global outgoing_email, outgoing_email_lock, outgoing_spool
+        try:
+            recovered = outgoing_spool.recover()
+        except (IOError, OSError):
+            print "Could not read the outgoing mail spool."
+            return
+        outgoing_email_lock.acquire()
+        outgoing_email[0:0] = filter(lambda messageID: messageID not in outgoing_email, recovered)
+        outgoing_email_lock.release()
+
+    def _sendSpooled(self, server, messageID):
+        global outgoing_spool
+        try:
+            msg = outgoing_spool.load( messageID )
+        except IOError:
+            return
+        server.sendMessage( msg )
+        outgoing_spool.markSent( messageID )
+        self._attempts.pop(messageID, None)
+
+# Moves a message that can't be sent to the failed messages of the spool,
+# and leaves word for the user.
+
+    def _failSpooled(self, messageID, error):
+        global failed_outgoing_email, outgoing_email_lock, outgoing_spool
+        try:
+            subject = outgoing_spool.load( messageID )['Subject']
+        except Exception:
+            subject = None
+        try:
+            outgoing_spool.markFailed( messageID )
+        except (IOError, OSError):
+            pass
+        self._attempts.pop(messageID, None)
+        outgoing_email_lock.acquire()
+        failed_outgoing_email.append( (subject, str(error)) )
+        outgoing_email_lock.release()
+
+# Sends a batch of spooled messages and returns the IDs of those that could
+# not be sent. A session that was dropped is opened again once; if that
+# fails, the rest of the batch is returned unsent. A message that fails on
+# its own is given up on if the error is permanent (see _isPermanentError())
+# or after SMTP_MAX_ATTEMPTS attempts.
+
+    def _sendBatch(self, batch):
+        server = self._getServer()
+        if server == None:
+            return batch
+        try:
+            server.ensureConnected()
+        except:
+            return batch
+
+        failed = []
+        for n in range(len(batch)):
+            try:
+                self._sendSpooled( server, batch[n] )
+            except (socket.error, smtplib.SMTPServerDisconnected, ServerError):
+                try:
+                    server.reconnect()
+                    self._sendSpooled( server, batch[n] )
+                except:
+                    return failed + batch[n:]
+            except Exception, e:
+                attempts = self._attempts.get(batch[n], 0) + 1
+                if _isPermanentError(e) or attempts >= SMTP_MAX_ATTEMPTS:
+                    self._failSpooled( batch[n], e )
+                else:
+                    self._attempts[batch[n]] = attempts
+                    failed.append( batch[n] )
+        return failed
+
+# Sends one batch from the queue. The queue is only changed while holding
+# outgoing_email_lock.
+
+    def _sendQueuedMail(self):
+        global outgoing_email, outgoing_email_lock, outgoing_spool, is_outgoing_mail
+        outgoing_email_lock.acquire()
+        batch = outgoing_email[:SMTP_MAX_BATCH]
+        del outgoing_email[:SMTP_MAX_BATCH]
+        if len(outgoing_email) > 0:
+            is_outgoing_mail.set()
+        outgoing_email_lock.release()
+
+        if len(batch) == 0:
+            return
+        failed = self._sendBatch( batch )
+        if len(failed) > 0:
+            outgoing_email_lock.acquire()
+            outgoing_email[0:0] = failed
+            outgoing_email_lock.release()
+            self._retryDelay = min( max(self._retryDelay * 2, SMTP_RETRY_DELAY), SMTP_MAX_RETRY_DELAY )
+            return
+        self._retryDelay = 0
+
+        outgoing_email_lock.acquire()
+        if len(outgoing_email) == 0:
+            try:
+                outgoing_spool.compact()
+            except (IOError, OSError):
+                pass
+        outgoing_email_lock.release()
+
+    def _hasQueuedMail(self):
+        global outgoing_email, outgoing_email_lock
+        outgoing_email_lock.acquire()
+        hasMail = len(outgoing_email) > 0
+        outgoing_email_lock.release()
+        return hasMail
 
     def run(self):
-        newMessages = []
+        self._recoverSpool()
         while 1:
             global server_settings_changed, is_outgoing_mail, system_quit
             if system_quit.isSet():
+                self._releaseServer()
                 break
-            
-            
-            global outgoing_servers, outgoing_servers_lock
-            global outgoing_email, outgoing_email_lock
-            
-            is_outgoing_mail.wait(180)
+
+# While backing off, new messages don't wake the thread up; only quitting
+# does. Otherwise the thread waits only when the queue is empty.
+
+            if self._retryDelay > 0:
+                system_quit.wait( self._retryDelay )
+            elif not self._hasQueuedMail():
+                is_outgoing_mail.wait(180)
             print 'sendmail thread woken up'
+            if system_quit.isSet():
+                continue
 
-            outgoing_email_lock.acquire()
-            if len(outgoing_email) > 0:
-                newMessages = outgoing_email
-                outgoing_email = []
-            else:
-                newMessages = []
-            outgoing_email_lock.release()
-                
-            if len(newMessages) > 0:
-                outgoing_servers_lock.acquire()
-                self._servers = outgoing_servers
-                outgoing_servers_lock.release()
-                
-                newServer = None
-                for j in self._servers:
-                    try:
-                        newServer = SMTPserver( j )
-                        break
-                    except:
-                        pass
-                if newServer:
-                    for i in newMessages:
-                        try:
-                            newServer.sendMessage(i)
-                        except Exception, e:
-                            outgoing_email.append( i )
-                else:
-                    outgoing_email_lock.acquire()
-                    outgoing_email.extend( newMessages )
-                    outgoing_email_lock.release()
             is_outgoing_mail.clear()
+            self._sendQueuedMail()
             print outgoing_email
-                    
+
 
 incomingThread = IncomingEmailThread()
 outgoingThread = OutgoingEmailThread()
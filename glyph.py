@@ -21,6 +21,7 @@ VERSION = "$Id: glyph.hpy,v 1.53 2005/04/04 04:04:51 andrewwwilson Exp $"
 # --------------------------
 
 import surfaces
+import lru_cache
 # TO DO: maybe remove the import?
 import style
 from archy_state import archyState
@@ -44,9 +45,22 @@ class Glyph:
 # The 'GlyphPool' Class
 # --------------------------
 
+# The glyph pool and the font character cache are bounded (see lru_cache.py). The glyphs and surfaces of the printable ASCII and whitespace characters are pinned, since they are in use all the time; the pinned ones count against the budget too, and once they fill the pinned budget of a cache, those of further styles are kept like any other.
+
+GLYPH_POOL_BUDGET = 4*1024*1024
+FONT_CHARACTER_BUDGET = 4*1024*1024
+
+# A FontGlyph doesn't keep its surface (the character cache does), so it is counted at a small fixed size.
+
+FONT_GLYPH_SIZE = 256
+
+PINNED_CHARACTERS = dict( map(lambda c: (c, 1), map(chr, range(32, 127)) + ['\n', '\t']) )
+
 class GlyphPool:
-    def __init__(self):
-        self.glyphDict = {}
+    def __init__(self, memoryBudget=None):
+        if memoryBudget == None:
+            memoryBudget = GLYPH_POOL_BUDGET
+        self.glyphs = lru_cache.LRUCache(memoryBudget)
 
     def makeGlyph(self, char, styleID):
 
@@ -80,15 +94,18 @@ class GlyphPool:
         else:
             new_glyph = FontGlyph(char, styleID)
 
-        self.glyphDict[(char, styleID)] = new_glyph
+        if isinstance(new_glyph, FontGlyph):
+            size = FONT_GLYPH_SIZE
+        else:
+            size = new_glyph.width * new_glyph.height * 4
+        self.glyphs.add((char, styleID), new_glyph, size, PINNED_CHARACTERS.has_key(char))
         return new_glyph        
 
     def getGlyph(self, char, styleID):
-        key = (char, styleID)
-        try:
-            return self.glyphDict[key]
-        except KeyError:
-            return self.makeGlyph(char, styleID)
+        glyph = self.glyphs.get((char, styleID))
+        if glyph == None:
+            glyph = self.makeGlyph(char, styleID)
+        return glyph
 
 # Here we declare our global flyweight pool for glyphs.
 
@@ -122,10 +139,13 @@ class Font:
         import pygame.font
         
         self._font = pygame.font.SysFont( self.fontName, self.size, self.bold, self.italic )
-        
-# The following instance variable will be a flyweight pool of characters for this font.
+        self._styleID = styleID
 
-        self._characters = {}
+# Outlined characters are drawn with a smaller font, which is made once here.
+
+        self._outlineFont = None
+        if self.outline:
+            self._outlineFont = pygame.font.SysFont( self.fontName, self.size-3, self.bold, self.italic )
 
     def getAscent(self):
         return self._font.get_ascent()
@@ -142,30 +162,37 @@ class Font:
 
     def getSize(self, char):
         if self.outline:
-            self.render(char)
-            return self._characters[char].getSize()
+            return self.render(char).getSize()
         else:
             return self._font.size(char)
 
+# The rendered characters of all fonts are kept in globalCharacterCache, keyed by style and character. A character missing from the cache is taken from the glyph atlas if it is there, and rasterised otherwise.
+
     def render(self, char):
-        if not self._characters.has_key(char):
-            try:
-                if self.outline:
-                    import pygame.font
-                    
-                    theFont = pygame.font.SysFont( self.fontName, self.size-3, self.bold, self.italic )
-                    charSurf = outlineText(theFont, char, self.fgcolor)
-                else:
-                    charSurf = self._font.render(char, self.ANTIALIAS, self.fgcolor, self.bgcolor)
+        key = (self._styleID, char)
+        charSurface = globalCharacterCache.get(key)
+        if charSurface == None:
+            import glyph_atlas
+            charSurface = glyph_atlas.getCharacter(self._styleID, char)
+            if charSurface == None:
+                charSurface = surfaces.PygameSurface(surface= self.rasterise(char))
+            globalCharacterCache.add(key, charSurface, lru_cache.surfaceSize(charSurface), PINNED_CHARACTERS.has_key(char))
+            
+        return charSurface
 
-# Note here that if the character is invalid and SDL TTF can't render the glyph, we'll just insert a '?' character for now, so that Archy doesn't crash.
+# 'rasterise' returns a new pygame surface with the character drawn on it; the glyph atlas (see glyph_atlas.py) uses it too.
+
+    def rasterise(self, char):
+        try:
+            if self.outline:
+                return outlineText(self._outlineFont, char, self.fgcolor)
+            else:
+                return self._font.render(char, self.ANTIALIAS, self.fgcolor, self.bgcolor)
 
-            except:
-                charSurf = self._font.render('?', self.ANTIALIAS, self.fgcolor, self.bgcolor)
+# Note here that if the character is invalid and SDL TTF can't render the glyph, we'll just insert a '?' character for now, so that Archy doesn't crash.
 
-            self._characters[char] = surfaces.PygameSurface(surface= charSurf)#surfaces.PygameSurface(surface = )
-            
-        return self._characters[char]
+        except:
+            return self._font.render('?', self.ANTIALIAS, self.fgcolor, self.bgcolor)
 
 # --------------------------
 # The 'FontPool' Class
@@ -206,9 +233,15 @@ def outlineText(font, char, color):
     img.set_colorkey(notcolor)
     return img
 
-# Here we declare our global flyweight pool for fonts.
+# Here we declare our global flyweight pool for fonts, and the cache of the characters they render.
 
 globalFontPool = FontPool()
+globalCharacterCache = lru_cache.LRUCache(FONT_CHARACTER_BUDGET)
+
+# The following function returns the hit, miss and eviction counts of the glyph pool and the character cache.
+
+def getCacheStatistics():
+    return {'glyphs':globalGlyphPool.glyphs.getStatistics(), 'characters':globalCharacterCache.getStatistics()}
 
 # --------------------------
 # The 'FontGlyph' Class
@@ -219,7 +252,6 @@ class FontGlyph(Glyph):
 # '__init__()' takes 2 arguments: a character 'char', and a 'styleID'
     
     def __init__(self, char, styleID):
-        self._surface = None
         self._char = char
         self._style = styleID
         self._font = globalFontPool.getFont( styleID )
@@ -232,13 +264,10 @@ class FontGlyph(Glyph):
         self.lineHeight = self._font.getLineSize()
         #print "char=",char, "styleID=", styleID, "lineHeight=", self.lineHeight
 
-    def render(self):
-        if self._surface == None:
-            self.makeSurface()
-        return self._surface
+# The surface is not kept by the glyph, but looked up in the character cache each time, so that the cache can free it.
 
-    def makeSurface(self):
-        self._surface = self._font.render(self._char)
+    def render(self):
+        return self._font.render(self._char)
 
 # --------------------------
 # The 'BlankGlyph' class
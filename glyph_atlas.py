@@ -0,0 +1,219 @@
+# glyph_atlas.py
+# The Raskin Center for Humane Interfaces (RCHI) 2005
+
+# This work is licensed under the Creative Commons
+# Attribution-NonCommercial-ShareAlike License. To view
+# a copy of this license, visit
+# http://creativecommons.org/licenses/by-nc-sa/2.0/
+
+# or send a letter to :
+
+# Creative Commons
+# 559 Nathan Abbott Way
+# Stanford, California 94305,
+# USA.
+# --- --- ---
+
+# This module implements the glyph atlas, which pre-renders the printable
+# ASCII characters of the styles in the style pool at startup, so that the
+# first paint doesn't have to rasterise its glyphs one at a time.
+
+# The characters of all the fonts are packed into the rows of one surface.
+# When a font renders a character that isn't in the font character cache
+# (see glyph.py), it asks the atlas for it first with getCharacter(); the
+# character is then cached as a subsurface of the atlas, counted at the
+# size of the subsurface. Only the characters of the styles that are
+# actually rendered get into the cache.
+
+# The atlas is saved to ATLAS_FILE (an image) and ATLAS_INDEX_FILE (where
+# each font's characters are in the image). The fonts are identified by
+# their font file, size and the other style attributes that affect
+# rendering. At startup, loadCached() reads the saved atlas in a background
+# thread while the document loads; install() then uses it if it has all
+# the fonts, and otherwise rebuilds and saves it.
+
+# Outlined fonts, and fonts without a background color (whose characters
+# have per-pixel transparency), are left out of the atlas and rendered as
+# before.
+
+import marshal
+import threading
+import pygame
+
+import glyph
+import surfaces
+from archy_state import archyState
+
+ATLAS_FILE = 'glyph_atlas.bmp'
+ATLAS_INDEX_FILE = 'glyph_atlas.idx'
+ATLAS_VERSION = 1
+ATLAS_WIDTH = 1024
+ATLAS_MAX_FONTS = 32
+ATLAS_CHARACTERS = map(chr, range(32, 127))
+
+# --------------------------
+# Module global variables
+# --------------------------
+
+loadThread = None
+cachedAtlas = None
+installedAtlas = None
+_styleFonts = {}
+
+def _fontKey(styleObj):
+    name = styleObj.get('font')
+    bold = styleObj.get('bold')
+    italic = styleObj.get('italic')
+    try:
+        fontFile = pygame.font.match_font(name, bold, italic)
+    except:
+        fontFile = None
+    if fontFile == None:
+        fontFile = name
+    return (fontFile, styleObj.get('size'), bold, italic, tuple(styleObj.get('foregroundColor')), tuple(styleObj.get('backgroundColor')))
+
+# The following function returns a dictionary mapping each font key to
+# the ID of a style with that font, for the styles the atlas can hold.
+
+def _atlasFonts(stylePool):
+    fonts = {}
+    for styleID in range(len(stylePool)):
+        styleObj = stylePool[styleID]
+        if styleObj.get('outline') or styleObj.get('backgroundColor') == None:
+            continue
+        key = _fontKey(styleObj)
+        if not fonts.has_key(key) and len(fonts) < ATLAS_MAX_FONTS:
+            fonts[key] = styleID
+    return fonts
+
+# --------------------------
+# The GlyphAtlas class
+# --------------------------
+
+# A GlyphAtlas holds the atlas surface, and for each font key a list of
+# (character, x, y, width, height) tuples.
+
+class GlyphAtlas:
+    def __init__(self, surface, index):
+        self.surface = surface
+        self.index = index
+        self._rects = {}
+
+    def hasFont(self, fontKey):
+        return self.index.has_key(fontKey)
+
+    def getCharacter(self, fontKey, char):
+        if not self._rects.has_key(fontKey):
+            rects = {}
+            for atlasChar, x, y, width, height in self.index[fontKey]:
+                rects[atlasChar] = (x, y, width, height)
+            self._rects[fontKey] = rects
+        rect = self._rects[fontKey].get(char)
+        if rect == None:
+            return None
+        return surfaces.PygameSurface(surface=self.surface.subsurface(rect))
+
+    def save(self):
+        pygame.image.save(self.surface, ATLAS_FILE)
+        f = open(ATLAS_INDEX_FILE, 'wb')
+        try:
+            marshal.dump( (ATLAS_VERSION, self.index.items()), f )
+        finally:
+            f.close()
+
+# The following function renders the atlas characters of the given fonts
+# (a dictionary mapping font keys to style IDs) and packs them into shelves
+# ATLAS_WIDTH pixels wide.
+
+def build(fonts):
+    rendered = []
+    for fontKey in fonts.keys():
+        font = glyph.globalFontPool.getFont(fonts[fontKey])
+        for char in ATLAS_CHARACTERS:
+            rendered.append( (fontKey, char, font.rasterise(char)) )
+
+    index = {}
+    positions = []
+    x = y = shelfHeight = 0
+    for fontKey, char, charSurf in rendered:
+        width, height = charSurf.get_size()
+        if x + width > ATLAS_WIDTH:
+            x = 0
+            y += shelfHeight
+            shelfHeight = 0
+        positions.append( (x, y) )
+        index.setdefault(fontKey, []).append( (char, x, y, width, height) )
+        x += width
+        shelfHeight = max(shelfHeight, height)
+
+    surface = pygame.Surface( (ATLAS_WIDTH, max(y + shelfHeight, 1)) )
+    for i in range(len(rendered)):
+        surface.blit(rendered[i][2], positions[i])
+    return GlyphAtlas(surface, index)
+
+# --------------------------
+# Startup
+# --------------------------
+
+def _loadCached():
+    global cachedAtlas
+    try:
+        f = open(ATLAS_INDEX_FILE, 'rb')
+        try:
+            version, items = marshal.load(f)
+        finally:
+            f.close()
+        if version <> ATLAS_VERSION:
+            return
+        index = {}
+        for fontKey, characters in items:
+            index[fontKey] = characters
+        cachedAtlas = GlyphAtlas(pygame.image.load(ATLAS_FILE), index)
+    except (IOError, EOFError, ValueError, TypeError, pygame.error):
+        cachedAtlas = None
+
+def loadCached():
+    global loadThread
+    loadThread = threading.Thread(target=_loadCached)
+    loadThread.start()
+
+# The following function makes the atlas of the fonts of the styles in the
+# style pool available to getCharacter().
+
+def install(stylePool):
+    global cachedAtlas, installedAtlas
+    if loadThread <> None:
+        loadThread.join()
+
+    fonts = _atlasFonts(stylePool)
+    atlas = cachedAtlas
+    missing = filter(lambda fontKey: atlas == None or not atlas.hasFont(fontKey), fonts.keys())
+    if len(missing) > 0:
+        atlas = build(fonts)
+        try:
+            atlas.save()
+        except (IOError, pygame.error):
+            print "Could not save the glyph atlas."
+    cachedAtlas = None
+    installedAtlas = atlas
+    _styleFonts.clear()
+
+# The following function returns the atlas surface of a character of a
+# style, or None if the atlas doesn't have it. The font key of each style
+# is worked out the first time the style asks.
+
+def getCharacter(styleID, char):
+    if installedAtlas == None:
+        return None
+    if not _styleFonts.has_key(styleID):
+        styleObj = archyState.stylePool[styleID]
+        fontKey = None
+        if not styleObj.get('outline') and styleObj.get('backgroundColor') <> None:
+            fontKey = _fontKey(styleObj)
+            if not installedAtlas.hasFont(fontKey):
+                fontKey = None
+        _styleFonts[styleID] = fontKey
+    fontKey = _styleFonts[styleID]
+    if fontKey == None:
+        return None
+    return installedAtlas.getCharacter(fontKey, char)
@@ -0,0 +1,253 @@
+# journal.py
+# The Raskin Center for Humane Interfaces (RCHI) 2005
+
+# This work is licensed under the Creative Commons
+# Attribution-NonCommercial-ShareAlike License. To view
+# a copy of this license, visit
+# http://creativecommons.org/licenses/by-nc-sa/2.0/
+
+# or send a letter to :
+
+# Creative Commons
+# 559 Nathan Abbott Way
+# Stanford, California 94305,
+# USA.
+# --- --- ---
+
+# This module implements the change journal used for incremental saving
+# (see commands/save_and_load.py).
+
+# Instead of whole command objects, the journal records the primitive
+# changes those commands made to the main text's storage layers: text
+# that was added or deleted, the style and behavior runs of ranges whose
+# styles or behaviors changed, entries added to the style, action and
+# behavior pools, and the cursor, selections and settings. Replaying the
+# journal applies these changes straight to the TextArray, StyleArray and
+# BehaviorArray, without going through the commands, the text observers
+# or the viewers.
+
+# Each record is a header packed with struct (the magic string "AJ", the
+# record type and the payload length) followed by the payload. Payloads
+# are marshalled tuples of plain Python values, except for the records
+# that carry behavior commands (classes and storage instances), which have
+# to be pickled.
+
+import struct
+import marshal
+import cPickle
+
+from style import Style
+
+# --------------------------
+# Record format
+# --------------------------
+
+MAGIC = 'AJ'
+HEADER_FORMAT = '<2sBI'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+JOURNAL_START = 1       # journalID
+ADD_TEXT = 2            # (position, text, style runs)
+DEL_TEXT = 3            # (start, end)
+SET_STYLES = 4          # (start, style runs)
+SET_BEHAVIORS = 5       # (start, behavior runs)
+NEW_STYLES = 6          # [style attribute dictionaries]
+NEW_ACTIONS = 7         # pickled [action tuples]
+NEW_BEHAVIORS = 8       # [behaviors (lists of action IDs)]
+BEHAVIOR_REGISTRY = 9   # pickled (behavior_dict, behavior_equiv)
+NON_CONTENT = 10        # (cursor, selections, selection anchor, last leap target)
+SETTINGS = 11           # pickled (passwordList, settingList)
+
+CONTENT_RECORDS = [ADD_TEXT, DEL_TEXT, SET_STYLES, SET_BEHAVIORS]
+
+class JournalError(Exception):
+    pass
+
+def encodeRecord(recordType, payload):
+    return struct.pack(HEADER_FORMAT, MAGIC, recordType, len(payload)) + payload
+
+def startRecord(journalID):
+    return encodeRecord(JOURNAL_START, marshal.dumps(journalID))
+
+# The following function reads the records of a journal file, returning a
+# list of (record type, decoded payload) tuples. A truncated record at the
+# end of the file (Archy crashed while writing it) is ignored.
+
+def readRecords(f):
+    records = []
+    while 1:
+        header = f.read(HEADER_SIZE)
+        if len(header) < HEADER_SIZE:
+            break
+        magic, recordType, length = struct.unpack(HEADER_FORMAT, header)
+        if magic <> MAGIC:
+            raise JournalError("Journal record %d is corrupt." % len(records))
+        payload = f.read(length)
+        if len(payload) < length:
+            break
+        if recordType in [NEW_ACTIONS, BEHAVIOR_REGISTRY, SETTINGS]:
+            records.append( (recordType, cPickle.loads(payload)) )
+        else:
+            records.append( (recordType, marshal.loads(payload)) )
+    return records
+
+# --------------------------
+# The Journal class
+# --------------------------
+
+# A Journal collects the records for the changes made to a HumaneDocumentText
+# until they are taken with takeRecords(). A resumed journal continues a
+# journal file that already has its JOURNAL_START record. The text and its
+# BehaviorArray report their changes to the journal given to setJournal(); the pools,
+# the selections and the settings are compared against what was last
+# journaled whenever the records are taken.
+
+class Journal:
+    def __init__(self, journalID, mainText, stylePool, commandHistory, resume=0):
+        self.journalID = journalID
+        self._mainText = mainText
+        self._stylePool = stylePool
+        self._commandHistory = commandHistory
+        self._started = resume
+        self._records = []
+        self.recordCount = 0
+
+        behaviorArray = mainText.behaviorArray
+        self._stylePoolLength = len(stylePool)
+        self._actionPoolLength = len(behaviorArray.behaviorPool.actionPool.pool)
+        self._behaviorPoolLength = len(behaviorArray.behaviorPool.pool)
+        self._registryChanged = 0
+        self._nonContent = self._getNonContent()
+        self._settings = self._getSettings()
+
+    def _getNonContent(self):
+        cursor, selections = self._mainText.getNonContentMemento()
+        return (cursor, selections, self._commandHistory.getSelectionAnchor(), self._commandHistory._lastLeapTarget)
+
+    def _getSettings(self):
+        return cPickle.dumps( (self._mainText.passwordList, self._mainText.settingList) )
+
+    def _add(self, recordType, value):
+        self._records.append( encodeRecord(recordType, marshal.dumps(value)) )
+
+    def recordAddText(self, pos, text, styleRuns):
+        self._add(ADD_TEXT, (pos, unicode(text), styleRuns))
+
+    def recordDelText(self, start, end):
+        self._add(DEL_TEXT, (start, end))
+
+    def recordStyles(self, start, styleRuns):
+        self._add(SET_STYLES, (start, styleRuns))
+
+    def recordBehaviors(self, start, behaviorRuns):
+        self._add(SET_BEHAVIORS, (start, behaviorRuns))
+
+    def recordRegistryChange(self):
+        self._registryChanged = 1
+
+# The following method returns all of the records collected since it was
+# last called, as one string ready to be appended to the journal file, and
+# adds their number to recordCount. The
+# pool records are written before the content records that may refer to
+# the new pool entries.
+
+    def takeRecords(self):
+        behaviorArray = self._mainText.behaviorArray
+        actionPool = behaviorArray.behaviorPool.actionPool.pool
+        behaviorPool = behaviorArray.behaviorPool.pool
+
+        records = []
+        if not self._started:
+            records.append( startRecord(self.journalID) )
+            self._started = 1
+        if len(self._stylePool) > self._stylePoolLength:
+            newStyles = map(lambda s:s.getAttributes(), self._stylePool[self._stylePoolLength:])
+            records.append( encodeRecord(NEW_STYLES, marshal.dumps(newStyles)) )
+            self._stylePoolLength = len(self._stylePool)
+        if len(actionPool) > self._actionPoolLength:
+            records.append( encodeRecord(NEW_ACTIONS, cPickle.dumps(actionPool[self._actionPoolLength:], 2)) )
+            self._actionPoolLength = len(actionPool)
+        if len(behaviorPool) > self._behaviorPoolLength:
+            records.append( encodeRecord(NEW_BEHAVIORS, marshal.dumps(behaviorPool[self._behaviorPoolLength:])) )
+            self._behaviorPoolLength = len(behaviorPool)
+        if self._registryChanged:
+            registry = (behaviorArray.behavior_dict, behaviorArray.behavior_equiv)
+            records.append( encodeRecord(BEHAVIOR_REGISTRY, cPickle.dumps(registry, 2)) )
+            self._registryChanged = 0
+
+        records.extend(self._records)
+        self._records = []
+
+        nonContent = self._getNonContent()
+        if nonContent <> self._nonContent:
+            self._nonContent = nonContent
+            records.append( encodeRecord(NON_CONTENT, marshal.dumps(nonContent)) )
+        settings = self._getSettings()
+        if settings <> self._settings:
+            self._settings = settings
+            records.append( encodeRecord(SETTINGS, settings) )
+
+        self.recordCount += len(records)
+        return "".join(records)
+
+# --------------------------
+# Replay
+# --------------------------
+
+# The following function applies journal records to a HumaneDocumentText
+# whose state is the one the journal was started from. Only records
+# following the JOURNAL_START record for journalID are applied; returns the
+# number of content records applied.
+
+def replay(records, journalID, mainText, stylePool, commandHistory):
+    if len(records) == 0 or records[0] <> (JOURNAL_START, journalID):
+        return 0
+
+    textArray = mainText.textArray
+    styleArray = mainText.styleArray
+    behaviorArray = mainText.behaviorArray
+    contentCount = 0
+
+    for recordType, value in records[1:]:
+        if recordType == ADD_TEXT:
+            pos, text, styleRuns = value
+            textArray.addText(text, pos)
+            styleArray.addText(text, pos)
+            behaviorArray.addText(text, pos)
+            styleArray.setRuns(pos, styleRuns)
+        elif recordType == DEL_TEXT:
+            start, end = value
+            textArray.delText(start, end)
+            styleArray.delText(start, end)
+            behaviorArray.delText(start, end)
+        elif recordType == SET_STYLES:
+            styleArray.setRuns(*value)
+        elif recordType == SET_BEHAVIORS:
+            behaviorArray.setRuns(*value)
+        elif recordType == NEW_STYLES:
+            for attributes in value:
+                newStyle = Style()
+                for key in attributes.keys():
+                    newStyle.setAttribute(key, attributes[key])
+                stylePool.append(newStyle)
+        elif recordType == NEW_ACTIONS:
+            behaviorArray.behaviorPool.actionPool.pool.extend(value)
+        elif recordType == NEW_BEHAVIORS:
+            for actionIDs in value:
+                behaviorArray.behaviorPool.getBehaviorID(actionIDs)
+        elif recordType == BEHAVIOR_REGISTRY:
+            behaviorArray.behavior_dict, behaviorArray.behavior_equiv = value
+        elif recordType == NON_CONTENT:
+            cursor, selections, anchor, lastLeapTarget = value
+            mainText.setNonContentInformation( [cursor, selections] )
+            commandHistory.setSelectionAnchor(anchor)
+            commandHistory._lastLeapTarget = lastLeapTarget
+        elif recordType == SETTINGS:
+            mainText.passwordList, mainText.settingList = value
+        elif recordType == JOURNAL_START:
+            raise JournalError("The journal was started twice.")
+
+        if recordType in CONTENT_RECORDS:
+            contentCount += 1
+
+    return contentCount
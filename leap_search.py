@@ -0,0 +1,246 @@
+# leap_search.py
+# The Raskin Center for Humane Interfaces (RCHI) 2004
+
+# This work is licensed under the Creative Commons
+# Attribution-NonCommercial-ShareAlike License. To view 
+# a copy of this license, visit 
+# http://creativecommons.org/licenses/by-nc-sa/2.0/ 
+
+# or send a letter to :
+
+# Creative Commons
+# 559 Nathan Abbott Way
+# Stanford, California 94305, 
+# USA.
+# --- --- ---
+
+# LEAP_SEARCH MODULE
+
+# This module finds Leap patterns using the native string search functions
+# instead of comparing the text character by character in Python.
+
+# The text is searched through a folded copy of itself: every character is
+# lowercased and every shifted punctuation character is replaced by its
+# unshifted key (see archy_globals.remove_shift_key_from_character). Any
+# text character that matches a pattern character under the Leap spec
+# folds to the same character as the pattern character, so every Leap
+# match is also a match of the folded pattern in the folded text. The
+# reverse is not always true (an uppercase letter in the pattern only
+# matches itself), so each candidate found in the folded text is checked
+# against the pattern with bmh_search.comparePattern.
+
+# The text is never folded (or even copied) as a whole: it is searched in
+# windows that start next to the search position and double in size until
+# a match is found or the search range is covered. A Leap to a nearby
+# match only looks at the text around it, however large the document is.
+
+# The LeapSearch class also remembers its results. An incremental Leap
+# searches again after each typed character, always over the same range
+# of the text; an occurrence of the longer pattern is also an occurrence
+# of the shorter one, so the new search can start at the previous match
+# instead of rescanning the range from the beginning.
+
+# --------------------------
+# Imported modules
+# --------------------------
+
+import archy_globals
+import bmh_search
+
+# --------------------------
+# Global constants
+# --------------------------
+
+FORWARD = 1
+BACKWARD = 0
+
+MAX_CACHED_RANGES = 16
+SEARCH_WINDOW = 4096
+FIND_ALL_WINDOW = 64*1024
+
+# --------------------------
+# Folding functions
+# --------------------------
+
+_FOLD_TABLE = {}
+for shifted, unshifted in archy_globals.SHIFTED_KEYS.items():
+    _FOLD_TABLE[ord(shifted)] = unshifted
+
+def foldText(text):
+    return unicode(text).lower().translate(_FOLD_TABLE)
+
+# The following function returns true if the folded text can be used to
+# find the given pattern, that is, if every character matching a pattern
+# character folds to the same character as the pattern character.
+
+def canFoldPattern(pattern):
+    for c in pattern:
+        folded = foldText(c)
+        for matchingChar in bmh_search.getPossibleMatchingChars(c):
+            if foldText(matchingChar) <> folded:
+                return 0
+    return 1
+
+# --------------------------
+# The LeapPattern class
+# --------------------------
+
+# A LeapPattern finds a pattern in a window of the text. prepare(text)
+# returns the folded copy of the window (or None if the folded text can't
+# be used), which find() then searches; a window is folded only once
+# however many times it is searched.
+
+class LeapPattern:
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self._canFold = canFoldPattern(pattern)
+        self._patternList = bmh_search.makePatternList(pattern)
+        self._foldedPattern = foldText(pattern)
+
+    def prepare(self, text):
+        if not self._canFold:
+            return None
+        foldedText = foldText(text)
+        if len(foldedText) <> len(text):
+            return None
+        return foldedText
+
+# The following method returns the position of the first (FORWARD) or last
+# (BACKWARD) match lying entirely within positions lo..hi-1 of the window,
+# or -1.
+
+    def find(self, text, foldedText, lo, hi, direction = FORWARD):
+        pattern = self.pattern
+        if foldedText is None:
+            if direction == FORWARD:
+                return bmh_search.BMHSearchForward(text, pattern, lo, hi)
+            else:
+                return bmh_search.BMHSearchBackward(text, pattern, lo, hi)
+
+        if direction == FORWARD:
+            pos = foldedText.find(self._foldedPattern, lo, hi)
+            while pos <> -1 and not bmh_search.comparePattern(self._patternList, text, pos):
+                pos = foldedText.find(self._foldedPattern, pos+1, hi)
+        else:
+            pos = foldedText.rfind(self._foldedPattern, lo, hi)
+            while pos <> -1 and not bmh_search.comparePattern(self._patternList, text, pos):
+                pos = foldedText.rfind(self._foldedPattern, lo, pos+len(pattern)-1)
+        return pos
+
+# --------------------------
+# Windowed searching
+# --------------------------
+
+# The text is read through getText(start, end), which returns the text
+# from position start up to (but not including) end.
+
+# The following function searches positions lo..hi-1 of the text for the
+# first (FORWARD) or last (BACKWARD) match, starting at lo or hi. search
+# (windowText, direction) returns the position of the match in the window,
+# or -1. Consecutive windows overlap by patternLength-1 characters, so that
+# no match is missed at a window boundary.
+
+def searchWindows(getText, search, patternLength, lo, hi, direction = FORWARD):
+    overlap = max(patternLength - 1, 0)
+    size = max(SEARCH_WINDOW, 2 * patternLength)
+    while lo < hi:
+        if direction == FORWARD:
+            winStart, winEnd = lo, min(hi, lo + size)
+        else:
+            winStart, winEnd = max(lo, hi - size), hi
+        pos = search(getText(winStart, winEnd), direction)
+        if pos <> -1:
+            return winStart + pos
+        if direction == FORWARD:
+            if winEnd >= hi:
+                break
+            lo = winEnd - overlap
+        else:
+            if winStart <= lo:
+                break
+            hi = winStart + overlap
+        size = size * 2
+    return -1
+
+# --------------------------
+# The LeapSearch class
+# --------------------------
+
+class LeapSearch:
+    def __init__(self):
+        self._version = None
+        self._results = {}
+
+# The following method returns the position of the first (FORWARD) or last
+# (BACKWARD) occurrence of the pattern lying entirely within positions
+# lo..hi-1 of the text, or -1 if there is none. version identifies the
+# state of the text; the remembered results are only reused while the same
+# version is passed in.
+
+    def find(self, getText, version, length, pattern, lo, hi, direction = FORWARD):
+        if len(pattern) == 0:
+            return -1
+        if lo < 0: lo = 0
+        if hi > length: hi = length
+
+        if version <> self._version or len(self._results) > MAX_CACHED_RANGES:
+            self._version = version
+            self._results = {}
+        results = self._results.setdefault((direction, lo, hi), {})
+
+        if results.has_key(pattern):
+            return results[pattern]
+
+# Narrow the range using the result for the longest pattern prefix searched
+# for so far.
+
+        for prefixLength in range(len(pattern)-1, 0, -1):
+            prefix = pattern[:prefixLength]
+            if results.has_key(prefix):
+                if results[prefix] == -1:
+                    results[pattern] = -1
+                    return -1
+                if direction == FORWARD:
+                    lo = results[prefix]
+                else:
+                    hi = min(hi, results[prefix] + len(pattern))
+                break
+
+        leapPattern = LeapPattern(pattern)
+        def search(text, direction):
+            return leapPattern.find(text, leapPattern.prepare(text), 0, len(text), direction)
+        pos = searchWindows(getText, search, len(pattern), lo, hi, direction)
+        results[pattern] = pos
+        return pos
+
+# The following method yields the position of every non-overlapping
+# occurrence of the pattern lying entirely within positions lo..hi-1 of the
+# text, in order. The pattern is prepared once for the whole scan, and the
+# text is scanned FIND_ALL_WINDOW characters at a time.
+
+    def findAll(self, getText, length, pattern, lo, hi):
+        if len(pattern) == 0:
+            return
+        if lo < 0: lo = 0
+        if hi > length: hi = length
+
+        leapPattern = LeapPattern(pattern)
+        winStart = lo
+        while winStart < hi:
+            winEnd = min(hi, winStart + max(FIND_ALL_WINDOW, 2 * len(pattern)))
+            text = getText(winStart, winEnd)
+            foldedText = leapPattern.prepare(text)
+
+# Matches that don't fit in this window are found in the next one, which
+# starts after the last match, and no earlier than the first position
+# where such a match could start.
+
+            nextStart = winEnd - len(pattern) + 1
+            pos = leapPattern.find(text, foldedText, 0, len(text))
+            while pos <> -1:
+                yield winStart + pos
+                nextStart = max(nextStart, winStart + pos + len(pattern))
+                pos = leapPattern.find(text, foldedText, pos+len(pattern), len(text))
+            if winEnd >= hi:
+                break
+            winStart = nextStart
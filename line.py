@@ -24,6 +24,22 @@ import glyph
 import pygame
 import drawing_surface
 import surfaces
+import lru_cache
+from array import array
+
+# --------------------------
+# The line surface cache
+# --------------------------
+
+# The following cache holds rendered line surfaces, so that a line whose glyphs were already rendered (by this line or by another one, such as a line that was re-wrapped or regenerated after scrolling) does not have to blit its glyphs again.
+
+# Since glyphs are flyweights (see glyph.GlyphPool), a line's surface is fully determined by its glyph sequence, the screen width, its margin and whether it is transparent, which together make the key of the cache. Cached surfaces are shared by lines and must not be drawn on.
+
+# The cache holds surfaces up to about LINE_SURFACE_CACHE_BUDGET bytes (see lru_cache.py).
+
+LINE_SURFACE_CACHE_BUDGET = 8*1024*1024
+
+globalLineSurfaceCache = lru_cache.LRUCache(LINE_SURFACE_CACHE_BUDGET)
 
 # --------------------------
 # The Line Class
@@ -39,6 +55,8 @@ import surfaces
 # - a width (which is the pixel width of the line).
 # - a length (which is the number of characters on the line).
 
+# The x position of each glyph (relative to the margin) is derived from the glyphs when first needed and kept in an array, so that pixel positions and widths of ranges are looked up rather than summed. Whatever changes the glyphs of a line calls invalidateMetrics(), which drops the array along with the height of the line.
+
 class Line:
 
 # '__init__' creates an empty Line, with a height and margin of 0, and the given
@@ -52,12 +70,12 @@ class Line:
         self._height = 0
         self._margin = 0
         self._glyphs = []
+        self._xPositions = None
         self.Previous = None
         self.Next = None
         self._needs_redraw = 1
         self._needs_recalc_glyph_metrics = 0
         self._surface = None
-        self._height_changed = 1
         self._cached_screenWidth = None
 
 # --------------------------
@@ -128,8 +146,7 @@ class Line:
         self.Next.addGlyphs(self._glyphs[-number:], 0)
         del self._glyphs[-number:]
 
-        self._needs_recalc_glyph_metrics = 1
-        self._needs_redraw = 1
+        self.invalidateMetrics()
         return self.Next
 
 # 'passToPrevious' passes the first 'number' Glyphs to the end of the previous line in the list.    If there is no previous line, 'passToPrevious' creates one.
@@ -142,8 +159,7 @@ class Line:
         self.Previous.addGlyphs(self._glyphs[:number])
         del self._glyphs[:number]
 
-        self._needs_recalc_glyph_metrics = 1
-        self._needs_redraw = 1
+        self.invalidateMetrics()
         return self.Previous
 
 # --------------------------
@@ -314,14 +330,18 @@ class Line:
         if pos == -1:
             pos = len(self._glyphs)
         self._glyphs[pos:pos] = glyphs
-        self._needs_recalc_glyph_metrics = 1            
+        self.invalidateMetrics()
+
+# 'invalidateMetrics' must be called whenever the glyphs of the line change.
+
+    def invalidateMetrics(self):
+        self._needs_recalc_glyph_metrics = 1
+        self._xPositions = None
         self._needs_redraw = 1
 
     def changeHeight(self):
         #height = self._ascent - self._descent
         height = self._lineHeight
-        if height <> self._height:
-            self._height_changed = 1
         self._height = height
 
     def isBlank(self):
@@ -361,28 +381,33 @@ class Line:
 # 'removeGlyph' removes the glyph at 'pos' characters into the line, and updates the height of the line
     def removeGlyph(self,pos):
         del(self._glyphs[pos])
-        self._needs_recalc_glyph_metrics = 1
-        self._needs_redraw = 1
+        self.invalidateMetrics()
 
     def getLength(self):
         return len(self._glyphs)
 
+    def _getXPositions(self):
+        if self._xPositions == None:
+            self._xPositions = array('l', [0])
+            x = 0
+            for glyph in self._glyphs:
+                x += int(glyph.width)
+                self._xPositions.append(x)
+        return self._xPositions
+
     def getWidthOfRange( self, startPos, endPos ):
-        pass
-        width = 0
-        for i in range (startPos, endPos+1):
-            if 0<= i and i < self.getLength():
-                width = width + self._glyphs[i].width
-        return width
+        startPos = max(startPos, 0)
+        endPos = min(endPos+1, len(self._glyphs))
+        if endPos <= startPos:
+            return 0
+        xPositions = self._getXPositions()
+        return xPositions[endPos] - xPositions[startPos]
     # end getWidthOfRange
 
     def posToPixel(self, pos):
-        pixelPos = self._margin
         if pos > len(self._glyphs):
             print "Error, pos is",pos,"but there are only",len(self._glyphs),"characters on line."
-        for i in range(pos):
-            pixelPos += self._glyphs[i].width
-        return pixelPos
+        return self._margin + self._getXPositions()[max(pos, 0)]
 
     def getPosWidth(self, pos):
         if pos >= len(self._glyphs):
@@ -394,21 +419,21 @@ class Line:
             self.calcGlyphMetrics()
         return self._height
 
+# 'makeSurface' always makes a new surface, since the previous one may be shared through the line surface cache.
+
     def makeSurface(self, screenWidth):
-        if self._cached_screenWidth != screenWidth or self._height_changed:
-            self._surface = surfaces.PygameSurface( (screenWidth, self._height) )
-            self._height_changed = 0
-            self._cached_screenWidth = screenWidth
-            #print "bustin' a new surface. %d" % id(self._surface)
-            if self.parent.isTransparent():
-                self._surface.setBackgroundToTransparent()
-        # TODO: Maybe we can optimize out this clear() at some point.
+        self._surface = surfaces.PygameSurface( (screenWidth, self._height) )
+        self._cached_screenWidth = screenWidth
+        if self.parent.isTransparent():
+            self._surface.setBackgroundToTransparent()
         self._surface.clear()
-        x = self._margin
-        for glyph in self._glyphs:
-            y = self._ascent - glyph.ascent
-            self._surface.blitRectangle( glyph.render(), (x, y) )
-            x += glyph.width
+        if self._needs_recalc_glyph_metrics:
+            self.calcGlyphMetrics()
+        xPositions = self._getXPositions()
+        for i in range(len(self._glyphs)):
+            x = self._margin + xPositions[i]
+            y = self._ascent - self._glyphs[i].ascent
+            self._surface.blitRectangle( self._glyphs[i].render(), (x, y) )
 
     def drawWhitespaceSymbols(self, surface, ypos, xpos=None, firstChar = 0, lastChar = None):
         if xpos == None:
@@ -433,5 +458,10 @@ class Line:
             self.calcGlyphMetrics()
         if self._needs_redraw or self._cached_screenWidth != screenWidth:
             self._needs_redraw = 0
-            self.makeSurface(screenWidth)
+            key = (tuple(self._glyphs), screenWidth, self._margin, self.parent.isTransparent())
+            self._surface = globalLineSurfaceCache.get(key)
+            self._cached_screenWidth = screenWidth
+            if self._surface == None:
+                self.makeSurface(screenWidth)
+                globalLineSurfaceCache.add(key, self._surface, lru_cache.surfaceSize(self._surface))
         return self._surface
@@ -0,0 +1,105 @@
+# lru_cache.py
+# The Raskin Center for Humane Interfaces (RCHI) 2005
+
+# This work is licensed under the Creative Commons
+# Attribution-NonCommercial-ShareAlike License. To view
+# a copy of this license, visit
+# http://creativecommons.org/licenses/by-nc-sa/2.0/
+
+# or send a letter to :
+
+# Creative Commons
+# 559 Nathan Abbott Way
+# Stanford, California 94305,
+# USA.
+# --- --- ---
+
+# This module implements the memory bounded caches used for rendered
+# surfaces and glyphs: the line surface cache (see line.py), and the glyph
+# pool and the font character cache (see glyph.py).
+
+# --------------------------
+# The LRUCache class
+# --------------------------
+
+# An LRUCache holds values along with their size in bytes. Once the values
+# take more than the memory budget, the least recently used ones are
+# dropped until the rest fit in three quarters of the budget. Pinned
+# values are never dropped, but they do count against the budget, and
+# they may only take up to the pinned budget (half of the memory budget
+# unless given); a value that would go over it is added unpinned.
+
+# The cache counts its hits, misses and evictions, which getStatistics()
+# returns to help size the budget.
+
+def surfaceSize(surface):
+    width, height = surface.getSize()
+    return width * height * 4
+
+class LRUCache:
+    def __init__(self, memoryBudget, pinnedBudget=None):
+        self.memoryBudget = memoryBudget
+        if pinnedBudget == None:
+            pinnedBudget = memoryBudget / 2
+        self.pinnedBudget = pinnedBudget
+        self.clear()
+
+    def clear(self):
+        self._entries = {}
+        self._pinned = {}
+        self._size = 0
+        self._pinnedSize = 0
+        self._clock = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries) + len(self._pinned)
+
+    def get(self, key):
+        if self._pinned.has_key(key):
+            self.hits += 1
+            return self._pinned[key][0]
+        try:
+            entry = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._clock += 1
+        entry[2] = self._clock
+        return entry[0]
+
+    def add(self, key, value, size, pinned=0):
+        self.remove(key)
+        if pinned and self._pinnedSize + size <= self.pinnedBudget:
+            self._pinned[key] = (value, size)
+            self._pinnedSize += size
+        else:
+            self._clock += 1
+            self._entries[key] = [value, size, self._clock]
+            self._size += size
+        if self._size + self._pinnedSize > self.memoryBudget:
+            self._evict()
+
+    def remove(self, key):
+        if self._pinned.has_key(key):
+            self._pinnedSize -= self._pinned[key][1]
+            del self._pinned[key]
+        elif self._entries.has_key(key):
+            self._size -= self._entries[key][1]
+            del self._entries[key]
+
+    def _evict(self):
+        entries = map(lambda item: (item[1][2], item[0]), self._entries.items())
+        entries.sort()
+        for lastUse, key in entries:
+            if self._size + self._pinnedSize <= self.memoryBudget * 3 / 4:
+                break
+            self._size -= self._entries[key][1]
+            del self._entries[key]
+            self.evictions += 1
+
+    def getStatistics(self):
+        return {'hits':self.hits, 'misses':self.misses, 'evictions':self.evictions, 'entries':len(self), 'size':self._size + self._pinnedSize, 'pinnedSize':self._pinnedSize}
@@ -0,0 +1,164 @@
+# mail_spool.py
+# The Raskin Center for Humane Interfaces (RCHI) 2005
+
+# This work is licensed under the Creative Commons
+# Attribution-NonCommercial-ShareAlike License. To view
+# a copy of this license, visit
+# http://creativecommons.org/licenses/by-nc-sa/2.0/
+
+# or send a letter to :
+
+# Creative Commons
+# 559 Nathan Abbott Way
+# Stanford, California 94305,
+# USA.
+# --- --- ---
+
+# This module implements the outgoing mail spool, which keeps the messages
+# waiting to be sent on disk so that they survive Archy exiting or
+# crashing (see OutgoingEmailThread in email_thread.py).
+
+# Each queued message is a file in the spool directory, named after its
+# message ID; the IDs increase in the order the messages were queued. A
+# message is first written to a ".tmp" file, which is synced to disk and
+# then renamed, so the spool never holds half a message.
+
+# Once a message has been sent, its ID is appended to the sent journal
+# before its file is removed. If Archy stops in between, the journal keeps
+# the message from being sent twice: recover() removes the files of the
+# messages in the journal, along with the ".tmp" files of the messages
+# that were never queued, and then empties the journal. The journal is
+# also emptied this way after every SENT_JOURNAL_LIMIT messages sent. New
+# IDs are always greater than those in the journal, so that compacting it
+# never removes a message queued since.
+
+# A message that can't be sent is moved to the FAILED_DIR subdirectory,
+# where the user can still find it.
+
+import os
+import threading
+import email
+
+SPOOL_SUFFIX = '.msg'
+SPOOL_TEMP_SUFFIX = '.tmp'
+SENT_JOURNAL = 'sent.log'
+FAILED_DIR = 'failed'
+SENT_JOURNAL_LIMIT = 100
+
+def _syncedWrite(f, data):
+    f.write(data)
+    f.flush()
+    os.fsync(f.fileno())
+
+class MailSpool:
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._nextID = None
+        self._sentCount = 0
+
+    def _path(self, messageID, suffix = SPOOL_SUFFIX):
+        return os.path.join(self.directory, '%08d%s' % (messageID, suffix))
+
+    def _listIDs(self, suffix, subdirectory = ''):
+        try:
+            names = os.listdir(os.path.join(self.directory, subdirectory))
+        except OSError:
+            return []
+        messageIDs = []
+        for name in names:
+            base, ext = os.path.splitext(name)
+            if ext == suffix and base.isdigit():
+                messageIDs.append(int(base))
+        messageIDs.sort()
+        return messageIDs
+
+    def _newID(self):
+        self._lock.acquire()
+        try:
+            if self._nextID == None:
+                if not os.path.isdir(self.directory):
+                    os.makedirs(self.directory)
+                messageIDs = self._listIDs(SPOOL_SUFFIX) + self._listIDs(SPOOL_TEMP_SUFFIX) + self._listIDs(SPOOL_SUFFIX, FAILED_DIR) + self._sentIDs()
+                self._nextID = max([0] + messageIDs) + 1
+            messageID = self._nextID
+            self._nextID += 1
+            return messageID
+        finally:
+            self._lock.release()
+
+# The following method writes a message to the spool and returns its ID.
+# The message is on disk when the method returns.
+
+    def enqueue(self, msg):
+        messageID = self._newID()
+        tempPath = self._path(messageID, SPOOL_TEMP_SUFFIX)
+        f = open(tempPath, 'wb')
+        try:
+            _syncedWrite(f, msg.as_string())
+        finally:
+            f.close()
+        os.rename(tempPath, self._path(messageID))
+        return messageID
+
+    def pending(self):
+        return self._listIDs(SPOOL_SUFFIX)
+
+    def load(self, messageID):
+        f = open(self._path(messageID), 'rb')
+        try:
+            return email.message_from_file(f)
+        finally:
+            f.close()
+
+    def markSent(self, messageID):
+        f = open(os.path.join(self.directory, SENT_JOURNAL), 'ab')
+        try:
+            _syncedWrite(f, '%d\n' % messageID)
+        finally:
+            f.close()
+        self._remove(self._path(messageID))
+        self._sentCount += 1
+        if self._sentCount >= SENT_JOURNAL_LIMIT:
+            self.compact()
+
+    def markFailed(self, messageID):
+        failedDirectory = os.path.join(self.directory, FAILED_DIR)
+        if not os.path.isdir(failedDirectory):
+            os.makedirs(failedDirectory)
+        os.rename(self._path(messageID), os.path.join(failedDirectory, os.path.basename(self._path(messageID))))
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _sentIDs(self):
+        try:
+            f = open(os.path.join(self.directory, SENT_JOURNAL), 'rb')
+        except IOError:
+            return []
+        try:
+            lines = f.read().split('\n')
+        finally:
+            f.close()
+        return [int(line) for line in lines if line.strip().isdigit()]
+
+# The following method removes the files of the messages in the sent
+# journal, and then the journal itself.
+
+    def compact(self):
+        for messageID in self._sentIDs():
+            self._remove(self._path(messageID))
+        self._remove(os.path.join(self.directory, SENT_JOURNAL))
+        self._sentCount = 0
+
+# The following method cleans up after a crash, and returns the IDs of the
+# messages still waiting to be sent, in the order they were queued.
+
+    def recover(self):
+        for messageID in self._listIDs(SPOOL_TEMP_SUFFIX):
+            self._remove(self._path(messageID, SPOOL_TEMP_SUFFIX))
+        self.compact()
+        return self.pending()
@@ -0,0 +1,263 @@
+# paged_history.py
+# The Raskin Center for Humane Interfaces (RCHI) 2005
+
+# This work is licensed under the Creative Commons
+# Attribution-NonCommercial-ShareAlike License. To view
+# a copy of this license, visit
+# http://creativecommons.org/licenses/by-nc-sa/2.0/
+
+# or send a letter to :
+
+# Creative Commons
+# 559 Nathan Abbott Way
+# Stanford, California 94305,
+# USA.
+# --- --- ---
+
+# This module implements the paged command history used by the
+# CommandHistory class (see commands/__init__.py).
+
+# The commands are kept in pages of PAGE_SIZE commands. Once a page is full
+# it is pickled and written to a temporary spill file. Full pages are kept
+# in memory as long as their total pickled size is within
+# HISTORY_MEMORY_BUDGET; beyond that the least recently used pages are
+# dropped from memory, and read back from the spill file when UNDO or REDO
+# reaches them.
+
+# A command may change when it is undone or redone, so CommandHistory calls
+# changed() after undoing or redoing one. A changed page is written to the
+# spill file again before it is dropped, over its old copy if the new one
+# fits there. Once less than half of the spill file is in use, it is
+# compacted.
+
+import tempfile
+import cStringIO
+import cPickle
+
+PAGE_SIZE = 100
+HISTORY_MEMORY_BUDGET = 2*1024*1024
+
+def _unpickleCommands(data):
+    commands = []
+    f = cStringIO.StringIO(data)
+    while 1:
+        try:
+            commands.extend(cPickle.load(f))
+        except EOFError:
+            break
+    return commands
+
+class _Page:
+    def __init__(self, commands, count):
+        self.commands = commands
+        self.count = count
+        self.offset = None
+        self.length = 0
+        self.capacity = 0
+        self.dirty = 1
+        self.lastUse = 0
+
+    def isResident(self):
+        return self.commands <> None
+
+# --------------------------
+# The PagedHistory class
+# --------------------------
+
+# A PagedHistory behaves like the list of commands it replaces: it supports
+# len(), indexing, slicing, append() and deleting slices.
+
+class PagedHistory:
+    def __init__(self, commands=None, memoryBudget=None):
+        if memoryBudget == None:
+            memoryBudget = HISTORY_MEMORY_BUDGET
+        self.memoryBudget = memoryBudget
+        self._pages = []
+        self._len = 0
+        self._spillFile = None
+        self._spillSize = 0
+        self._clock = 0
+        if commands:
+            for command in commands:
+                self.append(command)
+
+    def __len__(self):
+        return self._len
+
+# The following method returns the index of the page holding command i and
+# the position of its first command.
+
+    def _findPage(self, i):
+        start = 0
+        for n in range(len(self._pages)):
+            if i < start + self._pages[n].count:
+                return n, start
+            start += self._pages[n].count
+        raise IndexError("history index out of range")
+
+    def _getCommands(self, page):
+        self._clock += 1
+        page.lastUse = self._clock
+        if not page.isResident():
+            self._spillFile.seek(page.offset)
+            page.commands = _unpickleCommands(self._spillFile.read(page.length))
+            self._enforceBudget(page)
+        return page.commands
+
+# The following method marks the page holding command i as changed.
+
+    def changed(self, i):
+        if i < 0:
+            i += self._len
+        n, start = self._findPage(i)
+        self._pages[n].dirty = 1
+
+    def _store(self, page, data):
+        if self._spillFile == None:
+            self._spillFile = tempfile.TemporaryFile()
+        if page.offset == None or len(data) > page.capacity:
+            self._compact()
+            page.offset = self._spillSize
+            page.capacity = len(data)
+            self._spillSize += len(data)
+        self._spillFile.seek(page.offset)
+        self._spillFile.write(data)
+        page.length = len(data)
+        page.dirty = 0
+
+# The following method copies the pages in the spill file to a new spill
+# file, if less than half of the old one is in use.
+
+    def _compact(self):
+        spilled = filter(lambda p:p.offset <> None, self._pages)
+        used = 0
+        for page in spilled:
+            used += page.capacity
+        if used*2 >= self._spillSize:
+            return
+        spillFile = tempfile.TemporaryFile()
+        for page in spilled:
+            self._spillFile.seek(page.offset)
+            data = self._spillFile.read(page.length)
+            page.offset = spillFile.tell()
+            page.capacity = len(data)
+            spillFile.write(data)
+        self._spillFile.close()
+        self._spillFile = spillFile
+        self._spillSize = spillFile.tell()
+
+    def _write(self, page):
+        data = cPickle.dumps(page.commands, 2)
+        self._store(page, data)
+        return data
+
+    def _getData(self, page):
+        if page.isResident() and page.dirty:
+            return self._write(page)
+        self._spillFile.seek(page.offset)
+        return self._spillFile.read(page.length)
+
+# The following method drops the least recently used pages from memory
+# until the rest fit in the memory budget. The page given, and the last page
+# while it is being filled, are kept.
+
+    def _enforceBudget(self, keepPage=None):
+        resident = []
+        size = 0
+        for page in self._pages:
+            if page.isResident() and (page.count == PAGE_SIZE or page is not self._pages[-1]):
+                resident.append( (page.lastUse, page) )
+                size += page.length
+        resident.sort()
+        for lastUse, page in resident:
+            if size <= self.memoryBudget:
+                break
+            if page is keepPage:
+                continue
+            if page.dirty:
+                self._write(page)
+            page.commands = None
+            size -= page.length
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._len
+        if i < 0 or i >= self._len:
+            raise IndexError("history index out of range")
+        n, start = self._findPage(i)
+        return self._getCommands(self._pages[n])[i-start]
+
+    def __getslice__(self, i, j):
+        i = max(i, 0)
+        j = min(j, self._len)
+        commands = []
+        while i < j:
+            n, start = self._findPage(i)
+            pageCommands = self._getCommands(self._pages[n])
+            commands.extend(pageCommands[i-start:j-start])
+            i = start + len(pageCommands)
+        return commands
+
+    def __delslice__(self, i, j):
+        i = max(i, 0)
+        j = min(j, self._len)
+        if i >= j:
+            return
+        rest = self[j:]
+        n, start = self._findPage(i)
+        page = self._pages[n]
+        if i > start:
+            del self._getCommands(page)[i-start:]
+            page.count = i-start
+            page.dirty = 1
+            n += 1
+        del self._pages[n:]
+        self._len = i
+        for command in rest:
+            self.append(command)
+
+    def append(self, command):
+        if len(self._pages) > 0 and self._pages[-1].isResident() and self._pages[-1].count < PAGE_SIZE:
+            page = self._pages[-1]
+            page.commands.append(command)
+            page.count += 1
+            page.dirty = 1
+        else:
+            page = _Page([command], 1)
+            self._pages.append(page)
+        self._len += 1
+        self._clock += 1
+        page.lastUse = self._clock
+
+        if page.count == PAGE_SIZE:
+            self._write(page)
+            self._enforceBudget(page)
+
+# The following method returns the most recent pages of the history, as a
+# list of (command count, pickled commands) tuples, whose pickled size is
+# within budget, along with the number of older commands left out. No more
+# than maxDropped commands are left out, however.
+
+    def getPages(self, budget, maxDropped):
+        pages = []
+        size = 0
+        count = 0
+        for n in range(len(self._pages)-1, -1, -1):
+            page = self._pages[n]
+            data = self._getData(page)
+            if len(pages) > 0 and size + len(data) > budget and self._len - count <= maxDropped:
+                break
+            pages.insert(0, (page.count, data))
+            size += len(data)
+            count += page.count
+        return pages, self._len - count
+
+# The following method appends pages returned by getPages(). They are
+# written to the spill file without being unpickled.
+
+    def appendPages(self, pages):
+        for count, data in pages:
+            page = _Page(None, count)
+            self._store(page, data)
+            self._pages.append(page)
+            self._len += count
@@ -63,15 +63,27 @@ FULLSCREEN_SCREEN_SIZE = None
 screen = None
 mouse_visibility = None
 fullscreen_mode = None
+overlay_drawn = 0
 
 # --------------------------
 # Screen drawing
 # --------------------------
 
+# Only the rectangles of the display that the main text viewer redrew are
+# updated. The quasimode text and the tutorial's on-screen keyboard are drawn
+# over the main text, so while either of them is showing (and once more
+# after they are hidden) the whole display is redrawn and flipped instead.
+
 def draw_screen():
     global screen
+    global overlay_drawn
 
     if archyState.mainTextViewer.isChanged() or archyState.quasiModeTextViewer.isChanged():
+        overlay = archyState.quasiModeTextViewer.visible or archyState.quasiModeTextViewer.isChanged() or commands.tutorial.is_tutorial_running()
+        if overlay or overlay_drawn:
+            archyState.mainTextViewer.invalidate()
+        overlay_drawn = overlay
+
         archyState.mainTextViewer.render()
         archyState.quasiModeTextViewer.render()
         archyState.quasiModeTextViewer.draw()
@@ -79,7 +91,11 @@ def draw_screen():
         # TODO: This is a hack to allow the tutorial to draw the on-screen keyboard
         commands.tutorial.draw(screen)
 
-        pygame.display.flip()
+        dirtyRects = archyState.mainTextViewer.getDirtyRects()
+        if overlay:
+            pygame.display.flip()
+        elif len(dirtyRects) > 0:
+            pygame.display.update(dirtyRects)
 
 
 # --------------------------
@@ -310,7 +326,6 @@ def accelerate_functions():
     import commands.save_and_load
     psyco.bind(commands.save_and_load.compressList)
     psyco.bind(behavior.BehaviorArray)
-    psyco.bind(behavior.BehaviorArray._getBlankCommands)
 
 def process_command_line_arguments():
     import optparse
@@ -18,243 +18,310 @@
 # --- --- ---
 
 # Length Run Encoding List
-# The list contains tuples of the form (value, length-of-run).
+
+# The runs are kept in chunks of at most 2*RUNS_PER_CHUNK runs. Within a
+# chunk, starts[k] is the position of the first element of run k relative
+# to the start of the chunk, and values[k] is the value shared by every
+# element of that run. A run never spans two chunks, and adjacent runs
+# always hold different values.
+
+# The number of elements in each chunk is kept in a Fenwick (binary
+# indexed) tree, so finding the chunk holding a position, and changing the
+# length of a chunk, both cost O(log chunks); within the chunk the run is
+# found with a bisect. An edit therefore only rewrites the chunks it
+# touches, instead of shifting the starts of all the following runs. The
+# tree is only rebuilt when chunks are added or removed, which happens
+# about once every RUNS_PER_CHUNK new runs. Memory is proportional to the
+# number of runs rather than to the number of elements.
 
 # Important bug caution. Previously a list was being assigned via a call like:
 # self._styleNumbers = [styleID] * len(blah). However if self._styleNumbers was not a built in list
-# (such as a class like LRE_List) then such an assignment would set the variable
+# (such as a class like RLE_List) then such an assignment would set the variable
 # to be a list instead of just updating the contents of the vector.
-# If one uses splice notation, then one does not endanger the class.
+# Always modify an RLE_List through its methods (setRange, insert, delete...).
 
-# One should be able to fix this problem in general with implementing the __eq__ method. This, in theory,
-# should be equivalent to an equality statement: a.__eq__(y) <==> a = y. 
-# However, __eq__ does not appear to be called when something like a = [1,2,3] is interpreted.
+import bisect
 
-class RLE_List:
-    def __init__(self):
-    self._rle = []
-    self._len = 0
+RUNS_PER_CHUNK = 64
 
+class RLE_List:
+    def __init__(self, theList = None):
+        self._chunks = []
+        self._chunkLengths = []
+        self._tree = [0]
+        self._treeStep = 0
+        self._len = 0
+        if theList:
+            self.insertList(0, theList)
 
     def __repr__(self):
-    #return str(self._toList(0,self._len))
-    return str(self._rle)
+        return str(self.getRuns())
 
     def __len__(self):
-    self._calcLen()
-    return self._len
-
-    def _calcLen(self):
-    sum = 0
-    for tuple in self._rle:
-        sum += tuple[1]
-    self._len = sum
-
-    def _findTuplePos(self, i, returnOffset = 0):
-    count = 0
-    pos = 0
-
-    while pos < len(self._rle):
-        if i < count + self._rle[pos][1]:
-        if returnOffset:
-            return pos, i-count
-        else:
-            return pos
-        
-        count += self._rle[pos][1]
-        pos += 1
-
-    if returnOffset:
-        return pos, 0
-    else:
-        return pos
-
-
-    def _removeIfZero(self,i):
-    try:
-        if self._rle[i][1] == 0:
-        self._rle.pop(i)
-        return 1 
-    except IndexError:
-        pass
-    return 0
-
-    def _combine(self, i, j):
-    if i < 0: i = 0
-    if j < 0: j = 0
-    if i == j: return 0
-    
-    try:
-        if self._rle[i][0] == self._rle[j][0]:
-        self._rle[i][1] += self._rle[j][1]
-        self._rle.pop(j)
-        return 1
-
-    except IndexError:
-        pass
-    return 0
-
-    def _simplify(self, i):
-    for k in range(-1,2):
-        if self._removeIfZero(i+k): i -= 1
-
-    if self._combine(i, i-1): i -= 1
-    if self._combine(i, i+1): i -= 1
-
-    def _toList(self, start, end):
-    start, end = self._checkSliceBounds(start, end)
-    
-    theList = []
-
-    startPos, startOffset = self._findTuplePos(start,1)
-    if end == len(self):
-        endPos = len(self._rle)-1
-        endOffset = self._rle[endPos][1]
-    else:
-        endPos, endOffset = self._findTuplePos(end,1)
-
-    if startPos == endPos:
-        return [self._rle[startPos][0]] * (end-start)
-    for i in range(startPos, endPos+1):
-        if i == startPos:
-        theList.extend( [self._rle[i][0]] * (self._rle[i][1]-startOffset) )
-        elif i == endPos:
-        theList.extend( [self._rle[i][0]] * endOffset )
-        else:
-        theList.extend( [self._rle[i][0]] * self._rle[i][1] )
-        
-    return theList
-
-    def _checkSliceBounds(self, i, j):
-    length = len(self)
-    
-    if i < 0: i = length + i
-    if j < 0: j = length + j
-
-    if i > length: i = length
-    if j > length: j = length
-
-    return i,j
-
-    
-
-    def _compressList(self,theList):
-    compressed_list = []
-    last_i = theList[0]
-    same_i_count = 1
-    for i in theList[1:]:
-        if i == last_i:
-        same_i_count += 1
-        else:
-        compressed_list.append([last_i, same_i_count])
-        same_i_count = 1
-        last_i = i
-    compressed_list.append([last_i, same_i_count])
-    return compressed_list
-
+        return self._len
 
     def __getitem__(self, i):
-    pos = self._findTuplePos(i)
-    return self._rle[pos][0]
-        
-    def __getslice__(self, i, j):
-    i, j = self._checkSliceBounds(i,j)
-    return self._toList(i,j)
-
-    def __delslice__(self, i,j, doSimplify = 1):
-    i,j = self._checkSliceBounds(i,j)
-
-    pos, offset = self._findTuplePos(i, 1)
-    startPos = pos
-    for k in range(j-i):
-        self._rle[pos][1] -= 1
-        if pos == startPos:
-        if self._rle[pos][1] == (i-offset):
-            if self._rle[pos][1] == 0:
-            self._rle.pop(pos)
+        if i < 0:
+            i += self._len
+        if i < 0 or self._len <= i:
+            raise IndexError("RLE_List index out of range")
+        c, chunkStart, k = self._findRun(i)
+        return self._chunks[c][1][k]
+
+    def _checkBounds(self, i, j):
+        if i < 0: i = 0
+        if j > self._len: j = self._len
+        return i, j
+
+# The following methods keep the Fenwick tree of chunk lengths.
+
+    def _rebuildTree(self):
+        n = len(self._chunkLengths)
+        tree = [0] + self._chunkLengths
+        for k in range(1, n+1):
+            parent = k + (k & -k)
+            if parent <= n:
+                tree[parent] += tree[k]
+        self._tree = tree
+        self._treeStep = 1
+        while self._treeStep*2 <= n:
+            self._treeStep *= 2
+
+    def _addToChunk(self, c, count):
+        self._chunkLengths[c] += count
+        k = c+1
+        while k < len(self._tree):
+            self._tree[k] += count
+            k += k & -k
+
+# Return the index of the chunk containing position i, along with the
+# position of its first element. Position i must be in the list.
+
+    def _findChunk(self, i):
+        c = 0
+        chunkStart = 0
+        step = self._treeStep
+        while step:
+            if c+step < len(self._tree) and chunkStart + self._tree[c+step] <= i:
+                c += step
+                chunkStart += self._tree[c]
+            step >>= 1
+        return c, chunkStart
+
+# Return the chunk containing position i, the position of its first
+# element, and the index within the chunk of the run containing i.
+
+    def _findRun(self, i):
+        c, chunkStart = self._findChunk(i)
+        return c, chunkStart, bisect.bisect_right(self._chunks[c][0], i - chunkStart) - 1
+
+# Return the runs of chunk c as a list of (run length, value) tuples.
+
+    def _chunkRuns(self, c):
+        starts, values = self._chunks[c]
+        ends = starts[1:] + [self._chunkLengths[c]]
+        return [(ends[k] - starts[k], values[k]) for k in range(len(starts))]
+
+# The following method returns the runs covering positions i..j-1 as a list
+# of (run length, value) tuples. This is the same format that
+# save_and_load.compressList produces.
+
+    def getRuns(self, i = 0, j = None):
+        if j == None: j = self._len
+        i, j = self._checkBounds(i, j)
+        if i >= j:
+            return []
+        runs = []
+        c, chunkStart, k = self._findRun(i)
+        while chunkStart < j:
+            starts, values = self._chunks[c]
+            chunkEnd = chunkStart + self._chunkLengths[c]
+            while k < len(starts) and chunkStart + starts[k] < j:
+                if k+1 < len(starts):
+                    runEnd = chunkStart + starts[k+1]
+                else:
+                    runEnd = chunkEnd
+                runs.append( (min(runEnd, j) - max(chunkStart + starts[k], i), values[k]) )
+                k += 1
+            chunkStart = chunkEnd
+            c += 1
+            k = 0
+        return runs
+
+# The following method returns the run containing position i as a
+# (first position, position after the run, value) tuple.
+
+    def getRunAt(self, i):
+        c, chunkStart, k = self._findRun(i)
+        starts, values = self._chunks[c]
+        if k+1 < len(starts):
+            runEnd = starts[k+1]
+        else:
+            runEnd = self._chunkLengths[c]
+        return chunkStart + starts[k], chunkStart + runEnd, values[k]
+
+    def toList(self, i = 0, j = None):
+        theList = []
+        for count, value in self.getRuns(i, j):
+            theList.extend([value] * count)
+        return theList
+
+# The following method replaces positions i..j-1 with the given list of
+# (run length, value) tuples. The chunks holding those positions are
+# unpacked into runs, spliced and packed again; the chunk before or after
+# them is included when the new runs may join a run in it. As long as the
+# number of chunks stays the same, only their lengths in the tree change.
+
+    def _replace(self, i, j, runs):
+        if len(self._chunks) == 0:
+            first, last, segmentStart = 0, -1, 0
+        else:
+            if i < self._len:
+                first, segmentStart = self._findChunk(i)
+            else:
+                first = len(self._chunks) - 1
+                segmentStart = self._len - self._chunkLengths[first]
+            if j > i:
+                last, lastStart = self._findChunk(j-1)
+            else:
+                last, lastStart = first, segmentStart
+            if first > 0 and i == segmentStart:
+                first -= 1
+                segmentStart -= self._chunkLengths[first]
+            if last+1 < len(self._chunks) and j == lastStart + self._chunkLengths[last]:
+                last += 1
+
+        before = []
+        after = []
+        pos = segmentStart
+        for c in range(first, last+1):
+            for count, value in self._chunkRuns(c):
+                if pos < i:
+                    before.append( (min(count, i - pos), value) )
+                if pos + count > j:
+                    after.append( (min(count, pos + count - j), value) )
+                pos += count
+
+        segment = []
+        inserted = 0
+        for count, value in before + runs + after:
+            if count <= 0:
+                continue
+            if len(segment) > 0 and segment[-1][1] == value:
+                segment[-1] = (segment[-1][0] + count, value)
             else:
-            pos += 1
+                segment.append( (count, value) )
+        for count, value in runs:
+            inserted += max(count, 0)
+
+        chunkCount = last+1 - first
+        if chunkCount == 0 or len(segment) < chunkCount or len(segment) > 2*RUNS_PER_CHUNK*chunkCount:
+            newCount = (len(segment) + RUNS_PER_CHUNK - 1) / RUNS_PER_CHUNK
+        else:
+            newCount = chunkCount
+
+        chunks = []
+        chunkLengths = []
+        for n in range(newCount):
+            starts = []
+            values = []
+            chunkLength = 0
+            for count, value in segment[n*len(segment)/newCount:(n+1)*len(segment)/newCount]:
+                starts.append(chunkLength)
+                values.append(value)
+                chunkLength += count
+            chunks.append( [starts, values] )
+            chunkLengths.append(chunkLength)
+
+        if newCount == chunkCount:
+            for n in range(newCount):
+                self._chunks[first+n] = chunks[n]
+                self._addToChunk(first+n, chunkLengths[n] - self._chunkLengths[first+n])
+        else:
+            self._chunks[first:last+1] = chunks
+            self._chunkLengths[first:last+1] = chunkLengths
+            self._rebuildTree()
+        self._len += inserted - (j-i)
+
+    def setRange(self, i, j, value):
+        i, j = self._checkBounds(i, j)
+        if i >= j:
+            return
+        self._replace(i, j, [(j-i, value)])
+
+# Insert count copies of value before position i. An i at or past the end
+# of the list appends.
+
+    def insert(self, i, value, count = 1):
+        if count <= 0:
+            return
+        i = min(max(i, 0), self._len)
+
+        # Growing the run that already holds the value is by far the most
+        # common case (typing); it only shifts the runs after it in its
+        # chunk.
+        for position in (i-1, i):
+            if 0 <= position and position < self._len:
+                c, chunkStart, k = self._findRun(position)
+                starts, values = self._chunks[c]
+                if values[k] == value:
+                    starts[k+1:] = [start + count for start in starts[k+1:]]
+                    self._addToChunk(c, count)
+                    self._len += count
+                    return
+        self._replace(i, i, [(count, value)])
+
+# Insert every element of theList before position i.
+
+    def insertList(self, i, theList):
+        self.insertRuns(i, compressRuns(theList))
+
+# Insert a list of (run length, value) tuples before position i.
+
+    def insertRuns(self, i, runs):
+        i = min(max(i, 0), self._len)
+        self._replace(i, i, runs)
+
+# Overwrite the elements starting at position i with those of theList. As
+# with a list slice assignment, the list grows if theList runs past its end.
+
+    def replaceList(self, i, theList):
+        self.replaceRuns(i, compressRuns(theList))
+
+# The same as replaceList, for a list of (count, value) runs.
+
+    def replaceRuns(self, i, runs):
+        i = min(max(i, 0), self._len)
+        count = 0
+        for runLength, value in runs:
+            count += max(runLength, 0)
+        self._replace(i, min(i+count, self._len), runs)
+
+# Delete positions i..j-1.
+
+    def delete(self, i, j):
+        i, j = self._checkBounds(i, j)
+        if i >= j:
+            return
+        self._replace(i, j, [])
+
+    def append(self, value):
+        self.insert(self._len, value)
+
+# The following function compresses a list into (run length, value) tuples.
+
+def compressRuns(theList):
+    runs = []
+    if len(theList) == 0:
+        return runs
+    last_value = theList[0]
+    count = 1
+    for value in theList[1:]:
+        if value == last_value:
+            count += 1
         else:
-        if self._rle[pos][1] == 0:
-            self._rle.pop(pos)
-    
-    if doSimplify: self._simplify(pos)
-
-    def __delitem__(self, i):
-    del self[i:i+1]
-
-
-    def _break(self, i):
-        pos, offset = self._findTuplePos(i, 1)
-        if offset == 0 or offset == self._rle[pos][1]: return
-        self._rle[pos][1] -= offset
-        value = self._rle[pos][0]
-        self._rle.insert(pos, [value, offset]) 
-
-    def __setslice__(self, i, j, value):
-        i,j = self._checkSliceBounds(i,j)
-        #first break at the appropriate points
-        self._break(i)
-        self._break(j)
-        #then find appropriate tuples
-        start, end = self._findTuplePos(i), self._findTuplePos(j)
-        #then del appropriate tuples
-        del self._rle[start:end]
-        if len(value) > 0:
-            newList = self._compressList(value)
-            self._rle[start:start] = newList
-            self._simplify(start)
-            self._simplify(start+len(newList)-1)
-    
-
-    
-
-    def __setitem__(self, i, item):
-    self.insert(i, item)
-    del self[i+1:i+2]
-    self._simplify(self._findTuplePos(i))
-
-    def __eq__(self, item):
-    print "This does not seem to work...?"
-    self[:] = item
-
-    def append(self, item):
-    #If we are not looking at an empty array then we see if the new item is the same as the last value in the list. If it is increment the run by one. If it is not, put the new value on the end of the list with a run length of 1.
-    if len(self._rle) > 0:
-        value, run = self._rle[-1]
-        if value == item:
-        self._rle[-1][1] += 1
-        self._len += 1
-        return
-        
-    self._rle.append([item, 1])
-    self._len += 1
-    
-
-    def insert(self, i, item):
-    try:
-        pos, offset = self._findTuplePos(i, 1)
-    except IndexError:
-        self.append(item)
-        return
-
-    if len(self) == 0:
-        self.append(item)
-        self._simplify(0)
-        return
-   
-    startRun = offset
-    endRun = self._rle[pos][1] - startRun
-
-    if self._rle[pos][0] == item:
-        self._rle[pos][1] += 1
-    elif startRun == 0:
-        self._rle.insert(pos, [item,1])
-    elif endRun == 0:
-        self._rle.insert(pos+1, [item,1])
-    else:
-        oldValue = self._rle[pos][0]
-        
-        self._rle[pos][1] = startRun
-        self._rle.insert(pos+1, [item,1])
-        self._rle.insert(pos+2, [oldValue, endRun])
\ No newline at end of file
+            runs.append((count, last_value))
+            count = 1
+            last_value = value
+    runs.append((count, last_value))
+    return runs
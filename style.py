@@ -188,30 +188,24 @@ class StylePool( list ):
 # -------------------------------------
 
 
-# Until the bugs get sorted out, use a regular list.
-#from run_length_list import RLE_List
+from run_length_list import RLE_List
 
 # The next class uses the StylePool[] index numbers as the value assosciated with each position.
+# Style runs are very long in practice, so the style numbers are kept in a run
+# length encoded list rather than as one integer per character.
 
 class StyleArray:
     def __init__(self, associatedTextArray = None, defaultStyleNumber = 0):
-# Until the bugs get sorted out, use a regular list.
-        self._styleNumbers = []
-        #self._styleNumbers = RLE_List()
+        self._styleNumbers = RLE_List()
         
         self.defaultStyle = defaultStyleNumber
         if associatedTextArray:
-            for i in range(associatedTextArray.getLength()):
-                    self._styleNumbers.insert(i, defaultStyleNumber)
+            self._styleNumbers.insert(0, defaultStyleNumber, associatedTextArray.getLength())
 
     def clear(self, associatedTextArray ):
-        del self._styleNumbers
-# Until the bugs get sorted out, use a regular list.
-        self._styleNumbers = []
-        #self._styleNumbers = RLE_List()
+        self._styleNumbers = RLE_List()
         if associatedTextArray:
-            for i in range(associatedTextArray.getLength()):
-                    self._styleNumbers.insert(i, self.defaultStyle)
+            self._styleNumbers.insert(0, self.defaultStyle, associatedTextArray.getLength())
 
     def isValidPos(self, pos):
         if 0<= pos and pos < self.getLength():
@@ -220,22 +214,26 @@ class StyleArray:
 
     def setStyleInRange(self, styleID, startPos, endPos):
         #Remember that python uses slices... we don't. We need to add one to the endPos.
-        self._styleNumbers[startPos:endPos+1] = [styleID] * (endPos+1-startPos)
+        self._styleNumbers.setRange(startPos, endPos+1, styleID)
 
     def getDefaultStyle(self):
         return self.defaultStyle
 
     def setDefaultStyle(self, styleID):
         self.defaultStyle = styleID
-        #The slice insures that whatever type of object _styleNumbers is (it might be
-        #a re-implementation of list) it will not be replaced by a list object.
-        self._styleNumbers[:] = [styleID] * len(self._styleNumbers)
+        self._styleNumbers.setRange(0, len(self._styleNumbers), styleID)
 
     def getLength(self):
         return len(self._styleNumbers)
 
     def getStyles(self):
-        return self._styleNumbers
+        return self._styleNumbers.toList()
+
+# Returns the styles of positions startPos..endPos inclusive as a list of
+# (run length, styleID) tuples, in the format of save_and_load.compressList.
+
+    def getRuns(self, startPos, endPos):
+        return self._styleNumbers.getRuns(startPos, endPos+1)
 
     def getCharStyle(self,position):
         if position < 0 or self.getLength()-1 < position:
@@ -245,35 +243,41 @@ class StyleArray:
     def setCharStyle(self, position, styleID):
         if position < 0 or self.getLength()-1 < position:
             return
-        self._styleNumbers[position] = styleID
+        self._styleNumbers.setRange(position, position+1, styleID)
 
     def getSubString(self, startPos, endPos):
-        return self._styleNumbers[startPos:endPos+1]
+        return self._styleNumbers.toList(startPos, endPos+1)
 
     def replaceStyles(self, styleString, insertPos):
-        self._styleNumbers[insertPos:insertPos+len(styleString)] = styleString
+        self._styleNumbers.replaceList(insertPos, styleString)
+
+# Overwrites the styles starting at startPos with a list of (run length,
+# styleID) tuples, as returned by getRuns().
+
+    def setRuns(self, startPos, runs):
+        self._styleNumbers.replaceRuns(startPos, runs)
 
     def addText(self, newString, insertPos, styleID = None):
-        if insertPos < 0 or len(self._styleNumbers)-1 < insertPos :
-            insertPos = -1
+        if insertPos < 0 or self.getLength()-1 < insertPos :
+            insertPos = self.getLength()
         if styleID == None:
             if self.getLength() > 0:
                 styleID = self.getCharStyle(insertPos)
             else:
                 styleID = self.defaultStyle
-        self._styleNumbers[insertPos:insertPos] = [styleID] * len(newString)
+        self._styleNumbers.insert(insertPos, styleID, len(newString))
 
     def delText(self, start, end):
         if end < start:
             return
-        if len(self._styleNumbers) - 1 < start:
+        if self.getLength() - 1 < start:
             return
         if end < 0:
             return
         if start < 0:
             start = 0
         
-        if len(self._styleNumbers) - 1 < end:
-            end = len(self._styleNumbers) - 1
+        if self.getLength() - 1 < end:
+            end = self.getLength() - 1
 
-        del self._styleNumbers[start:end+1]
+        self._styleNumbers.delete(start, end+1)
@@ -77,3 +77,25 @@ class PygameSurface(drawing_surface.DrawingSurface):
     def blitRectangle(self, surface, (ypos,xpos) ):
         self.pygameSurface.blit( surface.pygameSurface, [ypos,xpos] )
 
+# An AlphaStrip draws translucent rectangles of one color, like
+# PygameSurface.drawRectangle, but from a surface that is filled once and
+# reused, instead of a new one on every call. The strip grows when a larger
+# rectangle is drawn.
+
+class AlphaStrip:
+    def __init__(self, color, alpha):
+        self.color = color
+        self.alpha = alpha
+        self._surface = None
+
+    def draw(self, drawingSurface, widthHeight, xyPos):
+        width, height = int(widthHeight[0]), int(widthHeight[1])
+        stripWidth, stripHeight = 0, 0
+        if self._surface <> None:
+            stripWidth, stripHeight = self._surface.get_size()
+        if self._surface == None or width > stripWidth or height > stripHeight:
+            self._surface = pygame.Surface( (max(width, stripWidth), max(height, stripHeight)) )
+            self._surface.fill(self.color)
+            self._surface.set_alpha(self.alpha)
+        drawingSurface.pygameSurface.blit(self._surface, xyPos, (0, 0, width, height))
+
@@ -37,6 +37,18 @@ class Text:
         self.behaviorArray = behavior.BehaviorArray(self.textArray)
         self._is_changed = 1
         self.observers = []
+        self._journal = None
+
+# The journal given here (see journal.py) is told about every change made
+# to the text, style and behavior arrays. Pass None to stop journaling.
+
+    def setJournal(self, journal):
+        self._journal = journal
+        self.behaviorArray.setJournal(journal)
+
+    def _journalStyles(self, startPos, endPos):
+        if self._journal:
+            self._journal.recordStyles(max(startPos, 0), self.styleArray.getRuns(startPos, endPos))
 
     def clear(self):
         self.textArray.clearText()
@@ -105,14 +117,19 @@ class Text:
             o.onDelText(startPos, endPos)
 
     def _notifyStyleChange(self, startPos, endPos):
-        self._notifyDelText(startPos, endPos)
-        self._notifyAddText(startPos, endPos - startPos + 1)
+        self._is_changed = 1
 
-# addText adds text and styles to the insert position.
-# It will work with behaviors later.
+        for o in self.observers:
+            o.onStyleChange(startPos, endPos)
+
+# addText adds text, styles and behaviors to the insert position. Like the
+# style, the behavior may be a single behavior ID for all of the new text,
+# or a list of behavior IDs, one for each character.
 
     def addText(self, newText, startPos, theStyle=None, behaviorString=None):
         insertPos = startPos
+        if not self.isValidPos(insertPos):
+            insertPos = self.getLength()
 
         try:
             newText = unicode(newText)
@@ -128,8 +145,16 @@ class Text:
         elif type(theStyle) == list:
             self.styleArray.replaceStyles(theStyle, insertPos)
 
+        if self._journal:
+            self._journal.recordAddText(insertPos, newText, self.styleArray.getRuns(insertPos, insertPos+len(newText)-1))
+
+        if type(behaviorString) == int:
+            self.behaviorArray.setBehaviorInRange(behaviorString, insertPos, insertPos+len(newText)-1)
+        elif type(behaviorString) == list:
+            self.behaviorArray.replaceBehaviors(behaviorString, insertPos)
+
         self._notifyAddText(insertPos, len(newText))
-        self.onAddText(newText, startPos)
+        self.onAddText(newText, insertPos)
 
     def onAddText(self):
         pass
@@ -138,6 +163,8 @@ class Text:
         self.textArray.delText(startPos, endPos)
         self.styleArray.delText(startPos, endPos)
         self.behaviorArray.delText(startPos, endPos)
+        if self._journal:
+            self._journal.recordDelText(startPos, endPos)
         self._notifyDelText(startPos, endPos)
         self.onDelText(startPos, endPos)
 
@@ -152,17 +179,22 @@ class Text:
     def setStyle(self, theStyle, startPos, endPos = None):
         if   type(theStyle) == int:
             self.styleArray.setStyleInRange(theStyle, startPos, endPos)
+            self._journalStyles(startPos, endPos)
         elif type(theStyle) == list:
             self.styleArray.replaceStyles(theStyle, startPos)
+            self._journalStyles(startPos, startPos + len(theStyle) - 1)
             endPos = startPos + len(theStyle)
         self._notifyStyleChange(startPos, endPos)
 
     def setStyleOverlay(self, overlay, startPos, endPos = None):
         if endPos == None: endPos = startPos
-        for pos in range(startPos, endPos + 1):
-            currentStyle = self.styleArray.getCharStyle(pos)
+        #The overlay is merged once per style run instead of once per character.
+        pos = max(startPos, 0)
+        for runLength, currentStyle in self.styleArray.getRuns(startPos, endPos):
             newStyle = archyState.stylePool.mergeStyleWithOverlay(currentStyle, overlay)
-            self.styleArray.setCharStyle(pos, newStyle)
+            self.styleArray.setStyleInRange(newStyle, pos, pos + runLength - 1)
+            pos += runLength
+        self._journalStyles(startPos, endPos)
         self._notifyStyleChange(startPos, endPos)
 
 # --------------------------
@@ -18,15 +18,31 @@ VERSION = "$Id: text_array.hpy,v 1.16 2005/02/10 23:06:51 andrewwwilson Exp $"
 
 # Archy wide global items
 import archy_globals
+import leap_search
+
+import array
 
 # --------------------------
 # The TextArray class
 # --------------------------
 
-# Eventually we will move to use the array module for faster access to text.
-# Eventually, we will move to using a proper Buffer Gap for better memory usage.
+# The text is kept in a Buffer Gap: a single array of characters with an
+# unused region (the gap) sitting at the most recent edit position. Typing
+# at the cursor fills the gap and deleting at the cursor widens it, so
+# both are cheap no matter how large the Humane Document gets. Moving the
+# gap to a new edit position only copies the characters between the old
+# and the new position, and that copy is done by the array module in C.
+
+# The gap is grown geometrically whenever it runs out, so that inserting
+# at the cursor is amortised O(1).
 
-# For now, we will make do with the Python string.
+# Searches don't need the text as one contiguous string: they read it in
+# windows around the search position (see leap_search.py), so a search
+# right after an edit costs no more than the distance to its match. The
+# whole text is only joined for the callers of _getContents(), and cached
+# until the next edit.
+
+MIN_GAP_SIZE = 1024
 
 class TextArray:
     def __init__(self, contents):
@@ -34,37 +50,133 @@ class TextArray:
 
     def initialize(self, contents=""):
         #print "in TextContent.initialize()"
-        self._contents = contents
+        try:
+            contents = unicode(contents)
+        except:
+            contents = unicode(contents, 'iso-8859-1')
+        self._buffer = array.array('u', contents)
+        self._gapStart = len(self._buffer)
+        self._gapEnd = len(self._buffer)
+        self._contents = None
+        self._version = 0
+        self._leapSearch = leap_search.LeapSearch()
         self._touched = 0
         
     def clearText(self):
         self.initialize()
 
     def getLength(self):
-        return len(self._contents)
+        return len(self._buffer) - (self._gapEnd - self._gapStart)
+
+# --------------------------
+# Buffer Gap management
+# --------------------------
+
+# Move the gap so that it starts at text position pos.
+
+    def _moveGap(self, pos):
+        if pos < self._gapStart:
+            count = self._gapStart - pos
+            self._buffer[self._gapEnd-count:self._gapEnd] = self._buffer[pos:self._gapStart]
+            self._gapStart -= count
+            self._gapEnd -= count
+        elif pos > self._gapStart:
+            count = pos - self._gapStart
+            self._buffer[self._gapStart:pos] = self._buffer[self._gapEnd:self._gapEnd+count]
+            self._gapStart += count
+            self._gapEnd += count
+
+# Make sure the gap can hold at least size characters.
+
+    def _ensureGap(self, size):
+        gapSize = self._gapEnd - self._gapStart
+        if gapSize >= size:
+            return
+        growBy = max(size - gapSize, self.getLength() / 2, MIN_GAP_SIZE)
+        self._buffer[self._gapEnd:self._gapEnd] = array.array('u', u' ' * growBy)
+        self._gapEnd += growBy
+
+# Return the whole text as a single string. The result is cached until
+# the text is next modified.
+
+    def _getContents(self):
+        if self._contents is None:
+            self._contents = self._buffer[:self._gapStart].tounicode() + self._buffer[self._gapEnd:].tounicode()
+        return self._contents
+
+# Return the text from position start up to (but not including) end.
+
+    def _getText(self, start, end):
+        if end <= start:
+            return u""
+        return self.getSubString(start, end-1)
+
+    def _modified(self):
+        self._contents = None
+        self._version += 1
+        self._touched = 1
+
+# raw_find and raw_rfind take their start and end like the string methods
+# do, and search outward from start (or back from end) a window at a time.
+
+    def _sliceBounds(self, start, end):
+        length = self.getLength()
+        if end < 0:
+            end = max(end + length, 0)
+        if start < 0:
+            start = max(start + length, 0)
+        return start, min(end, length)
 
     def raw_find(self, sub, start=0, end=-1):
-        return self._contents.find(sub, start, end)
+        start, end = self._sliceBounds(start, end)
+        if len(sub) == 0:
+            return self._getText(0, end).find(sub, start)
+        return leap_search.searchWindows(self._getText, lambda text, direction: text.find(sub), len(sub), start, end, leap_search.FORWARD)
 
     def raw_rfind(self, sub, start=0, end=-1):
-        return self._contents.rfind(sub, start, end)
+        start, end = self._sliceBounds(start, end)
+        if len(sub) == 0:
+            return self._getText(0, end).rfind(sub, start)
+        return leap_search.searchWindows(self._getText, lambda text, direction: text.rfind(sub), len(sub), start, end, leap_search.BACKWARD)
+
+# Find a Leap pattern. Searching forward returns the first match starting
+# at or after start; searching backward returns the last match ending
+# before start.
 
     def find(self, pattern, start, direction = 1):
-        return self._boyerMooreFind(pattern, start, direction)
+        if direction == 1:
+            return self._leapSearch.find(self._getText, self._version, self.getLength(), pattern, start, self.getLength(), leap_search.FORWARD)
+        else:
+            return self._leapSearch.find(self._getText, self._version, self.getLength(), pattern, 0, start, leap_search.BACKWARD)
+
+# Return a generator of the positions of every non-overlapping Leap match
+# lying entirely within positions start..end-1, in order. Use this rather
+# than calling find() repeatedly when more than one match is wanted.
+
+    def findAll(self, pattern, start = 0, end = None):
+        if end == None:
+            end = self.getLength()
+        return self._leapSearch.findAll(self._getText, self.getLength(), pattern, start, end)
+
+    def countAll(self, pattern, start = 0, end = None):
+        count = 0
+        for pos in self.findAll(pattern, start, end):
+            count += 1
+        return count
 
     def _boyerMooreFind(self, pattern, start, direction):
         import bmh_search
         if direction == 1:
-            return bmh_search.BMHSearchForward(self._contents, pattern, start)
+            return bmh_search.BMHSearchForward(self._getContents(), pattern, start)
         else:
-            return bmh_search.BMHSearchBackward(self._contents, pattern, 0, start)
+            return bmh_search.BMHSearchBackward(self._getContents(), pattern, 0, start)
 
     def _naiveFind(self, pattern, start, direction):
 
 # NOTE: This method does not perform a search as per the Leap spec.  Specifically, the search is entirely case-insensitive, even if there are capital letters in the pattern string.
 
         pattern = pattern.lower()
-        content = self._contents.lower()
+        content = self._getContents().lower()
         if direction == 1:
             return content.find(pattern, start)
         else:
@@ -72,19 +184,20 @@ class TextArray:
 
     def addText(self, value, pos=-1):
         #print "in content.TextContent.addText:" + str(value) + "<< pos=" + str(pos)
-        if pos < 0 or len(self._contents)-1 < pos :
-            pos = -1
+        if pos < 0 or self.getLength()-1 < pos :
+            pos = self.getLength()
 
-        #print "TextContent.addText(). pos = ", pos,
-        #print "value="+value+"<<"
-        if pos == -1:
-            self._contents = self._contents + value
-        else:
-            self._contents = "".join((self._contents[0:pos], value, self._contents[pos:len(self._contents)]))
+        try:
+            value = unicode(value)
+        except:
+            value = unicode(value, 'iso-8859-1')
 
-        #print "contents:"+self._contents
+        self._moveGap(pos)
+        self._ensureGap(len(value))
+        self._buffer[self._gapStart:self._gapStart+len(value)] = array.array('u', value)
+        self._gapStart += len(value)
 
-        self._touched = 1
+        self._modified()
 
 # Delete text from start..end inclusive.  start and end are enforced to be positive and valid
 
@@ -92,7 +205,7 @@ class TextArray:
         if end < start:
             return
 
-        if len(self._contents) - 1 < start:
+        if self.getLength() - 1 < start:
             return
 
         if end < 0:
@@ -101,16 +214,13 @@ class TextArray:
         if start < 0:
             start = 0
 
-        if len(self._contents) - 1 < end:
-            end = len(self._contents) - 1
-
-
-        self._contents = self._contents[0:start] + \
-            self._contents[end+1: len(self._contents)]
-
-        self._touched = 1
+        if self.getLength() - 1 < end:
+            end = self.getLength() - 1
 
+        self._moveGap(start)
+        self._gapEnd += end - start + 1
 
+        self._modified()
 
     def wasTouched(self):
         if self._touched:
@@ -122,13 +232,16 @@ class TextArray:
 # Return a character at position pos
 
     def getChar(self,pos):
-        return self._contents[pos:pos+1]
+        if pos < 0 or self.getLength()-1 < pos:
+            return u""
+        if pos >= self._gapStart:
+            pos += self._gapEnd - self._gapStart
+        return self._buffer[pos]
 
 # Return a substring from positions start..end inclusive.
 
     def getSubString(self, start, end):
-        pass
-        n = len(self._contents)-1
+        n = self.getLength()-1
         if end < 0:
             return ""
         if n < start:
@@ -137,4 +250,13 @@ class TextArray:
             return ""
         start = archy_globals.bound(start,0,n)
         end = archy_globals.bound(end,0,n)
-        return self._contents[start:end+1]
\ No newline at end of file
+
+        if self._contents is not None:
+            return self._contents[start:end+1]
+
+        gapSize = self._gapEnd - self._gapStart
+        if end < self._gapStart:
+            return self._buffer[start:end+1].tounicode()
+        if start >= self._gapStart:
+            return self._buffer[start+gapSize:end+1+gapSize].tounicode()
+        return self._buffer[start:self._gapStart].tounicode() + self._buffer[self._gapEnd:end+1+gapSize].tounicode()
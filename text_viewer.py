@@ -15,12 +15,22 @@
 
 # --- --- ---
 # --- --- ---
+import bisect
 import glyph
 import line
 import surfaces
 import archy_globals
+import word_wrap
 from archy_state import archyState
 
+# When PARAGRAPH_WRAP is set, addGlyphsWordwrap() lays out whole paragraphs with the wrap engine in word_wrap.py instead of wrapping glyph by glyph.
+
+PARAGRAPH_WRAP = 1
+
+# Paragraphs are turned into glyphs in windows of at most PARAGRAPH_WINDOW characters, so that a very long paragraph doesn't have to be turned into glyphs all at once to show one screen of it. A window that ends inside a paragraph ends at a soft boundary, after a space if there is one near the end of the window, and the text after a soft boundary starts a new line. More windows are generated as the screen scrolls.
+
+PARAGRAPH_WINDOW = 4096
+
 # debugging code to print if on_screen_part has changed.
 
 printed_selection_ranges = {}
@@ -120,6 +130,8 @@ def print_if_changed(selNum, selection_range):
 # -TextViewer.TextPosToScreenLinePos(self, textPos)
 # If the textPos is within the bounds [firstScreenPosition..lastScreenPosition], return the (line,offset). The line will have an entry in the Python map data type lineYPositions and together with the widths of the glyphs, the rectangle position of a glyph on the screen can be calculated.
 
+# These methods do not walk the linked list of lines. They use a line index: the list of lines, the offset (from the firstGlyphPosition) at which each line ends, and the number of each line. The index is built with a single walk of the lines the first time it is needed after the lines have changed, and then answers each mapping with a binary search.
+
 # --- --- ---
 # onAddText and onDelText and rewrapping of the lines
 # --- --- ---
@@ -140,6 +152,8 @@ class TextViewer:
     self._convert_document_and_page_characters = 0
     self.show_cursor = 1
     self._cursor_changed = 1
+    self.cursorLine = None
+    self.cursorPosOnLine = 0
     self.document = documentText
     self.document.addObserver(self)
     self._isTransparent = isTransparent
@@ -147,6 +161,14 @@ class TextViewer:
     self.documentCharacterGlyph = glyph.DocumentCharacterGlyph()
     self.pageCharacterGlyph = glyph.PageCharacterGlyph()
 
+    # Manage the damage tracking (see render()).
+    self._dirtyLines = {}
+    self._dirtyRects = []
+    self._linesToRender = None
+    self._renderedLinePositions = {}
+    self._renderedBottom = 0
+    self._renderedFlags = None
+
     self.setSurfaces(surface)
     self.initializeContent()
     self._needs_redraw=1
@@ -165,8 +187,11 @@ class TextViewer:
   def _clearContent(self):
     # Manage the lines of glyphs.
     self.startLine = line.Line(self)
+    self._lineIndex = None
     self.firstGlyphPosition = -1
     self.lastGlyphPosition = -1
+    self._firstGlyphPositionSoft = 0
+    self._lastGlyphPositionSoft = 0
 
     # Manage the screen.
     self.topLine = self.startLine
@@ -181,18 +206,19 @@ class TextViewer:
     self.documentCharacterGlyph.setWidth(glyphWidth)
     self.pageCharacterGlyph.setWidth(glyphWidth)
     self.surface.clear()
+    self.invalidate()
   # end setSurfaces
 
 # TextViewer: Check the validity of variables used to manage the linked list of lines and glyphs.
 
-# --- (firstGlyphPosition - 1) indexes a new line character.
+# --- (firstGlyphPosition - 1) indexes a new line character, unless firstGlyphPosition is a soft boundary.
 
   def isFirstGlyphPositionValid(self):
 
     if self.firstGlyphPosition < 0:
       return False
 
-    if self.firstGlyphPosition == 0:
+    if self.firstGlyphPosition == 0 or self._firstGlyphPositionSoft:
       return True
 
     if self.firstGlyphPosition > 0:
@@ -230,7 +256,7 @@ class TextViewer:
     return offset
   # end recalibrateFirstScreenPosition
 
-# - lastGlyphPosition indexes a new line character or the last character in Humane Document.
+# - lastGlyphPosition indexes a new line character or the last character in Humane Document, unless it is a soft boundary.
 
   def isLastGlyphPositionValid(self):
 
@@ -243,6 +269,9 @@ class TextViewer:
     if self.lastGlyphPosition == docLength-1:
       return True
 
+    if self._lastGlyphPositionSoft:
+      return self.lastGlyphPosition < docLength
+
     if d.getChar(self.lastGlyphPosition) == "\n":
       return True
     else:
@@ -269,28 +298,47 @@ class TextViewer:
     if N == 0: 
       return currLine, posInLine
 
-    if N > 0:
-      if currLine.getLength() - posInLine - N > 0:
-        return currLine, posInLine + N
-      if currLine.Next == None:
-        return currLine, currLine.getLength() -1
-      N -= currLine.getLength() - posInLine
-      while N >= 0:
+    if 0 <= posInLine + N and posInLine + N < currLine.getLength():
+      return currLine, posInLine + N
+
+    lines, lineEnds, lineNumbers = self._getLineIndex()
+    lineNumber = lineNumbers[currLine]
+    return self._lineIndexPos(lineEnds[lineNumber] - currLine.getLength() + posInLine + N)
+
+# --- --- ---
+# TextViewer._getLineIndex
+
+# Returns the line index: the list of lines from the startLine on, the offset from the start of the startLine at which each line ends, and a map from each line to its number. Any method that adds, removes or rewraps lines must call _invalidateLineIndex().
+
+  def _getLineIndex(self):
+    if self._lineIndex is None:
+      lines = []
+      lineEnds = []
+      lineNumbers = {}
+      offset = 0
+      currLine = self.startLine
+      while currLine is not None:
+        lineNumbers[currLine] = len(lines)
+        lines.append(currLine)
+        offset += len(currLine._glyphs)
+        lineEnds.append(offset)
         currLine = currLine.Next
-        N -= len(currLine._glyphs)
-      return currLine, currLine.getLength() + N
-
-    if N < 0:
-      N *= -1
-      if posInLine - N >= 0:
-        return currLine, posInLine - N
-      if currLine.Previous == None:
-        return currLine, 0
-      N -= posInLine
-      while N > 0:
-        currLine = currLine.Previous
-        N -= len(currLine._glyphs)
-      return currLine, -N
+      self._lineIndex = lines, lineEnds, lineNumbers
+    return self._lineIndex
+
+  def _invalidateLineIndex(self):
+    self._lineIndex = None
+
+# The following method returns the (line, position) of an offset from the start of the startLine. Like movePosition, it returns the first or last position of the lines for offsets outside of them.
+
+  def _lineIndexPos(self, offset):
+    lines, lineEnds, lineNumbers = self._getLineIndex()
+    if offset < 0:
+      return lines[0], 0
+    lineNumber = bisect.bisect_right(lineEnds, offset)
+    if lineNumber == len(lines):
+      return lines[-1], lines[-1].getLength() - 1
+    return lines[lineNumber], offset - lineEnds[lineNumber] + lines[lineNumber].getLength()
 
 # --- --- ---
 # TextViewer.textPosToLinePos.
@@ -306,7 +354,7 @@ class TextViewer:
 
     if textPos < self.firstGlyphPosition or textPos > self.lastGlyphPosition:
       return None, -1
-    line, posOnLine = self.movePosition(self.startLine, 0, textPos-self.firstGlyphPosition)
+    line, posOnLine = self._lineIndexPos(textPos-self.firstGlyphPosition)
     return line, posOnLine
   # end textPosToLinePos
 
@@ -320,13 +368,9 @@ class TextViewer:
     if self.firstGlyphPosition == -1:
       return -1
     
-    offset = 0
-    currLine = self.startLine
-    while currLine <> line:
-      offset = offset + currLine.getLength()
-      currLine = currLine.getNext()
-    offset = offset + pos
-    return offset
+    lines, lineEnds, lineNumbers = self._getLineIndex()
+    lineNumber = lineNumbers[line]
+    return lineEnds[lineNumber] - line.getLength() + pos
   #end findOffset
 
 # --- --- ---
@@ -377,21 +421,18 @@ class TextViewer:
     #Backtrack to the last newline.
 
     maxHeight = self.surface.getHeight()
-    tA = self.document.textArray
-    lineBreakBeforeCursor = tA.raw_rfind('\n', 0, cursorPosInText)
-    lineBreakAfterCursor = tA.raw_find('\n', cursorPosInText)
-    if lineBreakAfterCursor == -1:
-      lineBreakAfterCursor = tA.getLength()-1
-    #print "range: %d to %d" % (lineBreakBeforeCursor, lineBreakAfterCursor)
-    #print "text: %s" % str([contents[lineBreakBeforeCursor:lineBreakAfterCursor]])
 
-# Note if a new line was not found before the cursor, lineBreakBeforeCursor == -1 and the value of lineBreakBeforeCursor+1 == 0. Therefore the value of firstGlyphPosition will be correctly set to 0 (first character of humane document) if a new line can not be found before the cursor. See also _generatePreviousLines() for similar usage of the "not found" return value of -1.
+# The first window is the part of the cursor's paragraph within half a window of the cursor on either side.
 
-    glyphsToAdd = self.generateGlyphList(lineBreakBeforeCursor+1, lineBreakAfterCursor-lineBreakBeforeCursor)
-    self.addGlyphsWordwrap(glyphsToAdd, self.startLine)
+    windowStart, self._firstGlyphPositionSoft = self._findWindowStart(cursorPosInText, PARAGRAPH_WINDOW/2)
+    windowEnd, self._lastGlyphPositionSoft = self._findWindowEnd(cursorPosInText, PARAGRAPH_WINDOW/2)
+    #print "range: %d to %d" % (windowStart, windowEnd)
+
+    glyphsToAdd = self.generateGlyphList(windowStart, windowEnd+1-windowStart)
+    self.addGlyphsWordwrap(glyphsToAdd, self.startLine, 0)
 
-    self.firstGlyphPosition = lineBreakBeforeCursor+1
-    self.lastGlyphPosition = lineBreakAfterCursor
+    self.firstGlyphPosition = windowStart
+    self.lastGlyphPosition = windowEnd
 
     self.cursorLine, self.cursorPosOnLine = self.textPosToLinePos(cursorPosInText)
 
@@ -433,30 +474,72 @@ class TextViewer:
 # At this point the firstGlyphPosition, firstScreenPosition, and lastGlyphPosition have been set properly. The call to calcVisibleLineInfo will set the lastScreenPosition correctly and fill the lineYPositions map.
 
     height = self.calcVisibleLineInfo()
-    self._needs_redraw = 1
+    self.invalidate()
   #end regenerateTextAroundCursor
 
+# --- --- ---
+# TextViewer._findWindowStart
+
+# Returns the position of the first character of the window of text that ends just before endPos, and whether that position is a soft boundary. The window starts after the last new line before endPos, or at the start of the Humane Document, if that is no more than windowSize characters back; otherwise it starts at a soft boundary.
+
+  def _findWindowStart(self, endPos, windowSize):
+    tA = self.document.textArray
+    limit = endPos - windowSize
+
+# Note if a new line was not found, raw_rfind returns -1 and the window starts at 0 (first character of humane document).
+
+    if limit <= 0:
+      return tA.raw_rfind('\n', 0, endPos) + 1, 0
+    lineBreak = tA.raw_rfind('\n', limit, endPos)
+    if lineBreak <> -1:
+      return lineBreak + 1, 0
+    space = tA.raw_find(' ', limit, limit + windowSize/8)
+    if space <> -1:
+      return space + 1, 1
+    return limit, 1
+  # end _findWindowStart
+
+# --- --- ---
+# TextViewer._findWindowEnd
+
+# Returns the position of the last character of the window of text that starts at startPos, and whether that position is a soft boundary. The window ends with the first new line at or after startPos, or with the last character of the Humane Document, if that is less than windowSize characters on; otherwise it ends at a soft boundary.
+
+  def _findWindowEnd(self, startPos, windowSize):
+    tA = self.document.textArray
+    textLength = tA.getLength()
+    limit = startPos + windowSize
+
+    if limit >= textLength:
+      lineBreak = tA.raw_find('\n', startPos, textLength)
+      if lineBreak == -1:
+        return textLength - 1, 0
+      return lineBreak, 0
+    lineBreak = tA.raw_find('\n', startPos, limit)
+    if lineBreak <> -1:
+      return lineBreak, 0
+    space = tA.raw_rfind(' ', limit - windowSize/8, limit)
+    if space <> -1:
+      return space, 1
+    return limit - 1, 1
+  # end _findWindowEnd
+
 # --- --- ---
 # TextViewer._generateNextLines
 
-# Add a paragraph of lines to the linked list of lines at tail. Adjust the lastGlyphPosition.
+# Add a window of lines (a paragraph, or part of a long one) to the linked list of lines at tail. Adjust the lastGlyphPosition.
 
   def _generateNextLines(self, bottomLine):
     tA = self.document.textArray
     if self.lastGlyphPosition == tA.getLength()-1:
       return 0
-    lineBreakAfterEnd = tA.raw_find('\n', self.lastGlyphPosition+1)
+    self._invalidateLineIndex()
+    windowEnd, self._lastGlyphPositionSoft = self._findWindowEnd(self.lastGlyphPosition+1, PARAGRAPH_WINDOW)
 
-    if lineBreakAfterEnd == -1:
-      # There is no new line beyond last Glyph Position. 
-      # Just set to the last character position of the humane document
-      lineBreakAfterEnd = tA.getLength()-1
-
-    strLen = lineBreakAfterEnd - self.lastGlyphPosition
+    strLen = windowEnd - self.lastGlyphPosition
     glyphsToAdd = self.generateGlyphList(self.lastGlyphPosition+1, strLen)
     bottomLine.insertNewLineAfter()
     bottomLine = bottomLine.Next
-    self.addGlyphsWordwrap(glyphsToAdd, bottomLine)
+    self.addGlyphsWordwrap(glyphsToAdd, bottomLine, 0)
     self.lastGlyphPosition += strLen
     return 1
   #end _generateNextLines
@@ -464,28 +547,26 @@ class TextViewer:
 # --- --- ---
 # TextViewer._generatePreviousLines
 
-# Add a single paragraph of lines to the linked list of lines at head. Adjust the firstGlyphPosition.
+# Add a single window of lines (a paragraph, or part of a long one) to the linked list of lines at head. Adjust the firstGlyphPosition.
 
 
   def _generatePreviousLines(self):
     if self.firstGlyphPosition == 0:
       return 0
-    tA = self.document.textArray
+    self._invalidateLineIndex()
 
-    # note that the slice notation for rfind will search for a line break
-    # in 0..self.firstGlyphPosition-2. The line break on firstGlyphPosition - 1 will
-    # not be in the search range.
+    # note that the window ends with the character at firstGlyphPosition-1,
+    # which is either the line break ending the previous paragraph or the
+    # character before a soft boundary.
     #
-    lineBreakBeforeStart = tA.raw_rfind('\n', 0, self.firstGlyphPosition-1)
-
-# Note if a new line was not found before the firstGlyphPosition, lineBreakBeforeStart == -1 and the value of lineBreakBeforeStart+1 == 0 . Therefore the value of firstGlyphPosition will be correctly set to 0 (first character of humane document) if a paragraph break can not be found before the cursor. See also regenerateTextAroundCursor().
+    windowStart, self._firstGlyphPositionSoft = self._findWindowStart(self.firstGlyphPosition-1, PARAGRAPH_WINDOW)
 
-    strLen = self.firstGlyphPosition-1 - lineBreakBeforeStart
-    glyphsToAdd = self.generateGlyphList(lineBreakBeforeStart+1, strLen)
+    strLen = self.firstGlyphPosition - windowStart
+    glyphsToAdd = self.generateGlyphList(windowStart, strLen)
     self.startLine.insertNewLineBefore()
     self.startLine = self.startLine.Previous
     #print "glyphs to add: %s" % get_glyph_str(glyphsToAdd)
-    self.addGlyphsWordwrap(glyphsToAdd, self.startLine)
+    self.addGlyphsWordwrap(glyphsToAdd, self.startLine, 0)
     self.firstGlyphPosition -= strLen
     return 1
   # end _generatePreviousLines
@@ -532,7 +613,7 @@ class TextViewer:
     lSP = self.lastScreenPosition
     lGP = self.lastGlyphPosition
 
-# If the insert position was behind the glyphs, there is no need to change anything. Note that lGP is a new line so newly inserted text after lGP will not affect the lGP due to the rewrapping.
+# If the insert position was behind the glyphs, there is no need to change anything. Note that lGP is a new line (or a soft boundary) so newly inserted text after lGP will not affect the lGP due to the rewrapping.
 
     if lGP < insertPos:
       return
@@ -555,16 +636,24 @@ class TextViewer:
 
 # At this point we know that the fGP <= insertPos and insertPos <= lGP. Within this range, new glyphs will be added and the text will have to be rewrapped.
 
-# This heuristic checks if the work on rewrapping will be more difficult than just redrawing the screen from scratch with regenerateTextAroundCursor. If there are more characters inserted that have to be wrapped than the current glyphs on the screen, we just clear the content and let regenerateTextAroundCursor handle all the adjustments later.
+# If there are more characters inserted than the current glyphs on the screen, only the first window of them (see _findWindowEnd) is turned into glyphs, and the glyphs after the insert position are dropped. The lastGlyphPosition then ends that window, and the rest of the inserted text and the text after it are generated as the screen scrolls, like any other window.
 
-    if lSP - fSP + 1 < length:
-      self._clearContent()
-      return
+    truncate = lSP - fSP + 1 < length
+    if truncate:
+      windowEnd, windowEndSoft = self._findWindowEnd(insertPos, PARAGRAPH_WINDOW)
+      glyphsToAdd = self.generateGlyphList(insertPos, windowEnd+1-insertPos)
+    else:
+      glyphsToAdd = self.generateGlyphList(insertPos, length)
 
 # Find the line and position. Note that firstGlyphPosition is valid at this point since the insert point is behind it. The textPosToLinePos function will work correctly.
 
     line, posOnLine = self.textPosToLinePos(insertPos)
-    glyphsToAdd = self.generateGlyphList(insertPos, length)
+    self._invalidateLineIndex()
+    if truncate:
+      self.disposeLinesAfter(line)
+      glyphsAfterInsert = []
+    else:
+      glyphsAfterInsert = line._glyphs[posOnLine:]
 
 # We're done generating the new glyphs.  Before inserting them, we're going to see if we have a wrapped line (i.e., a line that doesn't end in CR) before the insertion point; if we do, we're going grab all of the glyphs on our current line and add them to the previous line.  This will allow us to deal with situations in which a space character was inserted near the beginning of a line, which breaks the first word of the line into two, allowing the first word to be wrapped up to the previous line.
 
@@ -573,7 +662,7 @@ class TextViewer:
     if line.Previous != None and not line.Previous.endsInNewline():
       #print "LINE HAS PREVIOUS!"
       glyphsToAdd[0:0] = line._glyphs[0:posOnLine]
-      glyphsToAdd.extend(line._glyphs[posOnLine:])
+      glyphsToAdd.extend(glyphsAfterInsert)
       line = line.Previous
       self.disposeOneLine(line.Next)
       if line.Previous != None and not line.Previous.endsInNewline():
@@ -582,12 +671,24 @@ class TextViewer:
         line = line.Previous
         self.disposeOneLine(line.Next)
     else:
-      glyphsToAdd.extend(line._glyphs[posOnLine:])
+      glyphsToAdd.extend(glyphsAfterInsert)
       line._glyphs[posOnLine:] = []
+      line.invalidateMetrics()
 
 # Now we call addGlyphsWordwrap to add the glyphs to the line.
     #print "onAddText: glyphs to add: %s   line: %s" % (get_glyph_str(glyphsToAdd), get_glyph_str(line._glyphs))
-    self.addGlyphsWordwrap(glyphsToAdd, line)
+    self.addGlyphsWordwrap(glyphsToAdd, line, not truncate)
+
+# After a truncated insert, the screen starts at the insert position if it started after it; the screen is then filled from the new window.
+
+    if truncate:
+      self.lastGlyphPosition = windowEnd
+      self._lastGlyphPositionSoft = windowEndSoft
+      if insertPos < fSP:
+        self.firstScreenPosition = insertPos
+      if self.recalibrateFirstScreenPosition() >= 0:
+        self._fillScreen()
+      return
 
 # If the insertPos is before the start of the screen, rewrapping may cause a change in the start of screen.
 # Check for it and adjust the fSP, lSP and lGP accordingly
@@ -601,9 +702,10 @@ class TextViewer:
         height = self.calcVisibleLineInfo()
       self.lastGlyphPosition = archy_globals.updateTextPositionOnAdd(lGP,insertPos, length)
 
-# Even if the insert position is behind the lSP, the rewrap can change the lSP, so do a calcVisibleLineInfo to make sure the lSP is updated for any other condition on the insert position.
+# Even if the insert position is behind the lSP, the rewrap can change the lSP, so do a calcVisibleLineInfo to make sure the lSP is updated for any other condition on the insert position. The rewrap may also have wrapped the topLine up into the line before it, so the topLine is found again first.
 
     if fSP <= insertPos and insertPos <= lGP:
+      self.recalibrateFirstScreenPosition()
       height = self.calcVisibleLineInfo()
       self.lastGlyphPosition = archy_globals.updateTextPositionOnAdd(lGP,insertPos, length)
 
@@ -619,11 +721,17 @@ class TextViewer:
     oldLSP = self.lastScreenPosition
     oldLGP = self.lastGlyphPosition
 
-# If the start of the deletion was behind the glyphs, there is no need to change anything. Note that lGP is a new line so deleted text after lGP will not affect the lGP due to the rewrapping.
+# If the start of the deletion was behind the glyphs, there is no need to change anything. Note that lGP is a new line (or a soft boundary) so deleted text after lGP will not affect the lGP due to the rewrapping.
 
     if oldLGP < delStart:
       return
 
+# If all of the glyphs are deleted, there is nothing left to rewrap.
+
+    if delStart <= oldFGP and oldLGP <= delEnd:
+      self._clearContent()
+      return
+
     import archy_globals
 # We need to obtain deletion line pos before we adjust any of the start positions.
 
@@ -634,18 +742,22 @@ class TextViewer:
 
 
 
+# If the deletion removed the new line before the firstGlyphPosition or after the lastGlyphPosition, the paragraph at that end of the glyphs was joined to the next one; that end becomes a soft boundary. If the deletion reached past the lastGlyphPosition, the glyphs now end just before the deletion.
+
     self.firstGlyphPosition = archy_globals.updateTextPositionOnDelete(oldFGP,delStart, delEnd)
 
     if not self.isFirstGlyphPositionValid():
-      self._clearContent()
-      return
+      self._firstGlyphPositionSoft = 1
 
     self.firstScreenPosition = archy_globals.updateTextPositionOnDelete(oldFSP,delStart, delEnd)
     #lastScreenPosition will be updated via calcVisibleLineInfo()
-    self.lastGlyphPosition  = archy_globals.updateTextPositionOnDelete(oldLGP,delStart, delEnd)
-    if not self.isLastGlyphPositionValid():
-      self._clearContent()
-      return
+    if delStart <= oldLGP and oldLGP <= delEnd:
+      self.lastGlyphPosition = delStart - 1
+      self._lastGlyphPositionSoft = 1
+    else:
+      self.lastGlyphPosition = archy_globals.updateTextPositionOnDelete(oldLGP,delStart, delEnd)
+      if not self.isLastGlyphPositionValid():
+        self._lastGlyphPositionSoft = 1
 
     if glyphDelEnd < glyphDelStart:
       # no glyphs will be deleted so we just need to update the lastScreenPos
@@ -654,38 +766,41 @@ class TextViewer:
 
 # At this point we know that glyphs will be deleted. 
 
-# We use a heuristic that checks if the glyphs that are deleted exceed half of the glyphs in the range [end of deletion..lastGlyphPosition]. If so, we do not bother to delete glyphs and rewrap, and instead just clear the content and return. That is because it is likely that there will not be enough glyphs to draw the screen and we will have to clear the content anyway.
+    self._replaceGlyphs(firstLine, posOnFirstLine, lastLine, posOnLastLine, [])
 
-    screenDelStart, screenDelEnd = archy_globals.intersection( [delStart,delEnd],[oldFSP, oldLGP] )
+# At this point, the glyphs are modified correctly and the firstGlyphPosition and lastGlyphPosition are valid. Because of the rewrapping, the firstScreenPosition may no longer be the 0th offset of the topLine. We need to recalibrate the firstScreenPosition and reset the lastScreenPosition. If the deletion reached past the glyphs, the screen starts on the last line left.
 
-    if screenDelStart <= screenDelEnd:
-      #deletion occurs on the screen
-      numberOfGlyphsToDelete = screenDelEnd - screenDelStart + 1
-      numberOfGlyphsBehindDelete = oldLGP - screenDelEnd
-      if numberOfGlyphsBehindDelete < numberOfGlyphsToDelete * 2:
-        self._clearContent()
-        return
+    if self.firstScreenPosition > self.lastGlyphPosition:
+      self.firstScreenPosition = self.lastGlyphPosition
+    offset = self.recalibrateFirstScreenPosition()
+    if offset >= 0:
+      height = self._fillScreen()
+  # end onDelText
+
+# --- --- ---
+# TextViewer._replaceGlyphs
 
-# Delete the glyphs and rewrap.
+# Replaces the glyphs from posOnFirstLine on firstLine through posOnLastLine on lastLine with newGlyphs, and rewraps them.
 
+  def _replaceGlyphs(self, firstLine, posOnFirstLine, lastLine, posOnLastLine, newGlyphs):
 # First, we'll try to "mass delete" as much of our selection as possible.  We call this "mass deletion" because we are deleting lines of text without performing any other computations, such as word-wrap, which speeds things up.
 
 # During the mass deletion, we will actually delete more of the selection than we need to, to speed things up; we will then quickly add back any deleted characters that weren't actually supposed to be deleted.
 
-    firstLine._needs_recalc_glyph_metrics = 1
-    firstLine._needs_redraw = 1
+    self._invalidateLineIndex()
 
+    glyphsToAdd = newGlyphs
     if firstLine != lastLine:
       while firstLine.Next <> lastLine:
         firstLine.deleteNextLine()
-      glyphsToAdd = firstLine._glyphs[0:posOnFirstLine]
-      glyphsToAdd = lastLine._glyphs[posOnLastLine+1:]
+      glyphsToAdd.extend(lastLine._glyphs[posOnLastLine+1:])
       firstLine.deleteNextLine()
     else:
       #print "posOnFirstLine: %d  posOnLastLine: %d" % (posOnFirstLine, posOnLastLine)
-      glyphsToAdd = firstLine._glyphs[posOnLastLine+1:]
+      glyphsToAdd.extend(firstLine._glyphs[posOnLastLine+1:])
 
     firstLine._glyphs[posOnFirstLine:] = []
+    firstLine.invalidateMetrics()
 
 # If we have a previous line that is word-wrapped (i.e., doesn't end in a CR), then we will delete our entire current line and add it to the end of the last line.  This is for situations in which the user deleted part of the first word on the line so that it can be wrapped up to the previous line.
 
@@ -705,22 +820,55 @@ class TextViewer:
     #print "glyphs to add: %s" % get_glyph_str(glyphsToAdd)
     #print "TheLine: %s" % get_glyph_str(theLine._glyphs)
     self.addGlyphsWordwrap(glyphsToAdd, theLine)
+  # end _replaceGlyphs
 
-# At this point, the glyphs are modified correctly and the firstGlyphPosition and lastGlyphPosition are valid. Because of the rewrapping, the firstScreenPosition may no longer be the 0th offset of the topLine. We need to recalibrate the firstScreenPosition and reset the lastScreenPosition.
+# --- --- ---
+# TextViewer.onStyleChange
 
-    offset = self.recalibrateFirstScreenPosition()
+# The text from startPos through endPos was given new styles. The text and its positions stay the same, so the glyphs in that range are generated again from the document and rewrapped in place.
+
+  def onStyleChange(self, startPos, endPos):
+    import archy_globals
+    if self.firstGlyphPosition < 0:
+      return
+    start, end = archy_globals.intersection( [startPos,endPos],[self.firstGlyphPosition, self.lastGlyphPosition] )
+    if end < start:
+      return
+
+    firstLine, posOnFirstLine = self.textPosToLinePos(start)
+    lastLine, posOnLastLine = self.textPosToLinePos(end)
+    self._replaceGlyphs(firstLine, posOnFirstLine, lastLine, posOnLastLine, self.generateGlyphList(start, end-start+1))
+
+    if self.recalibrateFirstScreenPosition() >= 0:
+      self._fillScreen()
+  # end onStyleChange
+
+# --- --- ---
+# TextViewer._fillScreen
+
+# Recalculates the visible lines, generating lines after the glyphs, and then before them, if there are not enough lines to fill the screen. Returns the height of the visible lines.
+
+  def _fillScreen(self):
+    maxHeight = self.surface.getHeight()
     height = self.calcVisibleLineInfo()
-    screenHeight = self.surface.getHeight()
-    if height < screenHeight:
-      # there were not enough lines in TextViewer to fill the screen.
-      # clear the content so that regenerateTextAroundCursor can be called.
-      self._clearContent()
-  # end onDelText
+    while height < maxHeight:
+      if not self._generateNextLines(self.visibleLines[-1]):
+        break
+      height = self.calcVisibleLineInfo()
+    while height < maxHeight:
+      if self.topLine.getPrevious() == None:
+        if not self._generatePreviousLines():
+          break
+      self._moveTopLineUp()
+      height = self.calcVisibleLineInfo()
+    return height
+  # end _fillScreen
 
 # --- --- ---
 # TextViewer.disposeOneLine
 
   def disposeOneLine( self, line):
+    self._invalidateLineIndex()
     if line.Previous is None:
       self.startLine = line.Next
     else:
@@ -730,6 +878,15 @@ class TextViewer:
       line.Next.Previous = line.Previous
   # end disposeOneLine
 
+# Unlinks all the lines after the given line, so that none of them still points back into the lines kept.
+
+  def disposeLinesAfter( self, line):
+    self._invalidateLineIndex()
+    if line.Next is not None:
+      line.Next.Previous = None
+      line.Next = None
+  # end disposeLinesAfter
+
 # --- --- ---
 # --- --- ---
 # TextViewer: Wordwrap related methods
@@ -743,7 +900,7 @@ class TextViewer:
     chars, styles = self.document.getStyledText(posInText, posInText+length-1)
 
     #print "generating glyphs (len %d) for: %s" % (length, str([chars]))
-    glyphDict = glyph.globalGlyphPool.glyphDict
+    glyphPool = glyph.globalGlyphPool
     convertDocAndPageChars = self._convert_document_and_page_characters
 
     for i in range(length):
@@ -757,10 +914,7 @@ class TextViewer:
       elif new_char == '~' and convertDocAndPageChars:
         new_glyph = self.pageCharacterGlyph
       else:
-        try:
-          new_glyph = glyphDict[(new_char, new_style)]
-        except:
-          new_glyph = glyph.globalGlyphPool.makeGlyph(new_char, new_style)
+        new_glyph = glyphPool.getGlyph(new_char, new_style)
 
       glyphsToAdd[i] = new_glyph
 
@@ -770,14 +924,20 @@ class TextViewer:
 # --- --- ---
 # TextViewer.addGlyphsWordwrap
 
-  def addGlyphsWordwrap(self, glyphs, theLine):
+# Adds the glyphs to the end of theLine and wraps them. Unless wrapNext is 0, the following lines of the paragraph are then wrapped up as well; the lines of a newly generated window are added with wrapNext 0, since nothing follows them in their paragraph.
+
+  def addGlyphsWordwrap(self, glyphs, theLine, wrapNext=1):
     if theLine is None:
       raise Exception("trying to add glyphs to null line")
+    self._invalidateLineIndex()
     if len(theLine._glyphs) == 0 and len(glyphs) == 0:
       self.disposeOneLine( theLine )
       return
     
     max_width = self.surface.getWidth()
+    if PARAGRAPH_WRAP:
+      self._wrapParagraph(glyphs, theLine, max_width, wrapNext)
+      return
 
     width = 0
     curr_word_width = 0
@@ -818,8 +978,7 @@ class TextViewer:
         i = 0
         curr_word_width = width
         last_space = -1
-        theLine._needs_recalc_glyph_metrics = 1
-        theLine._needs_redraw = 1
+        theLine.invalidateMetrics()
         theLine = theLine.Next
 
       width += g.width
@@ -831,8 +990,7 @@ class TextViewer:
         curr_word_width = 0
       elif g._char == '\n':
         theLine.insertNewLineAfter()
-        theLine._needs_recalc_glyph_metrics = 1
-        theLine._needs_redraw = 1
+        theLine.invalidateMetrics()
         theLine = theLine.Next
         width = 0
         curr_word_width = 0
@@ -849,13 +1007,59 @@ class TextViewer:
 # We're done inserting the new characters.  If the last glyph we added was not a newline character, then we need to wrap the next line up to the current line.  Otherwise, due to the structure of the loop just executed, we have a completely blank line just after the newline character we just inserted; delete it and we're done.
 
     if g._char != '\n':
-      theLine._needs_recalc_glyph_metrics = 1
-      theLine._needs_redraw = 1
-      theLine.wordWrap(max_width)
+      theLine.invalidateMetrics()
+      if wrapNext:
+        theLine.wordWrap(max_width)
     else:
       theLine.Previous.deleteNextLine()
   #end of addGlyphsWordwrap
 
+# --- --- ---
+# TextViewer._wrapParagraph
+
+# Adds the glyphs to the end of theLine and re-wraps the rest of its paragraph: the glyphs of theLine and the new glyphs are broken into lines by word_wrap.lineBreaks(). If the last of those lines doesn't end the paragraph, the glyphs of the following lines are wrapped up to it, one line at a time, until a following line would start the same way it already does; since the lines are broken greedily, that line and the rest of the paragraph are already wrapped correctly. The existing lines are reused in order, and only the lines whose glyphs changed are redrawn.
+
+  def _wrapParagraph(self, glyphs, theLine, max_width, wrapNext=1):
+    pending = theLine._glyphs + glyphs
+    lines = [theLine]
+    lineGlyphs = []
+    nextLine = theLine.Next
+    while 1:
+      breaks = self._lineBreaks(pending, max_width)
+      start = 0
+      for end in breaks[:-1]:
+        lineGlyphs.append(pending[start:end])
+        start = end
+      last = pending[start:]
+      if not wrapNext or nextLine is None or (len(last) > 0 and last[-1]._char == '\n'):
+        break
+      pending = last + nextLine._glyphs
+      if len(last) > 0 and self._lineBreaks(pending, max_width)[0] == len(last):
+        break
+      lines.append(nextLine)
+      nextLine = nextLine.Next
+    lineGlyphs.append(last)
+
+# The callers may already have cut the glyphs of theLine in place, so it is always redrawn.
+
+    for lineNum in range(len(lineGlyphs)):
+      if lineNum < len(lines):
+        theLine = lines[lineNum]
+      else:
+        theLine = theLine.insertNewLineAfter()
+      if lineNum == 0 or theLine._glyphs != lineGlyphs[lineNum]:
+        theLine._glyphs = lineGlyphs[lineNum]
+        theLine.invalidateMetrics()
+
+    for extraLine in lines[len(lineGlyphs):]:
+      self.disposeOneLine(extraLine)
+  # end _wrapParagraph
+
+  def _lineBreaks(self, glyphs, max_width):
+    widths = map(lambda g: g.width, glyphs)
+    chars = map(lambda g: g._char, glyphs)
+    return word_wrap.lineBreaks(widths, chars, max_width)
+
 # --- --- ---
 # --- --- ---
 # TextViewer: Cursor related methods
@@ -869,7 +1073,7 @@ class TextViewer:
 
   def toggle_cursor_display(self):
     self.show_cursor = (self.show_cursor == 0)
-    self._needs_redraw = 1
+    self._markLineDirty(self.cursorLine)
   # end toggle_cursor_display
 
 # --- --- ---
@@ -923,6 +1127,78 @@ class TextViewer:
   def isChanged(self):
     return self.document.isChanged() or self._needs_redraw
 
+# --- --- ---
+# --- --- ---
+# TextViewer: Damage tracking
+
+# Instead of redrawing every visible line, render() only redraws the lines that changed since the last render(): lines whose glyphs changed, lines that moved or were added to the screen, and lines that the cursor or a selection highlight moved onto or off of. The rectangles of the surface that were redrawn are collected until getDirtyRects() is called, so that only those rectangles of the display need to be updated.
+
+# Changes that affect the whole surface (scrolling, regenerating the lines, changing the surface) call invalidate() so that the next render() redraws everything.
+
+  def invalidate(self):
+    self._needs_full_redraw = 1
+    self._needs_redraw = 1
+
+  def _markLineDirty(self, theLine):
+    if theLine is not None:
+      self._dirtyLines[theLine] = 1
+    self._needs_redraw = 1
+
+  def _isLineToRender(self, theLine):
+    return self._linesToRender is None or self._linesToRender.has_key(theLine)
+
+# --- --- ---
+# TextViewer.getDirtyRects
+
+# Returns the list of (x, y, width, height) rectangles of the surface redrawn since the last call.
+
+  def getDirtyRects(self):
+    rects = self._dirtyRects
+    self._dirtyRects = []
+    return rects
+
+# --- --- ---
+# TextViewer._updateDirtyLines
+
+# Called by render() to add the lines that changed since the last render() to the dirty lines.
+
+  def _updateDirtyLines(self):
+    for theLine in self.visibleLines:
+      if theLine._needs_redraw or self._renderedLinePositions.get(theLine) <> self.lineYPositions[theLine]:
+        self._dirtyLines[theLine] = 1
+
+# --- --- ---
+# TextViewer._recordRender
+
+# Remembers where the lines were drawn, and adds the rectangles redrawn by render() to the dirty rectangles. The rectangles of adjoining lines are merged.
+
+  def _recordRender(self):
+    width = self.surface.getWidth()
+    if self._linesToRender is None:
+      self._dirtyRects = [ (0, 0, width, self.surface.getHeight()) ]
+
+    self._renderedLinePositions = {}
+    top = bottom = None
+    for theLine in self.visibleLines:
+      yPos = self.lineYPositions[theLine]
+      height = theLine.getHeight()
+      self._renderedLinePositions[theLine] = yPos
+      if self._linesToRender is None or not self._linesToRender.has_key(theLine):
+        continue
+      if bottom <> yPos:
+        if top is not None:
+          self._dirtyRects.append( (0, top, width, bottom-top) )
+        top = yPos
+      bottom = yPos + height
+    if top is not None:
+      self._dirtyRects.append( (0, top, width, bottom-top) )
+
+    lastLine = self.visibleLines[-1]
+    linesBottom = self.lineYPositions[lastLine] + lastLine.getHeight()
+    if self._linesToRender is not None and linesBottom < self._renderedBottom:
+      self._dirtyRects.append( (0, linesBottom, width, self._renderedBottom-linesBottom) )
+    self._renderedBottom = linesBottom
+
 # --- --- ---
 # --- --- ---
 # TextViewer: render() supporting methods
@@ -936,6 +1212,7 @@ class TextViewer:
     self.document.clearChanged()
     if self._isTransparent:
       self.surface.clear()
+      self.invalidate()
 
     if self.firstGlyphPosition == -1:
       textCursorPos = self.document.getCursorPos()
@@ -943,12 +1220,27 @@ class TextViewer:
       self._cursor_changed = 0
 
     if self._cursor_changed:
+      self._markLineDirty(self.cursorLine)
       self._refreshCursor()
+      self._markLineDirty(self.cursorLine)
       self._cursor_changed = 0
 
+    flags = (archyState.whitespaceVisible, archyState.preselectionVisible)
+    if background or flags <> self._renderedFlags:
+      self._renderedFlags = flags
+      self.invalidate()
+
     if background:
       self.surface.blitRectangle(background, (0,0))
+    self._updateDirtyLines()
+    if not self._needs_full_redraw:
+      self._linesToRender = self._dirtyLines
     self.doRender()
+    self._recordRender()
+
+    self._linesToRender = None
+    self._dirtyLines = {}
+    self._needs_full_redraw = 0
     self._needs_redraw = 0
 
 # --- --- ---
@@ -963,14 +1255,21 @@ class TextViewer:
     #print "redraw all the visible lines and white space symbols"
     for line in self.visibleLines:
       linePos = self.lineYPositions[line]
-      self.surface.blitRectangle(line.render( self.surface.getWidth()), (line._margin,linePos))
-    if not self._isTransparent and linePos+line._height < self.surface.getHeight():
+      if self._isLineToRender(line):
+        self.surface.blitRectangle(line.render( self.surface.getWidth()), (line._margin,linePos))
+    linesBottom = linePos+line._height
+    if self._linesToRender is not None and linesBottom >= self._renderedBottom:
+      # The part of the display area below the lowest line is already clear.
+      pass
+    elif not self._isTransparent and linesBottom < self.surface.getHeight():
       # Clear the part of the display area below the lowest line.
       # TODO: background color shouldn't be hardcoded...
       self.surface.fillRectangle((0, linePos+line._height, self.surface.getWidth(), self.surface.getHeight()), (255,255,255))
 
     if archyState.whitespaceVisible:
       for line in self.visibleLines:
+        if not self._isLineToRender(line):
+          continue
         linePos = self.lineYPositions[line]
         line.drawWhitespaceSymbols(self.surface, linePos)
   #end renderLines
@@ -981,6 +1280,8 @@ class TextViewer:
   def renderCursor(self):
     if not self.isCharOnScreen(self.document.getCursorPos()):
       return
+    if not self._isLineToRender(self.cursorLine):
+      return
     yPos = self.getLineYPos(self.cursorLine)
     xPos = self.cursorLine.posToPixel(self.cursorPosOnLine)
 
@@ -1005,6 +1306,7 @@ class TextViewer:
 
 # --- --- ---
   def setViewInformation(self, viewMemento):
+    self._invalidateLineIndex()
     self.startLine = viewMemento[0]
     self.topLine = viewMemento[1]
     self.firstGlyphPosition = viewMemento[2]
@@ -1013,7 +1315,7 @@ class TextViewer:
     self.lastGlyphPosition = viewMemento[5]
     self.calcVisibleLineInfo()
     self._refreshCursor()
-    self._needs_redraw = 1
+    self.invalidate()
   # end setViewInformation
 
 # --- --- ---
@@ -1037,7 +1339,7 @@ class TextViewer:
         return
     self._moveTopLineUp()
     self.calcVisibleLineInfo()
-    self._needs_redraw=1
+    self.invalidate()
   # end scrollUp
 
 # --- --- ---
@@ -1055,7 +1357,7 @@ class TextViewer:
 
     self._moveTopLineDown()
     self.calcVisibleLineInfo()
-    self._needs_redraw=1
+    self.invalidate()
   # end scrollDown
 
 
@@ -1082,18 +1384,64 @@ class HumaneDocumentTextViewer(TextViewer):
     self._convert_document_and_page_characters = 1
 
     self.selectionColors = ( [254,243,100], [0,0xff,0xcc], [0x7f,0xff,0xe6], [0xbf,0xff,0xb3],[0xe1,0xff,0xf9] )
+    self._selections_changed = 1
+    self._renderedSelections = {}
+    self._selectionOverlays = {}
+    self._selectionStrips = {}
 
   def onClear(self):
     #print "HumaneDocumentTextViewer: onClear"
     self.initializeContent()
 
+# Edits can rewrap the selected lines even when the selections keep their positions, so they invalidate the selection overlays too.
+
   def onSelectionsChanged(self):
+    self._selections_changed = 1
     self._needs_redraw=1
 
+  def onAddText(self, insertPos, length):
+    TextViewer.onAddText(self, insertPos, length)
+    self._selections_changed = 1
+
+  def onDelText(self, delStart, delEnd):
+    TextViewer.onDelText(self, delStart, delEnd)
+    self._selections_changed = 1
+
+  def onStyleChange(self, startPos, endPos):
+    TextViewer.onStyleChange(self, startPos, endPos)
+    self._selections_changed = 1
+
+# --- --- ---
+# method HumaneDocumentTextViewer._updateDirtyLines
+
+# Besides the lines that changed, the lines whose selection highlights changed are dirty. The highlighted part of each line is remembered as a map from (selection number, line) to (first offset, last offset), and compared with the highlights of the last render().
+
+# The highlighted lines of each selection are also kept in _selectionOverlays, from which renderSelections() draws them. They are only recomputed when the selections or the text change, or the whole viewer is redrawn, so a render() that only blinks the cursor doesn't walk the lines again.
+
+  def _updateDirtyLines(self):
+    TextViewer._updateDirtyLines(self)
+    if not (self._selections_changed or self._needs_full_redraw):
+      return
+
+    selectionRanges = {}
+    self._selectionOverlays = {}
+    for selNum in self._renderableSelections():
+      self._selectionOverlays[selNum] = self._selectionLineRanges(selNum)
+      for line, firstOffset, lastOffset in self._selectionOverlays[selNum]:
+        selectionRanges[(selNum, line)] = (firstOffset, lastOffset)
+
+    for key in selectionRanges.keys() + self._renderedSelections.keys():
+      if selectionRanges.get(key) <> self._renderedSelections.get(key):
+        self._dirtyLines[key[1]] = 1
+    self._renderedSelections = selectionRanges
+    self._selections_changed = 0
+
 # --- --- ---
 # method HumaneDocumentTextViewer.renderLineSelection(line, firstOffset, lastOffset, color)
 
   def renderLineSelection(self, line, firstOffset, lastOffset, color):
+    if not self._isLineToRender(line):
+      return
     try:
       #print "start renderLineSelection"
       xPos = line.posToPixel(firstOffset)
@@ -1101,7 +1449,7 @@ class HumaneDocumentTextViewer(TextViewer):
       width = line.getWidthOfRange( firstOffset, lastOffset)
       height = line.getHeight()
       line.drawWhitespaceSymbols( self.surface, yPos, xPos, firstOffset, lastOffset )
-      self.surface.drawRectangle(  ( width,height), (xPos,yPos), color, 50)
+      self._getSelectionStrip(color).draw( self.surface, ( width,height), (xPos,yPos) )
       #print "finished renderLineSelection"
     except:
       #print "something wrong in renderLineSelection"
@@ -1110,6 +1458,14 @@ class HumaneDocumentTextViewer(TextViewer):
       #traceback.print_exc(1000)
       raise
 
+# The translucent highlight of each selection color is drawn from an AlphaStrip (see surfaces.py), which is only filled once.
+
+  def _getSelectionStrip(self, color):
+    key = tuple(color)
+    if not self._selectionStrips.has_key(key):
+      self._selectionStrips[key] = surfaces.AlphaStrip(color, 50)
+    return self._selectionStrips[key]
+
 # --- --- ---
 
 # Rendering the selections in HumaneDocumentTextViewer
@@ -1124,44 +1480,53 @@ class HumaneDocumentTextViewer(TextViewer):
 
 # --- --- ---
 
-# method renderSelectionIntersection(self, selNum, rangeStart, rangeEnd)
+# method _selectionLineRanges(self, selNum)
 
-# Render the intersection of the selectionIndicator indexed by selNum and the viewport.
+# Returns the intersection of the selectionIndicator indexed by selNum and the viewport, as a list of (line, firstOffset, lastOffset) tuples.
 
-  def renderSelectionIntersection(self, selNum):
+  def _selectionLineRanges(self, selNum):
     import archy_globals
-    try:
-      selection = list(self.document.selections[selNum])
-      on_screen_part = archy_globals.intersection(selection,[self.firstScreenPosition, self.lastScreenPosition])
-      if on_screen_part[1] < on_screen_part[0]:
-        # none of selection is on screen.
-        return
+    selection = list(self.document.selections[selNum])
+    on_screen_part = archy_globals.intersection(selection,[self.firstScreenPosition, self.lastScreenPosition])
+    if on_screen_part[1] < on_screen_part[0]:
+      # none of selection is on screen.
+      return []
 
-      # now figure out what lines we need to draw selection highlights on.
-      s0_offs = self.textPosToScreenLocation( on_screen_part[0] )
-      s1_offs = self.textPosToScreenLocation( on_screen_part[1] )
+    # now figure out what lines we need to draw selection highlights on.
+    s0_offs = self.textPosToScreenLocation( on_screen_part[0] )
+    s1_offs = self.textPosToScreenLocation( on_screen_part[1] )
 
+    curr_line = s0_offs[0]
+    curr_offset = s0_offs[1]
+    end_line = s1_offs[0]
+    end_offset = s1_offs[1]
 
+    lineRanges = []
+    while curr_line != end_line:
+      last_char_of_line = curr_line.getLength() -1
+      lineRanges.append( (curr_line, curr_offset, last_char_of_line) )
+      #update the currLine and currOffset
+      curr_line = curr_line.Next
+      if curr_line is not None:
+        curr_offset=0
 
-      # now draw the selection highlight.
-      color = self.selectionColors[selNum]
+    # the last line. curr_line should == end_line
+    lineRanges.append( (curr_line, curr_offset, end_offset) )
+    return lineRanges
+
+# --- --- ---
+
+# method renderSelectionIntersection(self, selNum)
 
-      curr_line = s0_offs[0]
-      curr_offset = s0_offs[1]
-      end_line = s1_offs[0]
-      end_offset = s1_offs[1]
+# Render the intersection of the selectionIndicator indexed by selNum and the viewport, as computed by the last _updateDirtyLines().
 
-      while curr_line != end_line:
-        last_char_of_line = curr_line.getLength() -1
+  def renderSelectionIntersection(self, selNum):
+    try:
+      # now draw the selection highlight.
+      color = self.selectionColors[selNum]
+      for curr_line, first_offset, last_offset in self._selectionOverlays.get(selNum, []):
         #draw the line rect
-        self.renderLineSelection(curr_line, curr_offset, last_char_of_line, color)
-        #update the currLine and currOffset
-        curr_line = curr_line.Next
-        if curr_line is not None:
-          curr_offset=0
-
-      # draw the last line. curr_line should == end_line
-      self.renderLineSelection(curr_line, curr_offset, end_offset, color)
+        self.renderLineSelection(curr_line, first_offset, last_offset, color)
       #print "finished renderSelectionIntersection"
     except:
         #import sys
@@ -1174,25 +1539,18 @@ class HumaneDocumentTextViewer(TextViewer):
 
 # Render the selections and their intersection with the visible lines on the screen.
 
-  def renderSelections(self):
-    #print "render selection humane text viewer"
-    currVisibility = archyState.preselectionVisible
-
-    if currVisibility:
-      #print "render the preselection"
-      self.renderSelectionIntersection(PRESELECTION)
-
+  def _renderableSelections(self):
+    selNums = []
+    if archyState.preselectionVisible:
+      selNums.append(PRESELECTION)
     lastRenderableSelection = min(len(self.selectionColors), len(self.document.selections))
-    #any_printed = False
+    selNums.extend( range(SELECTION, lastRenderableSelection) )
+    return selNums
 
-    for i in range(SELECTION, lastRenderableSelection):
-      selection = list(self.document.selections[i])
-      #res = print_if_changed(i, selection)
-      #if res:
-        #any_printed = True
+  def renderSelections(self):
+    #print "render selection humane text viewer"
+    for i in self._renderableSelections():
       self.renderSelectionIntersection(i)
-    #if any_printed:
-      #print "--- --- ---"
   # end renderSelections
 
   def doRender(self):
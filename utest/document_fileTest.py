@@ -0,0 +1,40 @@
+# document_fileTest.py
+# The Raskin Center for Humane Interfaces (RCHI) 2005
+
+# This work is licensed under the Creative Commons
+# Attribution-NonCommercial-ShareAlike License. To view 
+# a copy of this license, visit 
+# http://creativecommons.org/licenses/by-nc-sa/2.0/ 
+
+# or send a letter to :
+
+# Creative Commons
+# 559 Nathan Abbott Way
+# Stanford, California 94305, 
+# USA.
+# --- --- ---
+
+import unittest
+import os
+import tempfile
+import document_file
+
+class DocumentFileTest(unittest.TestCase):
+    def testSections(self):
+        fileName = tempfile.mktemp()
+        f = open(fileName, 'wb')
+        f.write(document_file.encodeSections([('TEXT', u'h\xe9llo'.encode('utf-8')), ('HIST', 'xyz')]))
+        f.close()
+
+        try:
+            self.assert_(document_file.isDocumentFile(fileName))
+            doc = document_file.DocumentFile(fileName)
+            self.assertEquals(u'h\xe9llo', doc.getText('TEXT'))
+            self.assertEquals('xyz', doc.getSection('HIST'))
+            self.failIf(doc.hasSection('INFO'))
+            doc.close()
+        finally:
+            os.unlink(fileName)
+
+if __name__ == '__main__':
+    unittest.main()
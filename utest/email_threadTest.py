@@ -0,0 +1,409 @@
+# email_threadTest.py
+# The Raskin Center for Humane Interfaces (RCHI) 2005
+
+# This work is licensed under the Creative Commons
+# Attribution-NonCommercial-ShareAlike License. To view
+# a copy of this license, visit
+# http://creativecommons.org/licenses/by-nc-sa/2.0/
+
+# or send a letter to :
+
+# Creative Commons
+# 559 Nathan Abbott Way
+# Stanford, California 94305,
+# USA.
+# --- --- ---
+
+import unittest
+import threading
+import time
+import os
+import tempfile
+import shutil
+import SocketServer
+import asyncore
+import smtpd
+import email.Message
+import email_thread
+
+# A stand-in IMAP server, which speaks just enough of the protocol for
+# imaplib. It records the commands it receives.
+
+class FakeIMAPHandler(SocketServer.StreamRequestHandler):
+    def send(self, line):
+        self.wfile.write(line + '\r\n')
+        self.wfile.flush()
+
+    def handle(self):
+        server = self.server
+        self.send('* OK stand-in IMAP server ready')
+        while 1:
+            line = self.rfile.readline()
+            if not line:
+                break
+            words = line.strip().split(' ')
+            tag, command, args = words[0], words[1].upper(), words[2:]
+            server.commands.append(' '.join([command] + args))
+            if command == 'CAPABILITY':
+                self.send('* CAPABILITY IMAP4rev1 IDLE')
+            elif command == 'SELECT':
+                self.send('* %d EXISTS' % len(server.messages))
+                self.send('* OK [UIDVALIDITY %d] UIDs valid' % server.uidValidity)
+                self.send('* OK [UIDNEXT %d] next UID' % server.uidNext)
+            elif command == 'UID' and args[0].upper() == 'SEARCH':
+                uids = [str(uid) for uid, seen, text in server.messages if not seen]
+                self.send(' '.join(['* SEARCH'] + uids))
+            elif command == 'UID' and args[0].upper() == 'FETCH':
+                self.fetch(args[1])
+            elif command == 'IDLE':
+                server.idler = self
+                self.send('+ idling')
+                self.rfile.readline()
+                server.idler = None
+            elif command == 'LOGOUT':
+                self.send('* BYE')
+                self.send(tag + ' OK completed')
+                break
+            self.send(tag + ' OK completed')
+
+    def fetch(self, messageSet):
+        server = self.server
+        wanted = []
+        for part in messageSet.split(','):
+            if ':' in part:
+                first, last = part.split(':')
+                if last == '*':
+                    last = max([server.messages[-1][0], int(first)])
+                wanted.extend(range(min(int(first), int(last)), max(int(first), int(last)) + 1))
+            else:
+                wanted.append(int(part))
+        if messageSet.endswith(':*'):
+            wanted.append(server.messages[-1][0])
+        for n in range(len(server.messages)):
+            uid, seen, text = server.messages[n]
+            if uid in wanted:
+                server.messages[n] = (uid, 1, text)
+                self.wfile.write('* %d FETCH (UID %d RFC822 {%d}\r\n%s)\r\n' % (n + 1, uid, len(text), text))
+
+class FakeIMAPServer(SocketServer.ThreadingTCPServer):
+    allow_reuse_address = 1
+    daemon_threads = 1
+
+    def __init__(self):
+        SocketServer.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0), FakeIMAPHandler)
+        self.commands = []
+        self.messages = []
+        self.uidValidity = 1
+        self.uidNext = 1
+        self.idler = None
+
+    def deliver(self, subject, seen=0):
+        self.messages.append((self.uidNext, seen, 'Subject: %s\r\n\r\nbody\r\n' % subject))
+        self.uidNext += 1
+        if self.idler is not None:
+            self.idler.send('* %d EXISTS' % len(self.messages))
+
+# A stand-in POP3 server. Messages are (UIDL, text) tuples; UIDL can be
+# switched off.
+
+class FakePOPHandler(SocketServer.StreamRequestHandler):
+    def send(self, line):
+        self.wfile.write(line + '\r\n')
+
+    def sendLines(self, lines):
+        self.send('+OK')
+        for line in lines:
+            if line.startswith('.'):
+                line = '.' + line
+            self.send(line)
+        self.send('.')
+
+    def handle(self):
+        server = self.server
+        messages = server.messages[:]
+        self.send('+OK stand-in POP3 server ready')
+        while 1:
+            line = self.rfile.readline()
+            if not line:
+                break
+            words = line.strip().split(' ')
+            command = words[0].upper()
+            server.commands.append(line.strip())
+            if command == 'LIST':
+                self.sendLines(['%d %d' % (n + 1, len(messages[n][1])) for n in range(len(messages))])
+            elif command == 'UIDL' and server.hasUIDL:
+                self.sendLines(['%d %s' % (n + 1, messages[n][0]) for n in range(len(messages))])
+            elif command == 'RETR':
+                self.sendLines(messages[int(words[1]) - 1][1].split('\r\n'))
+            elif command == 'QUIT':
+                self.send('+OK bye')
+                break
+            elif command == 'UIDL':
+                self.send('-ERR UIDL not supported')
+            else:
+                self.send('+OK')
+            self.wfile.flush()
+
+class FakePOPServer(SocketServer.ThreadingTCPServer):
+    allow_reuse_address = 1
+    daemon_threads = 1
+
+    def __init__(self):
+        SocketServer.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0), FakePOPHandler)
+        self.commands = []
+        self.messages = []
+        self.hasUIDL = 1
+
+    def deliver(self, subject, body='body'):
+        uidl = 'uid-%d' % len(self.messages)
+        self.messages.append((uidl, 'Subject: %s\r\n\r\n%s' % (subject, body)))
+
+# A stand-in SMTP server, which counts the sessions it is sent mail in. It
+# refuses the messages whose subjects are in replies with the given reply.
+
+class FakeSMTPServer(smtpd.SMTPServer):
+    def __init__(self):
+        smtpd.SMTPServer.__init__(self, ('127.0.0.1', 0), None)
+        self.port = self.socket.getsockname()[1]
+        self.sessions = 0
+        self.received = []
+        self.replies = {}
+
+    def handle_accept(self):
+        self.sessions += 1
+        smtpd.SMTPServer.handle_accept(self)
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        subject = email.message_from_string(data)['Subject']
+        if self.replies.has_key(subject):
+            return self.replies[subject]
+        self.received.append(subject)
+
+def startSMTPServer():
+    thread = threading.Thread(target=asyncore.loop, kwargs={'timeout':0.05, 'map':asyncore.socket_map})
+    thread.setDaemon(1)
+    thread.start()
+    return thread
+
+def startServer(server):
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(1)
+    thread.start()
+
+def subjects(messages):
+    return map(lambda m: m['Subject'], messages)
+
+class IMAPEmailTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeIMAPServer()
+        startServer(self.server)
+        self.info = {'protocol':'IMAP', 'server':'127.0.0.1', 'port':self.server.server_address[1], 'user':'user', 'password':'password'}
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def testIncrementalFetch(self):
+        self.server.deliver('old', seen=1)
+        self.server.deliver('unseen')
+        imap = email_thread.IMAPEmail(self.info)
+        self.assertEquals(['unseen'], subjects(imap.getMail()))
+        self.assertEquals([], imap.getMail())
+
+        self.server.deliver('new 1')
+        self.server.deliver('new 2')
+        self.assertEquals(['new 2', 'new 1'], subjects(imap.getMail()))
+
+        # One session, and a single UID FETCH for the new messages.
+        commands = self.server.commands
+        self.assertEquals(1, len(filter(lambda c: c.startswith('LOGIN'), commands)))
+        self.assertEquals(['UID FETCH 2 (UID RFC822)', 'UID FETCH 3:* (UID RFC822)'], filter(lambda c: c.startswith('UID FETCH'), commands))
+        imap.releaseServer()
+
+    def testUIDValidity(self):
+        self.server.deliver('first')
+        imap = email_thread.IMAPEmail(self.info)
+        self.assertEquals(['first'], subjects(imap.getMail()))
+
+        self.server.messages = []
+        self.server.uidValidity = 2
+        self.server.uidNext = 1
+        self.server.deliver('renumbered')
+        self.assertEquals(['renumbered'], subjects(imap.getMail()))
+        imap.releaseServer()
+
+    def testIdle(self):
+        imap = email_thread.IMAPEmail(self.info)
+        imap.getMail()
+        wakeEvent = threading.Event()
+        timer = threading.Timer(0.2, self.server.deliver, ['pushed'])
+        timer.start()
+        start = time.time()
+        imap.waitForMail(wakeEvent)
+        self.failUnless(time.time() - start < 5)
+        self.failUnless('IDLE' in self.server.commands)
+        self.assertEquals(['pushed'], subjects(imap.getMail()))
+
+        threading.Timer(0.2, wakeEvent.set).start()
+        start = time.time()
+        imap.waitForMail(wakeEvent)
+        self.failUnless(time.time() - start < 5)
+        imap.releaseServer()
+
+class POPemailTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakePOPServer()
+        startServer(self.server)
+        self.info = {'protocol':'POP', 'server':'127.0.0.1', 'port':self.server.server_address[1], 'user':'user', 'password':'password'}
+        self.oldSettings = email_thread.POP_UIDL_FILE, email_thread.POP_MAX_MESSAGES
+        email_thread.POP_UIDL_FILE = tempfile.mktemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if os.path.exists(email_thread.POP_UIDL_FILE):
+            os.remove(email_thread.POP_UIDL_FILE)
+        email_thread.POP_UIDL_FILE, email_thread.POP_MAX_MESSAGES = self.oldSettings
+
+    def testUIDL(self):
+        self.server.deliver('one', '.dotted\r\nline')
+        self.server.deliver('two')
+        pop = email_thread.POPemail(self.info)
+        messages = pop.getMail()
+        self.assertEquals(['one', 'two'], subjects(messages))
+        self.assertEquals('.dotted\nline\n', messages[0].get_payload())
+        self.assertEquals([], pop.getMail())
+
+        self.server.deliver('three')
+        self.assertEquals(['three'], subjects(pop.getMail()))
+
+        # The UIDLs of the messages put into the document are remembered
+        # across restarts; the other messages are retrieved again.
+        email_thread.deliveredPOPMessages(messages)
+        self.server.deliver('four')
+        pop = email_thread.POPemail(self.info)
+        self.assertEquals(['three', 'four'], subjects(pop.getMail()))
+        self.assertEquals(5, len(filter(lambda c: c.startswith('RETR'), self.server.commands)))
+
+    def testLimit(self):
+        email_thread.POP_MAX_MESSAGES = 2
+        for subject in ['a', 'b', 'c']:
+            self.server.deliver(subject)
+        pop = email_thread.POPemail(self.info)
+        self.assertEquals(['a', 'b'], subjects(pop.getMail()))
+        self.assertEquals(['c'], subjects(pop.getMail()))
+
+    def testNoUIDL(self):
+        self.server.hasUIDL = 0
+        self.server.deliver('a')
+        pop = email_thread.POPemail(self.info)
+        self.assertEquals(['a'], subjects(pop.getMail()))
+        self.assertEquals(['a'], subjects(pop.getMail()))
+
+class OutgoingEmailThreadTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeSMTPServer()
+        self.serverThread = startSMTPServer()
+        self.info = {'server':'127.0.0.1', 'port':self.server.port, 'From':'me@example.com'}
+        email_thread.outgoing_servers = [self.info]
+        del email_thread.outgoing_email[:]
+        self.oldSettings = email_thread.SMTP_MAX_BATCH, email_thread.outgoing_spool
+        self.spoolDir = tempfile.mkdtemp()
+        email_thread.outgoing_spool = email_thread.mail_spool.MailSpool(self.spoolDir)
+
+    def tearDown(self):
+        email_thread.SMTP_MAX_BATCH, email_thread.outgoing_spool = self.oldSettings
+        shutil.rmtree(self.spoolDir)
+        del email_thread.outgoing_email[:]
+        email_thread.outgoing_servers = []
+        self.server.close()
+        asyncore.close_all()
+        self.serverThread.join()
+
+    def queue(self, subjects):
+        for subject in subjects:
+            msg = email.Message.Message()
+            msg['To'] = 'you@example.com'
+            msg['Subject'] = subject
+            msg.set_payload('body')
+            email_thread.queueOutgoingMail(msg)
+
+    def queuedSubjects(self):
+        return map(lambda messageID: email_thread.outgoing_spool.load(messageID)['Subject'], email_thread.outgoing_email)
+
+    def testOneSession(self):
+        self.queue(['a', 'b', 'c'])
+        thread = email_thread.OutgoingEmailThread()
+        thread._sendQueuedMail()
+        self.queue(['d'])
+        thread._sendQueuedMail()
+        thread._releaseServer()
+        self.assertEquals(['a', 'b', 'c', 'd'], self.server.received)
+        self.assertEquals(1, self.server.sessions)
+        self.assertEquals([], email_thread.outgoing_email)
+        self.assertEquals([], os.listdir(self.spoolDir))
+
+    def testBatchLimit(self):
+        email_thread.SMTP_MAX_BATCH = 2
+        self.queue(['a', 'b', 'c'])
+        thread = email_thread.OutgoingEmailThread()
+        thread._sendQueuedMail()
+        self.assertEquals(['a', 'b'], self.server.received)
+        self.failUnless(email_thread.is_outgoing_mail.isSet())
+        thread._sendQueuedMail()
+        thread._releaseServer()
+        self.assertEquals(['a', 'b', 'c'], self.server.received)
+
+    def testRetry(self):
+        self.info['port'] = 1
+        self.queue(['a', 'b'])
+        thread = email_thread.OutgoingEmailThread()
+        thread._sendQueuedMail()
+        self.queue(['c'])
+        self.assertEquals(['a', 'b', 'c'], self.queuedSubjects())
+        self.assertEquals(email_thread.SMTP_RETRY_DELAY, thread._retryDelay)
+        thread._sendQueuedMail()
+        self.assertEquals(email_thread.SMTP_RETRY_DELAY * 2, thread._retryDelay)
+
+        self.info['port'] = self.server.port
+        thread._sendQueuedMail()
+        thread._releaseServer()
+        self.assertEquals(['a', 'b', 'c'], self.server.received)
+        self.assertEquals(0, thread._retryDelay)
+
+    def testRefused(self):
+        self.server.replies['a'] = '554 Rejected'
+        self.server.replies['b'] = '451 Try again later'
+        self.queue(['a', 'b', 'c'])
+        thread = email_thread.OutgoingEmailThread()
+        thread._sendQueuedMail()
+        self.assertEquals(['c'], self.server.received)
+        self.assertEquals(['b'], self.queuedSubjects())
+
+        # The refused message is kept aside and reported; the delayed one is
+        # given up on after SMTP_MAX_ATTEMPTS attempts.
+        failedDir = os.path.join(self.spoolDir, email_thread.mail_spool.FAILED_DIR)
+        self.assertEquals(1, len(os.listdir(failedDir)))
+        self.assertEquals(['a'], map(lambda f:f[0], email_thread.failed_outgoing_email))
+        for n in range(email_thread.SMTP_MAX_ATTEMPTS - 1):
+            thread._sendQueuedMail()
+        thread._releaseServer()
+        self.assertEquals([], email_thread.outgoing_email)
+        self.assertEquals(['a', 'b'], map(lambda f:f[0], email_thread.failed_outgoing_email))
+        self.assertEquals(2, len(os.listdir(failedDir)))
+        del email_thread.failed_outgoing_email[:]
+
+    def testRecovery(self):
+        self.queue(['a', 'b'])
+        del email_thread.outgoing_email[:]
+
+        # The thread of the next run finds the messages in the spool.
+        thread = email_thread.OutgoingEmailThread()
+        thread._recoverSpool()
+        self.assertEquals(['a', 'b'], self.queuedSubjects())
+        thread._sendQueuedMail()
+        thread._releaseServer()
+        self.assertEquals(['a', 'b'], self.server.received)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+# journalTest.py
+# The Raskin Center for Humane Interfaces (RCHI) 2005
+
+# This work is licensed under the Creative Commons
+# Attribution-NonCommercial-ShareAlike License. To view 
+# a copy of this license, visit 
+# http://creativecommons.org/licenses/by-nc-sa/2.0/ 
+
+# or send a letter to :
+
+# Creative Commons
+# 559 Nathan Abbott Way
+# Stanford, California 94305, 
+# USA.
+# --- --- ---
+
+import unittest
+import marshal
+import cStringIO
+import journal
+
+class JournalRecordTest(unittest.TestCase):
+    def testReadRecords(self):
+        data = journal.encodeRecord(journal.JOURNAL_START, marshal.dumps('id'))
+        data += journal.encodeRecord(journal.ADD_TEXT, marshal.dumps( (3, u'abc', [(3, 1)]) ))
+        data += journal.encodeRecord(journal.DEL_TEXT, marshal.dumps( (0, 1) ))
+
+        records = journal.readRecords(cStringIO.StringIO(data))
+        self.assertEquals([(journal.JOURNAL_START, 'id'), (journal.ADD_TEXT, (3, u'abc', [(3, 1)])), (journal.DEL_TEXT, (0, 1))], records)
+
+        # A record cut short by a crash is dropped.
+        records = journal.readRecords(cStringIO.StringIO(data[:-2]))
+        self.assertEquals(2, len(records))
+
+    def testCorruptRecord(self):
+        data = journal.encodeRecord(journal.DEL_TEXT, marshal.dumps( (0, 1) ))
+        self.assertRaises(journal.JournalError, journal.readRecords, cStringIO.StringIO('XX' + data[2:]))
+
+if __name__ == '__main__':
+    unittest.main()
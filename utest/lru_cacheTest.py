@@ -0,0 +1,53 @@
+# lru_cacheTest.py
+# The Raskin Center for Humane Interfaces (RCHI) 2005
+
+# This work is licensed under the Creative Commons
+# Attribution-NonCommercial-ShareAlike License. To view
+# a copy of this license, visit
+# http://creativecommons.org/licenses/by-nc-sa/2.0/
+
+# or send a letter to :
+
+# Creative Commons
+# 559 Nathan Abbott Way
+# Stanford, California 94305,
+# USA.
+# --- --- ---
+
+import unittest
+import lru_cache
+
+class LRUCacheTest(unittest.TestCase):
+    def testEviction(self):
+        c = lru_cache.LRUCache(100)
+        for i in range(10):
+            c.add(i, str(i), 20)
+            c.get(0)
+        self.assertEquals('0', c.get(0))
+        self.assertEquals(None, c.get(1))
+        self.assertEquals('9', c.get(9))
+        stats = c.getStatistics()
+        self.assertEquals(4, stats['entries'])
+        self.assertEquals(80, stats['size'])
+        self.assertEquals(6, stats['evictions'])
+        self.assertEquals(1, stats['misses'])
+
+    def testPinned(self):
+        c = lru_cache.LRUCache(100)
+        c.add('a', 'pinned', 40, 1)
+        c.add('b', 'big', 70)
+        self.assertEquals('pinned', c.get('a'))
+        self.assertEquals(None, c.get('b'))
+        self.assertEquals(40, c.getStatistics()['size'])
+
+        # Pinned values count against the budget, up to the pinned budget.
+        c.add('c', 'over', 20, 1)
+        c.add('d', 'more', 30)
+        c.add('e', 'more', 30)
+        self.assertEquals(None, c.get('c'))
+        self.assertEquals(None, c.get('d'))
+        self.assertEquals('more', c.get('e'))
+        self.assertEquals(40, c.getStatistics()['pinnedSize'])
+        self.assertEquals(70, c.getStatistics()['size'])
+        c.remove('a')
+        self.assertEquals(0, c.getStatistics()['pinnedSize'])
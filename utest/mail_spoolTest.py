@@ -0,0 +1,97 @@
+# mail_spoolTest.py
+# The Raskin Center for Humane Interfaces (RCHI) 2005
+
+# This work is licensed under the Creative Commons
+# Attribution-NonCommercial-ShareAlike License. To view
+# a copy of this license, visit
+# http://creativecommons.org/licenses/by-nc-sa/2.0/
+
+# or send a letter to :
+
+# Creative Commons
+# 559 Nathan Abbott Way
+# Stanford, California 94305,
+# USA.
+# --- --- ---
+
+import unittest
+import os
+import shutil
+import tempfile
+import email.Message
+import mail_spool
+
+def makeMessage(subject):
+    msg = email.Message.Message()
+    msg['Subject'] = subject
+    msg.set_payload('body')
+    return msg
+
+class MailSpoolTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = os.path.join(tempfile.mkdtemp(), 'spool')
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.directory))
+
+    def testQueue(self):
+        spool = mail_spool.MailSpool(self.directory)
+        self.assertEquals([], spool.pending())
+        first = spool.enqueue(makeMessage('a'))
+        second = spool.enqueue(makeMessage('b'))
+        self.assertEquals([first, second], spool.pending())
+        self.assertEquals('b', spool.load(second)['Subject'])
+
+        spool.markSent(first)
+        self.assertEquals([second], spool.pending())
+
+        # A new spool, as after a restart, carries on numbering the messages.
+        spool = mail_spool.MailSpool(self.directory)
+        self.assertEquals([second], spool.recover())
+        third = spool.enqueue(makeMessage('c'))
+        self.failUnless(third > second)
+        self.assertEquals([second, third], spool.pending())
+
+    def testRecover(self):
+        spool = mail_spool.MailSpool(self.directory)
+        first = spool.enqueue(makeMessage('a'))
+        second = spool.enqueue(makeMessage('b'))
+
+        # Archy stopped after journalling the first message as sent, but
+        # before removing it, and while writing a third message.
+        f = open(os.path.join(self.directory, mail_spool.SENT_JOURNAL), 'wb')
+        f.write('%d\n' % first)
+        f.close()
+        f = open(spool._path(second + 1, mail_spool.SPOOL_TEMP_SUFFIX), 'wb')
+        f.write('Subject: c')
+        f.close()
+
+        spool = mail_spool.MailSpool(self.directory)
+        self.assertEquals([second], spool.recover())
+        self.assertEquals(['%08d.msg' % second], os.listdir(self.directory))
+
+    def testQueueBeforeRecover(self):
+        spool = mail_spool.MailSpool(self.directory)
+        first = spool.enqueue(makeMessage('a'))
+        second = spool.enqueue(makeMessage('b'))
+        spool.markSent(second)
+
+        # A message queued after a restart, before recover(), doesn't take
+        # the ID of a sent message that recover() then removes.
+        spool = mail_spool.MailSpool(self.directory)
+        third = spool.enqueue(makeMessage('c'))
+        self.failUnless(third > second)
+        self.assertEquals([first, third], spool.recover())
+
+    def testJournalLimit(self):
+        spool = mail_spool.MailSpool(self.directory)
+        journalPath = os.path.join(self.directory, mail_spool.SENT_JOURNAL)
+        for n in range(mail_spool.SENT_JOURNAL_LIMIT - 1):
+            spool.markSent(spool.enqueue(makeMessage('a')))
+        self.failUnless(os.path.exists(journalPath))
+        spool.markSent(spool.enqueue(makeMessage('a')))
+        self.failIf(os.path.exists(journalPath))
+        self.assertEquals([], spool.pending())
+
+if __name__ == '__main__':
+    unittest.main()
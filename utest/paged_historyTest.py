@@ -0,0 +1,83 @@
+# paged_historyTest.py
+# The Raskin Center for Humane Interfaces (RCHI) 2005
+
+# This work is licensed under the Creative Commons
+# Attribution-NonCommercial-ShareAlike License. To view 
+# a copy of this license, visit 
+# http://creativecommons.org/licenses/by-nc-sa/2.0/ 
+
+# or send a letter to :
+
+# Creative Commons
+# 559 Nathan Abbott Way
+# Stanford, California 94305, 
+# USA.
+# --- --- ---
+
+import unittest
+import paged_history
+
+class PagedHistoryTest(unittest.TestCase):
+    def testSpill(self):
+        h = paged_history.PagedHistory(memoryBudget=1)
+        for i in range(paged_history.PAGE_SIZE*3 + 5):
+            h.append([i])
+        self.assertEquals(paged_history.PAGE_SIZE*3 + 5, len(h))
+
+        resident = filter(lambda p:p.isResident(), h._pages)
+        self.assertEquals(2, len(resident))
+
+        # Spilled pages are read back, and changes to them are kept.
+        h[3].append('undone')
+        h.changed(3)
+        for i in range(paged_history.PAGE_SIZE, len(h)):
+            self.assertEquals(i, h[i][0])
+        self.assertEquals([3, 'undone'], h[3])
+
+    def testSpillSize(self):
+        h = paged_history.PagedHistory(map(lambda i:[i], range(paged_history.PAGE_SIZE*3)), memoryBudget=1)
+        size = h._spillSize
+
+        # Pages only read are not written again, and a changed page that
+        # still fits is written over its old copy.
+        for n in range(10):
+            for i in range(0, len(h), paged_history.PAGE_SIZE):
+                h[i]
+                h.changed(i)
+        self.assertEquals(size, h._spillSize)
+
+        # Pages that grow are moved, and the spill file is compacted.
+        for n in range(20):
+            for i in range(0, len(h), paged_history.PAGE_SIZE):
+                h[i].append(n)
+                h.changed(i)
+        used = 0
+        for page in h._pages:
+            used += page.capacity
+        self.failUnless(h._spillSize <= used*2)
+        self.assertEquals([0] + range(20), h[0])
+        self.assertEquals(range(1, paged_history.PAGE_SIZE), map(lambda c:c[0], h[1:paged_history.PAGE_SIZE]))
+
+    def testDelete(self):
+        h = paged_history.PagedHistory(range(250), memoryBudget=1)
+        del h[120:]
+        self.assertEquals(120, len(h))
+        h.append('new')
+        self.assertEquals(range(120) + ['new'], h[:])
+        del h[10:20]
+        self.assertEquals(range(10) + range(20, 120) + ['new'], h[:])
+
+    def testPages(self):
+        h = paged_history.PagedHistory(range(250))
+        pages, dropped = h.getPages(0, 200)
+        self.assertEquals(200, dropped)
+        self.assertEquals([50], map(lambda p:p[0], pages))
+        pages, dropped = h.getPages(0, 20)
+        self.assertEquals(0, dropped)
+
+        copy = paged_history.PagedHistory()
+        copy.appendPages(pages)
+        self.assertEquals(range(250), copy[:])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+# run_length_listTest.py
+# The Raskin Center for Humane Interfaces (RCHI) 2005
+
+# This work is licensed under the Creative Commons
+# Attribution-NonCommercial-ShareAlike License. To view 
+# a copy of this license, visit 
+# http://creativecommons.org/licenses/by-nc-sa/2.0/ 
+
+# or send a letter to :
+
+# Creative Commons
+# 559 Nathan Abbott Way
+# Stanford, California 94305, 
+# USA.
+# --- --- ---
+
+import unittest
+import random
+import run_length_list
+from run_length_list import RLE_List
+
+class RLE_ListTest(unittest.TestCase):
+    def assertSameList(self, expected, rle):
+        self.assertEquals(len(expected), len(rle))
+        self.assertEquals(expected, rle.toList())
+        for i in range(len(expected)):
+            self.assertEquals(expected[i], rle[i])
+        # adjacent runs never hold the same value
+        runs = rle.getRuns()
+        for k in range(1, len(runs)):
+            self.assertNotEqual(runs[k-1][1], runs[k][1])
+
+    def testCreate(self):
+        rle = RLE_List([1, 1, 2, 2, 2, 1])
+        self.assertEquals([(2, 1), (3, 2), (1, 1)], rle.getRuns())
+        self.assertEquals([(1, 1), (2, 2)], rle.getRuns(1, 4))
+        self.assertEquals(2, rle[-2])
+        self.assertRaises(IndexError, lambda: rle[6])
+
+    def testGetRunAt(self):
+        rle = RLE_List()
+        rle.insertRuns(0, [(2, 1), (3, 2), (0, 5), (1, 2)])
+        self.assertEquals([(2, 1), (4, 2)], rle.getRuns())
+        self.assertEquals((0, 2, 1), rle.getRunAt(1))
+        self.assertEquals((2, 6, 2), rle.getRunAt(2))
+        self.assertEquals((2, 6, 2), rle.getRunAt(5))
+
+    def testSetRange(self):
+        rle = RLE_List([0] * 10)
+        rle.setRange(2, 5, 1)
+        self.assertSameList([0, 0, 1, 1, 1, 0, 0, 0, 0, 0], rle)
+        rle.setRange(5, 20, 1)
+        self.assertSameList([0, 0, 1, 1, 1, 1, 1, 1, 1, 1], rle)
+        rle.setRange(0, 10, 3)
+        self.assertEquals([(10, 3)], rle.getRuns())
+
+    def testInsertAndDelete(self):
+        rle = RLE_List()
+        rle.insert(0, 5, 3)
+        rle.insert(3, 6, 2)
+        rle.insert(1, 5)
+        rle.insert(100, 6)
+        self.assertSameList([5, 5, 5, 5, 6, 6, 6], rle)
+        rle.insertList(2, [7, 5, 5])
+        self.assertSameList([5, 5, 7, 5, 5, 5, 5, 6, 6, 6], rle)
+        rle.delete(2, 3)
+        self.assertSameList([5, 5, 5, 5, 5, 5, 6, 6, 6], rle)
+        rle.replaceList(7, [1, 2, 3])
+        self.assertSameList([5, 5, 5, 5, 5, 5, 6, 1, 2, 3], rle)
+
+    def testRandomEdits(self):
+        self.randomEdits(random.Random(1))
+
+    def testRandomEditsInChunks(self):
+        # With tiny chunks, most edits span several chunks and change their
+        # number.
+        oldRunsPerChunk = run_length_list.RUNS_PER_CHUNK
+        run_length_list.RUNS_PER_CHUNK = 2
+        try:
+            self.randomEdits(random.Random(2))
+        finally:
+            run_length_list.RUNS_PER_CHUNK = oldRunsPerChunk
+
+    def randomEdits(self, rand):
+        expected = []
+        rle = RLE_List()
+        for n in range(2000):
+            i = rand.randint(0, len(expected))
+            j = rand.randint(i, len(expected))
+            value = rand.randint(0, 3)
+            operation = rand.randint(0, 3)
+            if operation == 0:
+                count = rand.randint(1, 5)
+                expected[i:i] = [value] * count
+                rle.insert(i, value, count)
+            elif operation == 1:
+                values = [rand.randint(0, 3) for k in range(rand.randint(0, 5))]
+                expected[i:i] = values
+                rle.insertList(i, values)
+            elif operation == 2:
+                expected[i:j] = [value] * (j-i)
+                rle.setRange(i, j, value)
+            else:
+                del expected[i:j]
+                rle.delete(i, j)
+            if n % 100 == 0:
+                self.assertSameList(expected, rle)
+        self.assertSameList(expected, rle)
+
+if __name__ == '__main__':
+    unittest.main()
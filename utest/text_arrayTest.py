@@ -0,0 +1,154 @@
+# text_arrayTest.py
+# The Raskin Center for Humane Interfaces (RCHI) 2005
+
+# This work is licensed under the Creative Commons
+# Attribution-NonCommercial-ShareAlike License. To view 
+# a copy of this license, visit 
+# http://creativecommons.org/licenses/by-nc-sa/2.0/ 
+
+# or send a letter to :
+
+# Creative Commons
+# 559 Nathan Abbott Way
+# Stanford, California 94305, 
+# USA.
+# --- --- ---
+
+import unittest
+import text_array
+
+class TextArrayTest(unittest.TestCase):
+    def testAddText(self):
+        a = text_array.TextArray('')
+        self.assertEquals(0, a.getLength())
+        a.addText('world')
+        a.addText('hello ', 0)
+        a.addText('!')
+        self.assertEquals(12, a.getLength())
+        self.assertEquals(u'hello world!', a.getSubString(0, 11))
+        a.addText('big ', 6)
+        self.assertEquals(u'hello big world!', a.getSubString(0, 15))
+        self.assert_(a.wasTouched())
+        self.failIf(a.wasTouched())
+
+    def testDelText(self):
+        a = text_array.TextArray('hello big world')
+        a.delText(6, 9)
+        self.assertEquals(u'hello world', a.getSubString(0, a.getLength()-1))
+        a.delText(-5, 0)
+        self.assertEquals(u'ello world', a.getSubString(0, a.getLength()-1))
+        a.delText(8, 100)
+        self.assertEquals(u'ello wor', a.getSubString(0, a.getLength()-1))
+        a.delText(3, 2)
+        self.assertEquals(8, a.getLength())
+
+    def testGetCharAcrossGap(self):
+        a = text_array.TextArray('abcdef')
+        a.addText('XY', 3)
+        text = u'abcXYdef'
+        for i in range(len(text)):
+            self.assertEquals(text[i], a.getChar(i))
+        self.assertEquals(u'', a.getChar(len(text)))
+        self.assertEquals(u'cXYd', a.getSubString(2, 5))
+        self.assertEquals(u'ef', a.getSubString(6, 20))
+
+    def testFind(self):
+        a = text_array.TextArray('one two one')
+        a.addText(' three', 7)
+        self.assertEquals(u'one two three one', a.getSubString(0, a.getLength()-1))
+        self.assertEquals(0, a.raw_find('one'))
+        self.assertEquals(14, a.raw_rfind('one', 0, a.getLength()))
+        self.assertEquals(8, a.find('three', 0))
+        a.delText(0, 3)
+        self.assertEquals(4, a.find('three', 0))
+
+    def testLeapFind(self):
+        a = text_array.TextArray('Hello world! Say HELLO to 1 friend.')
+        self.assertEquals(0, a.find('hello', 0))
+        self.assertEquals(17, a.find('hello', 1))
+        self.assertEquals(17, a.find('HELLO', 0))
+        self.assertEquals(-1, a.find('HELLO', 18))
+        self.assertEquals(10, a.find('d1', 0))
+        self.assertEquals(26, a.find('1', 12))
+        self.assertEquals(11, a.find('1', 20, 0))
+        self.assertEquals(17, a.find('hello', 30, 0))
+        self.assertEquals(0, a.find('hello', 21, 0))
+
+    def testIncrementalLeapFind(self):
+        a = text_array.TextArray('abc abd abe abd')
+        self.assertEquals(0, a.find('a', 0))
+        self.assertEquals(0, a.find('ab', 0))
+        self.assertEquals(4, a.find('abd', 0))
+        self.assertEquals(-1, a.find('abdx', 0))
+        self.assertEquals(0, a.find('ab', 0))
+        self.assertEquals(12, a.find('abd', 15, 0))
+        self.assertEquals(4, a.find('abd', 14, 0))
+        a.addText('abd ', 0)
+        self.assertEquals(0, a.find('abd', 0))
+
+    def testFindAll(self):
+        a = text_array.TextArray('aaaa Ab ab AB aB')
+        self.assertEquals([5, 8, 11, 14], list(a.findAll('ab')))
+        self.assertEquals([0, 2], list(a.findAll('aa')))
+        self.assertEquals([11], list(a.findAll('AB')))
+        self.assertEquals([5, 8], list(a.findAll('ab', 1, 12)))
+        self.assertEquals(4, a.countAll('ab'))
+        self.assertEquals(0, a.countAll(''))
+
+    def testLeapFindMatchesBMHSearch(self):
+        import random
+        import bmh_search
+        rand = random.Random(2)
+        text = u''.join([rand.choice(u'aAbB1!;:') for i in range(400)])
+        a = text_array.TextArray(text)
+        for i in range(300):
+            pattern = u''.join([rand.choice(u'aAbB1!;:') for k in range(rand.randint(1, 4))])
+            start = rand.randint(0, len(text))
+            for k in range(1, len(pattern)+1):
+                self.assertEquals(bmh_search.BMHSearchForward(text, pattern[:k], start), a.find(pattern[:k], start))
+                self.assertEquals(bmh_search.BMHSearchBackward(text, pattern[:k], 0, start), a.find(pattern[:k], start, 0))
+
+    def testSearchWindows(self):
+        import random
+        import bmh_search
+        import leap_search
+        oldWindows = leap_search.SEARCH_WINDOW, leap_search.FIND_ALL_WINDOW
+        leap_search.SEARCH_WINDOW, leap_search.FIND_ALL_WINDOW = 4, 5
+        try:
+            rand = random.Random(3)
+            text = u''.join([rand.choice(u'aAb \n') for i in range(300)])
+            a = text_array.TextArray(text[:150])
+            a.addText(text[150:])
+            for i in range(200):
+                pattern = u''.join([rand.choice(u'aAb \n') for k in range(rand.randint(1, 6))])
+                start = rand.randint(0, len(text))
+                end = rand.randint(start, len(text))
+                self.assertEquals(bmh_search.BMHSearchForward(text, pattern, start), a.find(pattern, start))
+                self.assertEquals(bmh_search.BMHSearchBackward(text, pattern, 0, start), a.find(pattern, start, 0))
+                self.assertEquals(text.find(pattern, start, end), a.raw_find(pattern, start, end))
+                self.assertEquals(text.rfind(pattern, start, end), a.raw_rfind(pattern, start, end))
+
+                expected = []
+                pos = bmh_search.BMHSearchForward(text, pattern, start, end)
+                while pos <> -1:
+                    expected.append(pos)
+                    pos = bmh_search.BMHSearchForward(text, pattern, pos+len(pattern), end)
+                self.assertEquals(expected, list(a.findAll(pattern, start, end)))
+        finally:
+            leap_search.SEARCH_WINDOW, leap_search.FIND_ALL_WINDOW = oldWindows
+
+    def testManyEdits(self):
+        a = text_array.TextArray('')
+        reference = u''
+        for i in range(3000):
+            pos = (i * 7) % (len(reference) + 1)
+            a.addText(str(i % 10), pos)
+            reference = reference[:pos] + unicode(i % 10) + reference[pos:]
+            if i % 3 == 0:
+                a.delText(pos / 2, pos / 2 + 1)
+                reference = reference[:pos/2] + reference[pos/2+2:]
+        self.assertEquals(len(reference), a.getLength())
+        self.assertEquals(reference, a.getSubString(0, a.getLength()-1))
+
+if __name__ == '__main__':
+    unittest.main()
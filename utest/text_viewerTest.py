@@ -0,0 +1,53 @@
+# text_viewerTest.py
+# The Raskin Center for Humane Interfaces (RCHI) 2005
+
+# This work is licensed under the Creative Commons
+# Attribution-NonCommercial-ShareAlike License. To view 
+# a copy of this license, visit 
+# http://creativecommons.org/licenses/by-nc-sa/2.0/ 
+
+# or send a letter to :
+
+# Creative Commons
+# 559 Nathan Abbott Way
+# Stanford, California 94305, 
+# USA.
+# --- --- ---
+
+# These tests need pygame; testUtil initializes Archy with the stock document.
+
+import unittest
+import testUtil
+from archy_state import archyState
+
+class TextViewerTest(unittest.TestCase):
+    def assertGlyphsMatchText(self, viewer):
+        document = viewer.document
+        pos = viewer.firstGlyphPosition
+        line = viewer.startLine
+        while line <> None:
+            for glyph in line._glyphs:
+                self.assertEquals(document.getChar(pos), glyph._char)
+                if isinstance(getattr(glyph, '_style', None), int):
+                    self.assertEquals(document.styleArray.getCharStyle(pos), glyph._style)
+                pos += 1
+            line = line.Next
+        self.assertEquals(viewer.lastGlyphPosition, pos - 1)
+
+    def testStyleChangeBeforeGlyphs(self):
+        mT = archyState.mainText
+        tv = archyState.mainTextViewer
+        mT.setCursor(mT.getLength() / 2)
+        tv.render()
+        fGP = tv.firstGlyphPosition
+        self.failUnless(fGP > 20)
+
+        # The range starts before the glyphs; the text doesn't move, so the
+        # glyphs must still be those of the text at their positions.
+        mT.setStyle(archyState.stylePool.newStyle(bold=1), fGP-20, fGP+300)
+        tv.render()
+        self.assertEquals(fGP, tv.firstGlyphPosition)
+        self.assertGlyphsMatchText(tv)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+# word_wrapTest.py
+# The Raskin Center for Humane Interfaces (RCHI) 2005
+
+# This work is licensed under the Creative Commons
+# Attribution-NonCommercial-ShareAlike License. To view
+# a copy of this license, visit
+# http://creativecommons.org/licenses/by-nc-sa/2.0/
+
+# or send a letter to :
+
+# Creative Commons
+# 559 Nathan Abbott Way
+# Stanford, California 94305,
+# USA.
+# --- --- ---
+
+import unittest
+import word_wrap
+
+def wrap(text, maxWidth, widths=None):
+    if widths == None:
+        widths = [1] * len(text)
+    breaks = word_wrap.lineBreaks(widths, list(text), maxWidth)
+    lines = []
+    start = 0
+    for end in breaks:
+        lines.append(text[start:end])
+        start = end
+    return lines
+
+class WordWrapTest(unittest.TestCase):
+    def testWords(self):
+        self.assertEquals(['hello ', 'world'], wrap('hello world', 8))
+        self.assertEquals(['ab cd ', 'ef'], wrap('ab cd ef', 6))
+        self.assertEquals(['ab ', ' cd'], wrap('ab  cd', 3))
+
+    def testLongWord(self):
+        self.assertEquals(['abcde', 'fghij'], wrap('abcdefghij', 5))
+        self.assertEquals(['a ', 'bcdefg', 'h'], wrap('a bcdefgh', 6))
+
+    def testNewlines(self):
+        self.assertEquals(['ab\n', '\n', 'cd ', 'ef\n'], wrap('ab\n\ncd ef\n', 5))
+        self.assertEquals(['abcde', '\n'], wrap('abcde\n', 5))
+
+    def testWideGlyph(self):
+        self.assertEquals(['a', 'B', 'c'], wrap('aBc', 5, [1, 9, 1]))
+        self.assertEquals(['a\n', '', 'B', 'c'], wrap('a\nBc', 5, [1, 1, 9, 1]))
@@ -0,0 +1,108 @@
+# word_wrap.py
+# The Raskin Center for Humane Interfaces (RCHI) 2005
+
+# This work is licensed under the Creative Commons
+# Attribution-NonCommercial-ShareAlike License. To view
+# a copy of this license, visit
+# http://creativecommons.org/licenses/by-nc-sa/2.0/
+
+# or send a letter to :
+
+# Creative Commons
+# 559 Nathan Abbott Way
+# Stanford, California 94305,
+# USA.
+# --- --- ---
+
+# This module implements the paragraph wrap engine used by the TextViewer
+# (see TextViewer.addGlyphsWordwrap in text_viewer.py).
+
+# Instead of moving glyphs from line to line one at a time, the engine
+# finds where all of the lines of a paragraph break at once. The prefix
+# sums of the glyph widths make the width of any run of glyphs a
+# subtraction, so the glyph that makes a line too wide is found with a
+# binary search in the prefix sums, and the word to break the line at with
+# a binary search in the sorted positions of the spaces and tabs.
+
+# The lines are broken by the same rules as the glyph by glyph wrapping:
+
+# - A line ends after a newline character.
+# - A glyph that would make its line wider than the maximum width starts a
+#   new line. If the line has a space or tab before the glyph, the word
+#   following the last space or tab starts the new line instead.
+# - A line started by a width break always holds its first glyph, even if
+#   that glyph alone is wider than the maximum width. A glyph that wide at
+#   the start of the paragraph, or after a newline, is put after an empty
+#   line.
+
+# NumPy is used for the prefix sums when it is available.
+
+import bisect
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def _prefixSums(widths):
+    if numpy is not None:
+        sums = numpy.zeros(len(widths)+1, numpy.int64)
+        numpy.cumsum(widths, out=sums[1:])
+        return sums
+    sums = [0] * (len(widths)+1)
+    total = 0
+    for i in range(len(widths)):
+        total += widths[i]
+        sums[i+1] = total
+    return sums
+
+# The following function returns the first index i, no less than lo, for
+# which sums[i] > value.
+
+def _findOverflow(sums, value, lo):
+    if numpy is not None:
+        return max(lo, int(numpy.searchsorted(sums, value, 'right')))
+    return bisect.bisect_right(sums, value, lo)
+
+# The following function returns the line breaks of a paragraph, given the
+# widths and characters of its glyphs, as the list of the indices (one past
+# the last glyph) at which each line ends. The last index is the number of
+# glyphs.
+
+def lineBreaks(widths, chars, maxWidth):
+    glyphCount = len(widths)
+    sums = _prefixSums(widths)
+    spaces = []
+    newlines = []
+    for i in range(glyphCount):
+        if chars[i] in [' ', '\t']:
+            spaces.append(i)
+        elif chars[i] == '\n':
+            newlines.append(i)
+
+    breaks = []
+    start = 0
+    forced = 0
+    while start < glyphCount:
+
+# The glyph at 'overflow' is the first one that doesn't fit on the line; a
+# forced line holds its first glyph even though it doesn't fit.
+
+        overflow = _findOverflow(sums, sums[start] + maxWidth, start + 1 + forced) - 1
+
+        n = bisect.bisect_left(newlines, start)
+        if n < len(newlines) and newlines[n] < overflow:
+            end = newlines[n] + 1
+            forced = 0
+        elif overflow >= glyphCount:
+            end = glyphCount
+        else:
+            end = overflow
+            s = bisect.bisect_left(spaces, overflow) - 1
+            if s >= 0 and spaces[s] >= start and spaces[s] < overflow - 1:
+                end = spaces[s] + 1
+            forced = 1
+
+        breaks.append(end)
+        start = end
+    return breaks